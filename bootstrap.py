@@ -0,0 +1,161 @@
+import xarray as xr
+import numpy as np
+from ncf_funct import zonal_mean, difference
+from segments import group_year_mean
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# moving-block bootstrap significance for trends and model-reanalysis differences.
+# year indices are resampled once and applied to every (season, plev, lat) point as a single
+# matrix product over the year axis, so no per-gridpoint loop or linregress call is needed.
+# the percentile bootstrap is anti-conservative for short records (about 9% rejections of a true
+# null at alpha = 0.05 for 35 years of white noise), so by default (small_sample = True) the
+# bootstrap standard error is bias-corrected (variance_correction) and p-values and intervals use
+# Student-t quantiles with the effective number of years: about 5.7% rejections for white noise
+# and 10% for lag-1 autocorrelation 0.3 (14% uncorrected). tests/test_bootstrap.py checks the size.
+
+def block_indices(n, n_boot = 1000, block_length = None, seed = 0):
+    # (n_boot, n) resampled year indices built from overlapping blocks
+    if block_length is None:
+        block_length = max(2, int(round(n ** (1/3))))
+    block_length = min(block_length, n)
+    rng = np.random.default_rng(seed)
+    n_blocks = int(np.ceil(n / block_length))
+    starts = rng.integers(0, n - block_length + 1, size = (n_boot, n_blocks))
+    idx = starts[:, :, None] + np.arange(block_length)
+    return idx.reshape(n_boot, -1)[:, :n]
+
+def resample_matrix(idx, weights):
+    # (n, n_boot) matrix W with x @ W[:, b] = sum_j weights[j] * x[idx[b, j]]
+    n_boot, n = idx.shape
+    matrix = np.zeros((n, n_boot))
+    np.add.at(matrix, (idx, np.broadcast_to(np.arange(n_boot)[:, None], idx.shape)), np.broadcast_to(weights, idx.shape))
+    return matrix
+
+def variance_correction(matrix, weights):
+    # ratio of the true to the expected bootstrap variance of the statistic (weights @ y) for iid
+    # residuals. residuals about the fit and the overlapping blocks shrink the bootstrap spread
+    # (to about 0.83x for n = 35 and blocks of 3); the ratio depends only on the design, not the data
+    n = len(weights)
+    t = np.arange(n) - (n - 1) / 2
+    design = np.stack([np.ones(n), t], axis = 1)
+    projection = np.eye(n) - design @ np.linalg.pinv(design) # data -> residuals
+    centered = matrix - matrix.mean(axis = 1, keepdims = True)
+    expected = np.trace(projection @ (centered @ centered.T / matrix.shape[1]) @ projection)
+    return (weights @ weights) / expected
+
+def _bootstrap(y, matrix, kind, alpha, max_points, correction):
+    # y (..., n) -> (..., 4) stacked [statistic, pvalue, lower, upper]
+    from scipy.stats import t as student_t
+    n = y.shape[-1]
+    t = np.arange(n) - (n - 1) / 2
+    shape = y.shape[:-1]
+    y = y.reshape(-1, n)
+    out = np.full((y.shape[0], 4), np.nan)
+
+    for start in range(0, y.shape[0], max_points): # bound the (points, n_boot) working array
+        block = y[start:start + max_points]
+        ybar = block.mean(axis = -1, keepdims = True)
+        slope = (block - ybar) @ t / (t @ t)
+        residual = block - ybar - slope[:, None] * t
+        statistic = slope if kind == 'trend' else ybar[:, 0]
+
+        null = residual @ matrix # bootstrap spread about the statistic
+        if correction is None:
+            pvalue = (1 + (np.abs(null) >= np.abs(statistic)[:, None]).sum(axis = -1)) / (matrix.shape[1] + 1)
+            lower, upper = statistic + np.quantile(null, [alpha / 2, 1 - alpha / 2], axis = -1)
+        else:
+            # bias-corrected bootstrap standard error and Student-t quantiles with the effective
+            # number of years n (1 - r1) / (1 + r1), r1 the lag-1 autocorrelation of the residuals
+            se = null.std(axis = -1) * np.sqrt(correction)
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                r1 = (residual[:, 1:] * residual[:, :-1]).sum(axis = -1) / (residual ** 2).sum(axis = -1)
+                df = np.clip(n * (1 - r1) / (1 + r1), 3, n) - 2
+                pvalue = 2 * student_t.sf(np.abs(statistic / se), df)
+            half = student_t.ppf(1 - alpha / 2, df) * se
+            lower, upper = statistic - half, statistic + half
+        missing = np.isnan(statistic) # e.g. model levels below ground, never significant
+        pvalue, lower, upper = [np.where(missing, np.nan, value) for value in [pvalue, lower, upper]]
+        out[start:start + max_points] = np.stack([statistic, pvalue, lower, upper], axis = -1)
+
+    return out.reshape(shape + (4,))
+
+def _bootstrap_xr(da, dim, kind, n_boot, block_length, seed, alpha, max_points, small_sample):
+    n = da.sizes[dim]
+    idx = block_indices(n, n_boot, block_length, seed)
+    t = np.arange(n) - (n - 1) / 2
+    weights = t / (t @ t) if kind == 'trend' else np.full(n, 1 / n)
+    matrix = resample_matrix(idx, weights)
+    correction = variance_correction(matrix, weights) if small_sample else None
+
+    stats = xr.apply_ufunc(_bootstrap, da.chunk({dim: -1}) if da.chunks else da,
+                           input_core_dims = [[dim]],
+                           output_core_dims = [['stat']],
+                           kwargs = {'matrix': matrix, 'kind': kind, 'alpha': alpha, 'max_points': max_points, 'correction': correction},
+                           dask = 'parallelized',
+                           dask_gufunc_kwargs = {'output_sizes': {'stat': 4}},
+                           output_dtypes = [float])
+    name = 'trend' if kind == 'trend' else 'mean'
+    return xr.Dataset({name: stats.isel(stat = 0),
+                       'pvalue': stats.isel(stat = 1),
+                       'lower': stats.isel(stat = 2),
+                       'upper': stats.isel(stat = 3)})
+
+def bootstrap_trend(da, dim = 'year', n_boot = 1000, block_length = None, seed = 0, alpha = 0.05, max_points = 10000, small_sample = True):
+    # trend per year (K/year) with block-bootstrap p-value and confidence interval
+    # of the residuals about the linear fit, at every point of da
+    return _bootstrap_xr(da, dim, 'trend', n_boot, block_length, seed, alpha, max_points, small_sample)
+
+def bootstrap_mean(da, dim = 'year', n_boot = 1000, block_length = None, seed = 0, alpha = 0.05, max_points = 10000, small_sample = True):
+    # mean with block-bootstrap p-value (H0: mean = 0) and confidence interval,
+    # resampling detrended anomalies so the trend does not inflate the spread
+    return _bootstrap_xr(da, dim, 'mean', n_boot, block_length, seed, alpha, max_points, small_sample)
+
+def annual_series(xrds, lon, time, variable):
+    # (plev, lat, year) annual zonal means
+    return group_year_mean(zonal_mean(xrds[[variable]], lon), time)
+
+def seasonal_series(xrds, lon, time, variable):
+    # (plev, lat, season, year) seasonal zonal means, every season and year in one pass
+    return group_year_mean(zonal_mean(xrds[[variable]], lon), time, 'season')
+
+def per_decade(stats):
+    # convert /year to /decade, p-values are unchanged
+    for name in ['trend', 'lower', 'upper']:
+        stats[name] = stats[name] * 10
+    return stats
+
+def trend_significance(model_xrds, rean_xrds, lon, time, variable, n_boot = 1000, block_length = None, seed = 0):
+    # p-values and confidence intervals (K/decade) of model trends and of model - reanalysis
+    # trend differences, annual and for all seasons, with one set of resampled years
+    sig = {}
+    for kind, series in [('annual', annual_series), ('seasonal', seasonal_series)]:
+        model = series(model_xrds, lon, time, variable)[variable]
+        rean = series(rean_xrds, lon, time, variable)[variable]
+        diff = difference(model, rean)
+        sig[f'{kind}_model'] = per_decade(bootstrap_trend(model, n_boot = n_boot, block_length = block_length, seed = seed))
+        sig[f'{kind}_diff'] = per_decade(bootstrap_trend(diff, n_boot = n_boot, block_length = block_length, seed = seed))
+    return sig
+
+def difference_significance(model_xrds, rean_xrds, lon, time, variable, n_boot = 1000, block_length = None, seed = 0):
+    # p-values and confidence intervals of model - reanalysis mean differences, annual and seasonal
+    sig = {}
+    for kind, series in [('annual', annual_series), ('seasonal', seasonal_series)]:
+        model = series(model_xrds, lon, time, variable)[variable]
+        rean = series(rean_xrds, lon, time, variable)[variable]
+        sig[f'{kind}_diff'] = bootstrap_mean(difference(model, rean), n_boot = n_boot, block_length = block_length, seed = seed)
+    return sig
+
+def stipple(pvalue, ax, alpha = 0.05):
+    # hatch points that are not significant at level alpha
+    xr.plot.contourf(pvalue,
+            x = 'lat',
+            y = 'plev',
+            yincrease = False,
+            levels = [alpha, 1],
+            hatches = ['..'],
+            colors = 'none',
+            add_colorbar = False,
+            add_labels = False,
+            yscale = 'log',
+            ylim = (1000, 1),
+            ax = ax)
@@ -0,0 +1,459 @@
+import os
+import json
+import base64
+import asyncio
+import threading
+import itertools
+import weakref
+import time as timer
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+import xarray as xr
+from zarr.abc.store import Store, RangeByteRequest, OffsetByteRequest, SuffixByteRequest
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# concurrent readahead chunk store for remote zarr (the CMIP6 stores on GCS, or kerchunk references
+# into remote files, see refs.py). Chunks are fetched by a pool of `concurrency` threads with plain
+# HTTP (range) requests, a key already in flight is never requested twice, and byte ranges of the
+# same file closer than max_gap are merged into one request. plan_reads() walks the dask graph of
+# a result in dask's own execution order (dask.order) and the store keeps the next `readahead`
+# chunks of that order in flight while the current ones are reduced, e.g.
+#   xrds = open_remote('gs://cmip6/CMIP6/CMIP/NASA-GISS/GISS-E2-1-G/historical/r1i1p1f1/Amon/ta/gn/v20180827/')
+#   zonal = compute(xrds['ta'].mean(dim = 'lon'))
+# benchmark() compares it against plain sequential fetches on a local server with injected latency.
+
+CONCURRENCY = 16 # simultaneous requests
+READAHEAD = 32 # chunks kept in flight ahead of the one being read
+MAX_GAP = 64 * 1024 # bytes, ranges of one file closer than this are read in one request
+MAX_REQUEST = 16 * 2**20 # bytes, upper size of a merged request
+CACHE_BYTES = 512 * 2**20 # fetched chunks kept in memory
+RETRIES = 3
+
+_OPEN = weakref.WeakSet() # stores opened in this session, searched by plan_reads
+
+def http_url(url):
+    # gs://bucket/path -> public https url, anything else unchanged
+    if url.startswith('gs://'):
+        return 'https://storage.googleapis.com/' + url[len('gs://'):]
+    return url
+
+def read_range(url, start = None, stop = None, timeout = 60):
+    # bytes [start, stop) of a remote (http) or local file, the whole object if start is None;
+    # None if it does not exist
+    if not url.startswith(('http://', 'https://')):
+        path = url[len('file://'):] if url.startswith('file://') else url
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            f.seek(start or 0)
+            return f.read() if stop is None else f.read(stop - (start or 0))
+
+    request = urllib.request.Request(url)
+    if start is not None:
+        request.add_header('Range', f'bytes={start}-{stop - 1}')
+    for attempt in range(RETRIES):
+        try:
+            with urllib.request.urlopen(request, timeout = timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code in (403, 404):
+                return None
+            if attempt == RETRIES - 1 or e.code < 500:
+                raise
+        except (urllib.error.URLError, ConnectionError, TimeoutError):
+            if attempt == RETRIES - 1:
+                raise
+        timer.sleep(0.1 * 2**attempt)
+
+def coalesce(ranges, max_gap = MAX_GAP, max_request = MAX_REQUEST):
+    # [(start, stop), ...] of one file -> [(start, stop, [positions]), ...] with ranges closer than
+    # max_gap merged, max_gap < 0 keeps one request per range
+    blocks = []
+    for position in sorted(range(len(ranges)), key = lambda i: ranges[i]):
+        start, stop = ranges[position]
+        if blocks and max_gap >= 0 and start - blocks[-1][1] <= max_gap and max(stop, blocks[-1][1]) - blocks[-1][0] <= max_request:
+            blocks[-1][1] = max(stop, blocks[-1][1])
+            blocks[-1][2].append(position)
+        else:
+            blocks.append([start, stop, [position]])
+    return [tuple(block) for block in blocks]
+
+def _slice(data, byte_range):
+    if byte_range is None:
+        return data
+    if isinstance(byte_range, RangeByteRequest):
+        return data[byte_range.start:byte_range.end]
+    if isinstance(byte_range, OffsetByteRequest):
+        return data[byte_range.offset:]
+    if isinstance(byte_range, SuffixByteRequest):
+        return data[len(data) - byte_range.suffix:]
+    raise TypeError(f'unknown byte range {byte_range}')
+
+class ReadaheadStore(Store):
+    # read-only zarr store over a url (one object per key) or kerchunk references (byte ranges)
+
+    def __init__(self, url = None, references = None, concurrency = CONCURRENCY, readahead = READAHEAD,
+                 max_gap = MAX_GAP, cache_bytes = CACHE_BYTES):
+        super().__init__(read_only = True)
+        if isinstance(references, str):
+            with open(references) as f:
+                references = json.load(f)
+        if references is not None:
+            references = references.get('refs', references)
+        self.url = http_url(url).rstrip('/') if url else None
+        self.references = references
+        self.concurrency = concurrency
+        self.readahead = readahead
+        self.max_gap = max_gap
+        self.cache_bytes = cache_bytes
+        self.order = []
+        self.position = {}
+        self.arrays = {} # dask name -> (zarr path, dask chunks)
+        self.stats = {'requests': 0, 'bytes': 0, 'hits': 0}
+        self._pool = ThreadPoolExecutor(concurrency)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._cache = OrderedDict()
+        self._cached = 0
+        _OPEN.add(self)
+
+    def __eq__(self, other):
+        return self is other
+
+    def __hash__(self):
+        return id(self)
+
+    def __repr__(self):
+        return f'ReadaheadStore({self.url or "references"}, concurrency = {self.concurrency}, readahead = {self.readahead})'
+
+    @property
+    def supports_writes(self):
+        return False
+
+    @property
+    def supports_deletes(self):
+        return False
+
+    @property
+    def supports_listing(self):
+        return True
+
+    # fetching
+
+    def _location(self, key):
+        # (url, start, stop) of a key, or the bytes themselves for inline references
+        if self.references is None:
+            return f'{self.url}/{key}', None, None
+        ref = self.references.get(key)
+        if ref is None or isinstance(ref, (str, bytes)):
+            if isinstance(ref, str):
+                ref = base64.b64decode(ref[len('base64:'):]) if ref.startswith('base64:') else ref.encode()
+            return ref, None, None
+        if len(ref) == 1:
+            return http_url(ref[0]), None, None
+        return http_url(ref[0]), ref[1], ref[1] + ref[2]
+
+    def _store(self, key, data):
+        # called with the lock held
+        self._cache[key] = data
+        self._cached += len(data or b'')
+        while self._cached > self.cache_bytes and len(self._cache) > 1:
+            old, value = self._cache.popitem(last = False)
+            self._cached -= len(value or b'')
+
+    def _request(self, keys):
+        # futures of keys, fetching the ones neither cached nor in flight; ranges of one file
+        # are merged into as few requests as max_gap allows
+        futures = {}
+        ranged = {}
+        with self._lock:
+            for key in keys:
+                if key in futures:
+                    continue
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    futures[key] = Future()
+                    futures[key].set_result(self._cache[key])
+                    continue
+                if key in self._pending:
+                    futures[key] = self._pending[key]
+                    continue
+                url, start, stop = self._location(key)
+                future = futures[key] = Future()
+                if url is None or isinstance(url, bytes):
+                    self._store(key, url)
+                    future.set_result(url)
+                elif start is None:
+                    self._pending[key] = future
+                    self._pool.submit(self._fetch, url, None, None, [(key, None, None)])
+                else:
+                    self._pending[key] = future
+                    ranged.setdefault(url, []).append((key, start, stop))
+
+        for url, parts in ranged.items():
+            for start, stop, positions in coalesce([(s, e) for _, s, e in parts], self.max_gap):
+                self._pool.submit(self._fetch, url, start, stop, [parts[i] for i in positions])
+        return futures
+
+    def _fetch(self, url, start, stop, parts):
+        # one request, split into the keys it covers
+        try:
+            data = read_range(url, start, stop)
+        except Exception as e:
+            with self._lock:
+                for key, _, _ in parts:
+                    self._pending.pop(key).set_exception(e)
+            return
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += len(data or b'')
+            for key, s, e in parts:
+                value = data if s is None or data is None else data[s - start:e - start]
+                self._store(key, value)
+                self._pending.pop(key).set_result(value)
+
+    def _window(self, key):
+        # the key and the next readahead keys of the planned order, topped up half a window at a
+        # time so that neighbouring chunks go out together and can be coalesced
+        i = self.position.get(key)
+        if i is None or self.readahead <= 0:
+            return [key]
+        ahead = self.order[i + 1:i + 1 + self.readahead]
+        with self._lock:
+            middle = ahead[len(ahead) // 2] if ahead else None
+            if middle in self._cache or middle in self._pending:
+                return [key]
+        return [key] + ahead
+
+    def fetch(self, key):
+        # blocking read of one key (metadata)
+        return self._request([key])[key].result()
+
+    # zarr store interface
+
+    async def get(self, key, prototype, byte_range = None):
+        with self._lock:
+            hit = key in self._cache
+            self.stats['hits'] += hit
+        future = self._request(self._window(key))[key]
+        data = await asyncio.wrap_future(future)
+        if data is None:
+            return None
+        return prototype.buffer.from_bytes(_slice(data, byte_range))
+
+    async def get_partial_values(self, prototype, key_ranges):
+        return await asyncio.gather(*[self.get(key, prototype, byte_range) for key, byte_range in key_ranges])
+
+    async def exists(self, key):
+        return await asyncio.wrap_future(self._request([key])[key]) is not None
+
+    async def set(self, key, value):
+        self._check_writable()
+
+    async def delete(self, key):
+        self._check_writable()
+
+    def _keys(self):
+        # references, or the metadata keys of a consolidated store
+        if self.references is not None:
+            return list(self.references)
+        metadata = self.fetch('.zmetadata')
+        return ['.zmetadata'] + list(json.loads(metadata)['metadata']) if metadata else []
+
+    async def list(self):
+        for key in self._keys():
+            yield key
+
+    async def list_prefix(self, prefix):
+        for key in self._keys():
+            if key.startswith(prefix):
+                yield key
+
+    async def list_dir(self, prefix):
+        prefix = prefix.rstrip('/') + '/' if prefix else ''
+        seen = set()
+        for key in self._keys():
+            if key.startswith(prefix):
+                child = key[len(prefix):].split('/')[0]
+                if child not in seen:
+                    seen.add(child)
+                    yield child
+
+    # readahead plan
+
+    def register(self, xrds):
+        # remember which dask arrays of a dataset opened from this store are which zarr arrays
+        for name, da in xrds.variables.items():
+            if da.chunks is not None:
+                self.arrays[da.data.name] = (str(name), da.chunks)
+
+    def _zarr_chunks(self, path):
+        # (chunk shape, dimension separator) of a zarr v2 array
+        zarray = json.loads(self.fetch(f'{path}/.zarray'))
+        return zarray['chunks'], zarray.get('dimension_separator', '.')
+
+    def plan(self, result):
+        # zarr chunk keys in the order dask will compute the tasks reading them
+        from dask.order import order
+        graph = dict(result.__dask_graph__())
+        priority = order(graph)
+        reads = []
+        for key in graph:
+            if not isinstance(key, tuple) or key[0] not in self.arrays:
+                continue
+            path, chunks = self.arrays[key[0]]
+            zchunks, separator = self._zarr_chunks(path)
+            # zarr chunks covered by this dask block
+            covered = []
+            for i, block_chunks, size in zip(key[1:], chunks, zchunks):
+                start = sum(block_chunks[:i])
+                covered.append(range(start // size, (start + block_chunks[i] - 1) // size + 1))
+            for index in itertools.product(*covered):
+                reads.append((priority[key], f'{path}/' + separator.join(map(str, index)) if index else f'{path}/0'))
+        self.order = list(dict.fromkeys(key for _, key in sorted(reads)))
+        self.position = {key: i for i, key in enumerate(self.order)}
+        return self.order
+
+def open_remote(url = None, references = None, concurrency = CONCURRENCY, readahead = READAHEAD, max_gap = MAX_GAP, **kwargs):
+    # lazy dataset of a remote zarr store (or kerchunk references) read through a ReadaheadStore
+    store = ReadaheadStore(url, references, concurrency, readahead, max_gap)
+    kwargs.setdefault('consolidated', references is None)
+    kwargs.setdefault('zarr_format', 2)
+    xrds = xr.open_zarr(store, **kwargs)
+    store.register(xrds)
+    return xrds
+
+def plan_reads(result):
+    # readahead plan of every open store the result reads from
+    names = {key[0] for key in result.__dask_graph__() if isinstance(key, tuple)}
+    for store in list(_OPEN):
+        if names & set(store.arrays):
+            store.plan(result)
+
+def compute(result, **kwargs):
+    # compute with the reads planned, as result.compute()
+    plan_reads(result)
+    return result.compute(**kwargs)
+
+# stand-in server and benchmark
+
+def serve_directory(root, latency = 0.05):
+    # threaded http server with range requests and latency added to every request, in a
+    # background thread; returns (url, server, counts)
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+    counts = {'requests': 0}
+    lock = threading.Lock()
+
+    class LatencyHandler(SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory = root, **kwargs)
+
+        def do_GET(self):
+            timer.sleep(latency)
+            with lock:
+                counts['requests'] += 1
+            path = self.translate_path(self.path)
+            if not os.path.isfile(path):
+                self.send_error(404)
+                return
+            size = os.path.getsize(path)
+            byte_range = self.headers.get('Range')
+            with open(path, 'rb') as f:
+                if byte_range:
+                    start, stop = byte_range.split('=')[1].split('-')
+                    start, stop = int(start), min(int(stop) + 1, size)
+                    f.seek(start)
+                    data = f.read(stop - start)
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{stop - 1}/{size}')
+                else:
+                    data = f.read()
+                    self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        request_queue_size = 128
+        daemon_threads = True
+
+    server = Server(('localhost', 0), LatencyHandler)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return f'http://localhost:{server.server_address[1]}', server, counts
+
+def _example_store(root, ntime = 96):
+    # (time, plev, lat, lon) float32 zarr v2 store, one chunk per month (~1 MB raw), and the
+    # same chunks packed into one file with kerchunk-style references into it
+    rng = np.random.default_rng(0)
+    lat = np.linspace(-90, 90, 96)
+    field = 250 - 40 * np.cos(np.deg2rad(lat))[None, None, :, None] + rng.normal(0, 2, (ntime, 19, 96, 144))
+    xrds = xr.Dataset({'ta': (('time', 'plev', 'lat', 'lon'), field.astype(np.float32))},
+                      coords = {'time': np.arange(ntime), 'plev': np.geomspace(1000, 1, 19), 'lat': lat, 'lon': np.arange(0, 360, 2.5)})
+    path = f'{root}/example.zarr'
+    xrds.chunk({'time': 1}).to_zarr(path, mode = 'w', zarr_format = 2, consolidated = True)
+
+    refs = {}
+    with open(f'{root}/example.bin', 'wb') as packed:
+        for dirpath, _, files in os.walk(path):
+            for name in sorted(files):
+                key = os.path.relpath(os.path.join(dirpath, name), path)
+                with open(os.path.join(dirpath, name), 'rb') as f:
+                    data = f.read()
+                if name.startswith('.'):
+                    refs[key] = data.decode() # metadata inline, as kerchunk does
+                else:
+                    refs[key] = ['example.bin', packed.tell(), len(data)]
+                    packed.write(data)
+    return xrds, refs
+
+def benchmark(latency = 0.05, ntime = 96, concurrency = CONCURRENCY, readahead = READAHEAD):
+    # wall time and request count of a zonal mean over the stand-in server
+    import tempfile
+    report = {}
+    with tempfile.TemporaryDirectory() as root:
+        local, refs = _example_store(root, ntime)
+        expected = local['ta'].mean(dim = 'lon').values
+        base, server, counts = serve_directory(root, latency)
+        packed = {key: [f'{base}/{ref[0]}', ref[1], ref[2]] if isinstance(ref, list) else ref for key, ref in refs.items()}
+
+        cases = {'sequential': dict(url = f'{base}/example.zarr', concurrency = 1, readahead = 0),
+                 'concurrent': dict(url = f'{base}/example.zarr', concurrency = concurrency, readahead = 0),
+                 'readahead': dict(url = f'{base}/example.zarr', concurrency = concurrency, readahead = readahead),
+                 'references': dict(references = packed, concurrency = concurrency, readahead = readahead, max_gap = -1),
+                 'references coalesced': dict(references = packed, concurrency = concurrency, readahead = readahead)}
+        print(f'{ntime} chunks, {latency * 1e3:.0f} ms latency, dask threads: {os.cpu_count()}')
+        for name, kwargs in cases.items():
+            xrds = open_remote(**kwargs)
+            before = counts['requests']
+            start = timer.perf_counter()
+            zonal = compute(xrds['ta'].mean(dim = 'lon'))
+            elapsed = timer.perf_counter() - start
+            error = float(np.abs(zonal.values - expected).max())
+            report[name] = {'seconds': elapsed, 'requests': counts['requests'] - before, 'error': error}
+            print(f'{name:>22}: {elapsed:6.2f} s, {counts["requests"] - before:4d} requests, max error {error:.1e}')
+
+        # fsspec's default http store, when its aiohttp dependency is installed
+        try:
+            import aiohttp
+        except ImportError:
+            print(f'{"fsspec default":>22}: skipped, needs aiohttp')
+        else:
+            xrds = xr.open_zarr(f'{base}/example.zarr', consolidated = True, zarr_format = 2)
+            before = counts['requests']
+            start = timer.perf_counter()
+            zonal = xrds['ta'].mean(dim = 'lon').compute()
+            elapsed = timer.perf_counter() - start
+            report['fsspec default'] = {'seconds': elapsed, 'requests': counts['requests'] - before,
+                                        'error': float(np.abs(zonal.values - expected).max())}
+            print(f'{"fsspec default":>22}: {elapsed:6.2f} s, {counts["requests"] - before:4d} requests')
+        server.shutdown()
+    return report
+
+if __name__ == '__main__':
+    benchmark()
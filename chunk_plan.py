@@ -0,0 +1,102 @@
+import os
+import numpy as np
+import xarray as xr
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# operation-aware chunking. Every operation needs some dimensions whole inside one chunk
+# (the zonal mean needs lon, detrending/trends/seasonal grouping need time, regridding needs
+# plev and lat). The planner keeps those dimensions unchunked from the source on, splits the
+# others to fill the memory budget, and reports the chunk shape and estimated peak memory,
+# so the pipeline never has to shuffle data between chunks halfway through.
+
+# generic dimensions each operation needs whole
+CORE_DIMS = {'zonal_mean': ['lon'],
+             'area_mean': ['lat', 'lon'],
+             'detrend': ['time'],
+             'trend': ['time'],
+             'season': ['time'],
+             'anomaly': ['time'],
+             'regrid': ['plev', 'lat']}
+
+# dimensions each operation removes
+REDUCES = {'zonal_mean': ['lon'], 'area_mean': ['lat', 'lon'], 'trend': ['time']}
+
+# working copies held per chunk while an operation runs (sorted copy, masks, products ...)
+OVERHEAD = {'zonal_mean': 2, 'area_mean': 2, 'detrend': 6, 'trend': 6, 'season': 6, 'anomaly': 6, 'regrid': 3}
+
+BUDGET = 128 * 2**20 # bytes per chunk
+
+def _bytes(chunks, itemsize):
+    return int(np.prod(list(chunks.values()))) * itemsize
+
+def plan_chunks(sizes, ops, itemsize = 8, budget = BUDGET, names = {}, threads = None):
+    # sizes: {dim: length} in storage order, ops: e.g. ['zonal_mean', 'season', 'trend'],
+    # names maps generic dims to the dataset's names, e.g. {'plev': 'lev'}.
+    # returns ({dim: chunk} for the source, [(op, {dim: chunk}), ...] for every stage)
+    if threads is None:
+        threads = os.cpu_count() or 1
+
+    # dims to keep whole, as many of the ops as the budget allows
+    whole = []
+    for op in ops:
+        need = [names.get(dim, dim) for dim in CORE_DIMS.get(op, [])]
+        need = [dim for dim in need if dim in sizes and dim not in whole]
+        if _bytes({dim: sizes[dim] for dim in whole + need}, itemsize) > budget:
+            print(f'chunk plan: {op} needs {need} whole, over budget, rechunking at that step')
+            break
+        whole += need
+
+    # split the others to fill the budget, trailing (contiguous) dims first
+    chunks = {dim: sizes[dim] if dim in whole else 1 for dim in sizes}
+    for dim in reversed(list(sizes)):
+        if dim in whole:
+            continue
+        rest = _bytes({d: c for d, c in chunks.items() if d != dim}, itemsize)
+        chunks[dim] = int(max(1, min(sizes[dim], budget // rest)))
+
+    # intermediates keep the source chunks of the dims that survive each op;
+    # peak = largest chunk an op reads times its working copies, on every thread at once
+    stages = []
+    current = dict(chunks)
+    peak = 0
+    for op in ops:
+        peak = max(peak, _bytes(current, itemsize) * OVERHEAD.get(op, 1))
+        for dim in REDUCES.get(op, []):
+            current.pop(names.get(dim, dim), None)
+        stages.append((op, dict(current)))
+    print(f'chunk plan for {" -> ".join(ops)}: {chunks}, '
+          f'{_bytes(chunks, itemsize) / 2**20:.1f} MiB per chunk, '
+          f'estimated peak {peak * threads / 2**20:.0f} MiB on {threads} threads')
+    return chunks, stages
+
+def _sizes(xrds):
+    # sizes in the storage order of the largest variable
+    if isinstance(xrds, xr.Dataset):
+        da = max(xrds.data_vars.values(), key = lambda da: da.size)
+    else:
+        da = xrds
+    return {dim: da.sizes[dim] for dim in da.dims}, da.dtype.itemsize
+
+def chunk_for(xrds, ops, budget = BUDGET, names = {}):
+    # chunk a lazily opened (unchunked) dataset for the planned ops
+    sizes, itemsize = _sizes(xrds)
+    chunks, stages = plan_chunks(sizes, ops, itemsize, budget, names)
+    return xrds.chunk(chunks)
+
+def conform(xrds, ops, budget = BUDGET, names = {}):
+    # rechunk only if a dim the ops need whole is split; otherwise return xrds unchanged
+    split = []
+    for op in ops:
+        for dim in CORE_DIMS.get(op, []):
+            dim = names.get(dim, dim)
+            if dim in xrds.dims and xrds.chunksizes.get(dim, (xrds.sizes[dim],))[0] != xrds.sizes[dim] and dim not in split:
+                split.append(dim)
+    if not split:
+        return xrds
+    print(f'chunk plan: {split} split across chunks, rechunking once')
+    return chunk_for(xrds, ops, budget, names)
+
+def open_planned(path, ops, budget = BUDGET, names = {}, **kwargs):
+    # xr.open_dataset with chunks picked for the planned ops instead of chunks = 'auto'
+    xrds = xr.open_dataset(path, **kwargs)
+    return chunk_for(xrds, ops, budget, names)
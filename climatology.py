@@ -1,63 +1,57 @@
 import xarray as xr
-import matplotlib.pyplot as plt
 import numpy as np
-import colorcet as cc
 from datetime import datetime
 from reanalyses_plots import annual_zonal_mean_detrended, seasonal_zonal_mean_detrended
-from pangeo_pull import pangeo_pull
-from ncf_funct import detrend_fct, difference
+from ncf_funct import detrend_fct
+from ingest import open_source, open_model, model_name, source_paths, HI_MODEL_LI, LO_MODEL_LI
+from time_index import select_years
+from bootstrap import difference_significance, stipple
+from cubes import stack_seasons, batch_differences
+from sweep import run_sweep
 
 
 # plots to compare model and reanalysis climatology
 
-def load_models(source_id, institution_id, time_range:tuple):
+def load_models(source_id, institution_id, time_range:tuple, resolution = None, n_boot = 0, seed = 0, scenario = None):
+    # n_boot > 0 adds block-bootstrap p-values for the difference panels
+    # scenario = 'ssp245' etc. continues the historical run past 2014 (ingest.open_model)
     # load model
-    time_slice = slice(f'{time_range[0]}-01-01', f'{time_range[1]}-12-01')
+    model_xrds = select_years(open_model(source_id, institution_id, scenario), *time_range)
 
-    model_xrds = pangeo_pull(source_id, institution_id)
+    # load reanalysis (zonal-mean tier if built)
+    rean_xrds = open_source('MERRA-2', time_range, resolution = resolution)
 
-    model_xrds =model_xrds.sel(time = time_slice)
+    annual_model = annual_zonal_mean_detrended(model_xrds, 'lon', 'time', 'ta', resolution)
+    seasonal_model = seasonal_zonal_mean_detrended(model_xrds, 'lon', 'time', 'ta', resolution)
 
-    model_xrds = model_xrds.sel(member_id = 'r1i1p1f1')
-    plev = model_xrds.coords['plev'].values
-    model_xrds = model_xrds.assign_coords(plev  = np.divide(plev,100).round(2))
-    model_xrds = model_xrds.sel(plev = slice(1000,1))
-    model_xrds = model_xrds.mean(dim = ['dcpp_init_year'])
+    annual_rean = annual_zonal_mean_detrended(rean_xrds, 'lon', 'time', 'ta', resolution)
+    seasonal_rean = seasonal_zonal_mean_detrended(rean_xrds, 'lon', 'time', 'ta', resolution)
 
-    # load reanalysis
-    rean_xrds = xr.open_dataset('/dx02/siw2111/MERRA-2/MERRA-2_TEMP_ALL-TIME.nc4', chunks = 'auto')
-    rean_xrds = rean_xrds.rename({'lat':'lat', 'lon':'lon', 'lev':'plev', 'time': 'time', 'T':'ta'})
-    rean_xrds = rean_xrds.sel(plev = slice(1000,1))
-    rean_xrds = rean_xrds.sortby('time')
-    
-    rean_xrds = rean_xrds.sel(time = time_slice)
-
-    annual_model = annual_zonal_mean_detrended(model_xrds, 'lon', 'time', 'ta')
-    seasonal_model = seasonal_zonal_mean_detrended(model_xrds, 'lon', 'time', 'ta')
-
-    annual_rean = annual_zonal_mean_detrended(rean_xrds, 'lon', 'time', 'ta')
-    seasonal_rean = seasonal_zonal_mean_detrended(rean_xrds, 'lon', 'time', 'ta')
-
-    xrds_li = [(annual_model, annual_rean), (seasonal_model, seasonal_rean)]
-    diff_li = []
-
-    for model, rean in xrds_li:
-        diff = difference(model, rean)
-        diff_li.append(diff)
+    # annual and seasonal differences in one broadcast, extremes from the same compute (cubes.py)
+    model = stack_seasons(annual_model, seasonal_model).expand_dims(model = [source_id])
+    rean = stack_seasons(annual_rean, seasonal_rean).expand_dims(source = ['MERRA-2'])
+    diff, metrics = batch_differences(model, rean)
+    diff = diff.isel(model = 0, reanalysis = 0, drop = True)
+    annual_diff = diff.sel(season = 'ANN', drop = True)
+    seasonal_diff = diff.sel(season = ['DJF', 'MAM', 'JJA', 'SON'])
 
-    annual_diff = diff_li[0] 
-    seasonal_diff = diff_li[1] 
-
-    maximum = max(float(diff_li[0]['ta'].max()), float(diff_li[1]['ta'].max()))
-    minimum = max(float(diff_li[0]['ta'].min()), float(diff_li[1]['ta'].min()))
+    maximum = float(metrics['ta'].sel(metric = 'max').max())
+    minimum = float(metrics['ta'].sel(metric = 'min').min())
     print(f'maximum difference: {maximum} \n minimum difference: {minimum}')
 
-    data = (source_id, annual_model, annual_rean, annual_diff, seasonal_model, seasonal_rean, seasonal_diff)
+    sig = None
+    if n_boot:
+        print(f'bootstrapping significance ({n_boot} replicates)...')
+        sig = difference_significance(model_xrds, rean_xrds, 'lon', 'time', 'ta', n_boot = n_boot, seed = seed)
+
+    data = (source_id, annual_model, annual_rean, annual_diff, seasonal_model, seasonal_rean, seasonal_diff, sig)
 
     return data, maximum, minimum
     
 def plot_clim(data, savename, time_range):
-    model, annual_model, annual_rean, annual_diff, seasonal_model, seasonal_rean, seasonal_diff = data
+    import matplotlib.pyplot as plt
+    import colorcet as cc
+    model, annual_model, annual_rean, annual_diff, seasonal_model, seasonal_rean, seasonal_diff, sig = data
     fig, axes = plt.subplots(nrows = 5, ncols = 2, figsize = (18, 20), 
                              sharex = True, sharey = False, layout = 'constrained')
 
@@ -171,6 +165,8 @@ def plot_clim(data, savename, time_range):
             xlim = (-89, 89),
             ax = axes[0,1])
     plt.clabel(cs, cs.levels, fontsize=10)
+    if sig is not None:
+        stipple(sig['annual_diff']['pvalue'], axes[0,1])
     annual_diff.close()
     axes[0,1].set_title('Difference in Mean \nAnnual', fontsize = 15)
     #axes[0,1].set_ylabel('Pressure, hPa', fontsize = 15)
@@ -209,6 +205,8 @@ def plot_clim(data, savename, time_range):
             xlim = (-89, 89),
             ax = axes[i + 1, 1])
         plt.clabel(cs, cs.levels, fontsize=10)
+        if sig is not None:
+            stipple(sig['seasonal_diff']['pvalue'].sel(season = season), axes[i + 1, 1])
         seasonal_diff.close()
 
         axes[i+1,1].set_title(season, fontsize = 15)
@@ -225,27 +223,23 @@ def plot_clim(data, savename, time_range):
     plt.close()
 
 if __name__ == '__main__':
-    #model_li = ['CESM2-WACCM', 'ACCESS-CM2', 'AWI-CM-1-1-MR' , 'GISS-E2-1-G', 'GISS-E2-1-H','IITM-ESM','MIROC6', 'MPI-ESM1-2-HR', 'MPI-ESM1-2-LR', 'MRI-ESM2-0', 'E3SM-1-1', 'EC-Earth3','EC-Earth3-CC', 'EC-Earth3-Veg', 'INM-CM5-0', 'IPSL-CM6A-LR' , 'KACE-1-0-G']
+    #model_li = HI_MODEL_LI
+    model_li = LO_MODEL_LI
     
-         
-    model_li = ['ACCESS-ESM1-5','BCC-CSM2-MR', 'CAMS-CSM1-0','CanESM5','CAS-ESM2-0','CESM2', 'CIESM','CMCC-CM2-SR5', 'CMCC-ESM2', 'EC-Earth3-Veg-LR','FGOALS-f3-L', 'FGOALS-g3',
-                'FIO-ESM-2-0', 'GFDL-CM4', 'GFDL-ESM4', 'INM-CM4-8', 'KIOST-ESM', 'MIROC-ES2L','NESM3', 'NorESM2-LM','NorESM2-MM ','TaiESM1' ]
-    
-    for model in model_li:
-        for time_range in [('1980','2014')]:
-            print(f'plotting... {model} -----------------------------------------------')
-            try:
-                start = datetime.now()
-
-                data, maximum, minimum = load_models(model, '', time_range)
-                savename = f'/home/siw2111/cmip6_reanalyses_comp/model_plots/04-20-2025/{model}_zonal-mean_{time_range[0]}-{time_range[1]}_{maximum}{minimum}.png'
-                plot_clim(data, savename, time_range)
-                model.close()
-                end = datetime.now()
-                print(f'{model} finished at {end}, runtime: {end - start}')
-            except:
-                print(f'error: unable to plot {model}')
-                continue
+    time_range = ('1980','2014')
+    scenario = None # e.g. 'ssp245' with time_range = ('1980', '2024')
+    plot_dir = '/home/siw2111/cmip6_reanalyses_comp/model_plots/04-20-2025'
+
+    def clim_task(model):
+        data, maximum, minimum = load_models(model, '', time_range, n_boot = 1000, scenario = scenario)
+        savename = f'{plot_dir}/{model_name(model, scenario)}_zonal-mean_{time_range[0]}-{time_range[1]}_{maximum}{minimum}.png'
+        plot_clim(data, savename, time_range)
+        return [savename]
+
+    # rerunning skips models already plotted, see sweep.py
+    run_sweep(model_li, clim_task, f'{plot_dir}/clim_sweep.json',
+              params = {'time_range': time_range, 'rean': 'MERRA-2', 'n_boot': 1000, 'scenario': scenario},
+              source = lambda model: source_paths(model_name(model, scenario), tier = False) + source_paths('MERRA-2'))
     
     
     '''start = datetime.now()
@@ -0,0 +1,187 @@
+import xarray as xr
+import numpy as np
+import dask
+from ncf_funct import zonal_mean
+from ingest import open_source, HI_MODEL_LI, LO_MODEL_LI, TIER_DIR, PULL_ERRORS
+from time_index import time_labels, add_time_labels, group_key, load_time_labels
+from precision import weights_for
+from storage import write_compressed
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# stacked zonal-mean cubes on a common grid, so statistics across sources are one broadcasted
+# computation instead of one pass per source or per pair.
+
+REAN_LI = ['MERRA-2', 'ERA-5.1', 'JRA-55']
+
+# shared model grid: CMIP6 plev19 levels (hPa) and 2.5 degree latitudes
+COMMON_PLEV = np.array([1000, 925, 850, 700, 600, 500, 400, 300, 250, 200, 150, 100, 70, 50, 30, 20, 10, 5, 1], dtype = float)
+COMMON_LAT = np.arange(-88.75, 90, 2.5)
+
+def month_start(xrds, time = 'time'):
+    # label every monthly mean by the first of its month so sources (and model calendars) line up exactly
+    year, month = time_labels(xrds[time].values)
+    months = (year - 1970) * 12 + month - 1
+    return xrds.assign_coords({time: months.astype('datetime64[M]').astype('datetime64[ns]')})
+
+def build_rean_cube(time_range = None, names = REAN_LI, variable = 'ta', lat = None, resolution = None):
+    # lazy (source, time, plev, lat) zonal-mean cube of the reanalyses on common
+    # times and pressure levels, interpolated to lat (default: grid of the first source)
+    rean_li = []
+    for name in names:
+        rean = open_source(name, time_range, resolution = resolution)
+        rean = month_start(zonal_mean(rean[[variable]], 'lon'))
+        rean_li.append(rean)
+
+    common_plev = rean_li[0]['plev'].values
+    for rean in rean_li[1:]:
+        common_plev = np.intersect1d(common_plev, rean['plev'].values)
+    common_plev = common_plev[::-1] # 1000 -> 1 hPa
+    if lat is None:
+        lat = rean_li[0]['lat']
+
+    aligned_li = []
+    for rean in rean_li:
+        rean = rean.sel(plev = common_plev)
+        if not np.array_equal(rean['lat'].values, np.asarray(lat)):
+            rean = rean.interp(lat = lat)
+        aligned_li.append(rean)
+
+    cube = xr.concat(aligned_li, dim = 'source', join = 'inner', coords = 'minimal', compat = 'override')
+    cube = cube.assign_coords(source = list(names))
+    print(cube)
+    return cube
+
+def reduce_reans(reduce, time_range = None, names = REAN_LI, variable = 'ta', resolution = None):
+    # reduce(name, zonal mean) of every reanalysis on its own grid, stacked along source in one
+    # compute. For reductions over latitude (box and area means) this avoids the interpolation of
+    # build_rean_cube, so each source is averaged over its own grid points
+    reduced = []
+    for name in names:
+        rean = open_source(name, time_range, resolution = resolution)
+        reduced.append(reduce(name, month_start(zonal_mean(rean[[variable]], 'lon'))))
+    stacked = xr.concat(reduced, dim = 'source', coords = 'minimal', compat = 'override')
+    return stacked.assign_coords(source = list(names)).compute()
+
+def pairwise_differences(cube, dim = 'source'):
+    # (source, other, ...) differences of every pair in one broadcast
+    return cube - cube.rename({dim: 'other'})
+
+def rean_stats(cube, dim = 'source'):
+    # inter-reanalysis mean, spread (standard deviation and range) and pairwise differences
+    stats = xr.concat([cube.mean(dim = dim),
+                       cube.std(dim = dim),
+                       cube.max(dim = dim) - cube.min(dim = dim)], dim = 'stat')
+    stats = stats.assign_coords(stat = ['mean', 'spread', 'range'])
+    return stats, pairwise_differences(cube, dim)
+
+def to_common_grid(xrds, plev, lat):
+    # interpolate a zonal-mean cube to common pressure levels and latitudes
+    if not np.array_equal(xrds['plev'].values, np.asarray(plev)):
+        xrds = xrds.interp(plev = plev)
+    if not np.array_equal(xrds['lat'].values, np.asarray(lat)):
+        xrds = xrds.interp(lat = lat)
+    return xrds
+
+def stack_seasons(annual, seasonal):
+    # (season, ...) with the annual field as season 'ANN' in front of the four seasons
+    return xr.concat([annual.expand_dims(season = ['ANN']), seasonal.sel(season = ['DJF', 'MAM', 'JJA', 'SON'])], dim = 'season')
+
+def climatology_cube(cube, time = 'time'):
+    # (..., season, plev, lat) climatology with the annual mean as season 'ANN'
+    return stack_seasons(cube.mean(dim = time), cube.groupby(group_key(cube, time, 'season')).mean(dim = time))
+
+def difference_matrix(models, reans, model_dim = 'model', rean_dim = 'source'):
+    # (model, reanalysis, ...) differences in one broadcast; the reanalyses are put on the model
+    # grid as in ncf_funct.difference (common pressure levels, latitudes interpolated)
+    common_plev = np.intersect1d(reans['plev'], models['plev'])
+    models = models.sel(plev = common_plev)
+    reans = reans.sel(plev = common_plev)
+    if not np.array_equal(reans['lat'].values, models['lat'].values):
+        reans = reans.interp(lat = models['lat'])
+    diff = models - reans.rename({rean_dim: 'reanalysis'})
+    return diff.transpose(model_dim, 'reanalysis', ...)
+
+def difference_metrics(diff, lat = 'lat', plev = 'plev'):
+    # max, min, rms and area-weighted bias over (plev, lat), computed together in one pass
+    weights = weights_for(diff, lat)
+    weighted = diff.weighted(weights)
+    metrics = xr.concat([diff.max(dim = [plev, lat]),
+                         diff.min(dim = [plev, lat]),
+                         np.sqrt((diff ** 2).weighted(weights).mean(dim = [plev, lat])),
+                         weighted.mean(dim = [plev, lat])], dim = 'metric')
+    metrics = metrics.assign_coords(metric = ['max', 'min', 'rms', 'bias'])
+    return metrics.compute()
+
+def difference_extremes(diff_li, variable):
+    # overall max and min of several difference datasets with a single compute
+    extremes = dask.compute(*[diff[variable].max() for diff in diff_li], *[diff[variable].min() for diff in diff_li])
+    n = len(diff_li)
+    return float(max(extremes[:n])), float(min(extremes[n:]))
+
+def batch_differences(models, reans, model_dim = 'model', rean_dim = 'source'):
+    # differences of every model against every reanalysis and their summary metrics, from reduced
+    # (model, season, plev, lat) and (source, season, plev, lat) fields, e.g. stack_seasons of
+    # climatologies (climatology_cube) or trends
+    diff = difference_matrix(models, reans, model_dim, rean_dim)
+    return diff, difference_metrics(diff)
+
+def build_model_cube(time_range, hi_model_li = HI_MODEL_LI, lo_model_li = LO_MODEL_LI, variable = 'ta',
+                     plev = COMMON_PLEV, lat = COMMON_LAT, savename = None, keepbits = None):
+    # regrid every model zonal mean once onto (plev, lat) and stack into a
+    # (model, time, plev, lat) cube with a 'top' coordinate ('high' or 'low'),
+    # stored compressed (bit-rounded with keepbits, see storage.py)
+    model_li = []
+    id_li = []
+    top_li = []
+    failed = []
+    for top, id_li_top in [('high', hi_model_li), ('low', lo_model_li)]:
+        for id in id_li_top:
+            print(f'regridding {id}----------------------------------')
+            try:
+                model = open_source(id, time_range)
+                model = month_start(zonal_mean(model[[variable]], 'lon'))
+                model = to_common_grid(model, plev, lat)
+                model = model.drop_vars([name for name in model.coords if name not in ['time', 'plev', 'lat']])
+                model_li.append(model)
+                id_li.append(id)
+                top_li.append(top)
+            except PULL_ERRORS as e:
+                print(f'error: unable to regrid {id}: {type(e).__name__}: {e}')
+                failed.append(id)
+                continue
+
+    cube = xr.concat(model_li, dim = 'model', join = 'outer')
+    cube = cube.assign_coords(model = id_li, top = ('model', top_li))
+    cube.attrs['failed'] = failed # so a reopen knows these were tried
+    cube = add_time_labels(cube)
+
+    if savename is None:
+        savename = f'{TIER_DIR}/models_{time_range[0]}-{time_range[1]}.nc'
+    write_compressed(cube, savename, keepbits)
+    return open_model_cube(time_range, savename)
+
+def open_model_cube(time_range, savename = None):
+    if savename is None:
+        savename = f'{TIER_DIR}/models_{time_range[0]}-{time_range[1]}.nc'
+    cube = load_time_labels(xr.open_dataset(savename, chunks = 'auto'))
+    return cube.assign_coords(top = ('model', cube['top'].values)) # eager labels for groupby
+
+def ensemble_stats(cube, dim = 'model'):
+    # multi-model mean and spread, high-top and low-top composites and their difference
+    stats = xr.concat([cube.mean(dim = dim),
+                       cube.std(dim = dim),
+                       cube.max(dim = dim) - cube.min(dim = dim)], dim = 'stat')
+    stats = stats.assign_coords(stat = ['mean', 'spread', 'range'])
+    composites = cube.groupby('top').mean(dim = dim)
+    top_diff = composites.sel(top = 'high') - composites.sel(top = 'low')
+    return stats, composites, top_diff
+
+def rank_models(metric, dim = 'model', ascending = True):
+    # rank of every model (1 = smallest) at every point of a per-model metric, e.g. abs(bias)
+    ranks = xr.apply_ufunc(lambda x: x.argsort(axis = -1).argsort(axis = -1) + 1, metric,
+                           input_core_dims = [[dim]],
+                           output_core_dims = [[dim]],
+                           dask = 'parallelized')
+    if not ascending:
+        ranks = metric.sizes[dim] + 1 - ranks
+    return ranks
@@ -0,0 +1,99 @@
+import numpy as np
+import xarray as xr
+from segments import label_values, _center
+from ncf_funct import field_names
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# harmonic-regression seasonal cycle: y = mean + trend * t + sum_j (a_j cos 2 pi j f + b_j sin 2 pi j f)
+# with f the fraction of the year (month centres) and j = 1..k annual harmonics. The design matrix
+# depends only on the time axis, so its pseudo-inverse is computed once and the fit of every grid
+# point is one matmul over time. Climatology, anomalies, amplitude/phase and trend all follow from
+# the coefficients. k = 6 reproduces monthly means; k = 3 gives the usual smooth cycle.
+
+HARMONICS = 3
+
+def fraction_of_year(xrds, time = 'time'):
+    # (year, fraction) of monthly data at month centres, calendar independent via the labels
+    years = label_values(xrds, time, 'year').astype(np.float64)
+    months = label_values(xrds, time, 'month').astype(np.float64)
+    return years, (months - 0.5) / 12
+
+def coefficient_names(k = HARMONICS):
+    return ['mean', 'trend'] + [f'{part}{j}' for j in range(1, k + 1) for part in ['cos', 'sin']]
+
+def harmonic_columns(fraction, k = HARMONICS):
+    # (n, 2k) cos/sin columns
+    angle = 2 * np.pi * np.outer(fraction, np.arange(1, k + 1))
+    return np.stack([np.cos(angle), np.sin(angle)], axis = -1).reshape(len(fraction), 2 * k)
+
+def design_matrix(years, fraction, k = HARMONICS):
+    # (n, 2 + 2k) [1, t, cos, sin ...], t in years from the middle of the record
+    t = years + fraction
+    t = t - t.mean()
+    return np.column_stack([np.ones_like(t), t, harmonic_columns(fraction, k)])
+
+def _fit_kernel(y, design, pinv):
+    # (..., n) -> (..., p) least-squares coefficients, one matmul for complete series and
+    # batched normal equations for the series with gaps
+    yc, shift = _center(y)
+    valid = ~np.isnan(yc)
+    coef = np.where(valid, yc, 0) @ pinv.T.astype(y.dtype)
+
+    gaps = ~valid.all(axis = -1)
+    if gaps.any():
+        weights = valid[gaps].astype(np.float64)
+        normal = np.einsum('in,np,nq->ipq', weights, design, design)
+        rhs = np.einsum('in,np->ip', weights * np.where(valid[gaps], yc[gaps], 0), design)
+        coef[gaps] = np.einsum('ipq,iq->ip', np.linalg.pinv(normal), rhs)
+
+    coef = coef.astype(np.float64)
+    coef[..., 0] += shift[..., 0]
+    coef[valid.sum(axis = -1) == 0] = np.nan
+    return coef.astype(y.dtype)
+
+def harmonic_coefficients(da, time = 'time', k = HARMONICS):
+    # (..., coefficient) fit of every point, trend per year
+    years, fraction = fraction_of_year(da, time)
+    design = design_matrix(years, fraction, k)
+    pinv = np.linalg.pinv(design)
+    if da.chunks:
+        da = da.chunk({time: -1})
+    coef = xr.apply_ufunc(_fit_kernel, da,
+                          input_core_dims = [[time]],
+                          output_core_dims = [['coefficient']],
+                          kwargs = {'design': design, 'pinv': pinv},
+                          dask = 'parallelized',
+                          dask_gufunc_kwargs = {'output_sizes': {'coefficient': design.shape[1]}},
+                          output_dtypes = [da.dtype])
+    return coef.assign_coords(coefficient = coefficient_names(k))
+
+def harmonic_fit(da, time = 'time', k = HARMONICS):
+    # mean, trend (per decade), amplitude, phase and peak month of each harmonic,
+    # (month) climatology and (time) anomalies from it, all from one fit
+    coef = harmonic_coefficients(da, time, k)
+    years, fraction = fraction_of_year(da, time)
+    cos = coef.isel(coefficient = slice(2, None, 2)).rename(coefficient = 'harmonic').assign_coords(harmonic = np.arange(1, k + 1))
+    sin = coef.isel(coefficient = slice(3, None, 2)).rename(coefficient = 'harmonic').assign_coords(harmonic = np.arange(1, k + 1))
+    phase = np.arctan2(sin, cos) # a cos(x) + b sin(x) = A cos(x - phase)
+
+    # seasonal cycle on the time axis and at the 12 month centres, in the data dtype
+    harmonic = coef.isel(coefficient = slice(2, None))
+    cycle = xr.dot(harmonic, xr.DataArray(harmonic_columns(fraction, k).astype(da.dtype), dims = [time, 'coefficient'],
+                                          coords = {time: da[time], 'coefficient': harmonic['coefficient']}), dim = 'coefficient')
+    months = xr.DataArray(harmonic_columns((np.arange(1, 13) - 0.5) / 12, k).astype(da.dtype), dims = ['month', 'coefficient'],
+                          coords = {'month': np.arange(1, 13), 'coefficient': harmonic['coefficient']})
+    mean = coef.sel(coefficient = 'mean', drop = True)
+
+    return xr.Dataset({'mean': mean,
+                       'trend': coef.sel(coefficient = 'trend', drop = True) * 10, # per decade, as find_trend
+                       'amplitude': np.hypot(cos, sin),
+                       'phase': phase,
+                       'peak_month': (phase / (2 * np.pi * cos['harmonic']) % (1 / cos['harmonic'])) * 12 + 0.5,
+                       'climatology': mean + xr.dot(harmonic, months, dim = 'coefficient'),
+                       'anomaly': da - mean - cycle})
+
+def harmonic_anomaly(xrds, time = 'time', k = HARMONICS):
+    # anomalies from the harmonic climatology for a DataArray or every field of a Dataset
+    if isinstance(xrds, xr.DataArray):
+        return harmonic_fit(xrds, time, k)['anomaly']
+    return xrds.assign({name: harmonic_fit(xrds[name], time, k)['anomaly'] for name in field_names(xrds, time)})
@@ -0,0 +1,218 @@
+import os
+import xarray as xr
+import numpy as np
+from ncf_funct import concat_era, zonal_mean, area_weighted_mean, coarsen_lat
+from sweep import run_sweep
+from time_index import add_time_labels, select_years, load_time_labels
+from chunk_plan import conform, open_planned
+from refs import open_reference, ref_path, RAW_FILES
+from storage import write_compressed
+from precision import as_compute
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# ingest stage: open each source once with standard names (lat, lon, plev, time, ta) and store
+# a monthly zonal-mean (time, plev, lat) tier and a regional-mean (region, time, plev) tier.
+# downstream zonal-mean functions accept these cubes directly (see ncf_funct.zonal_mean).
+# the zonal tier is also stored as a pyramid of area-weighted latitude bands for quick-look figures.
+
+TIER_DIR = '/dx02/siw2111/tiers'
+
+REAN_SOURCES = {'MERRA-2': {'path': '/dx02/siw2111/MERRA-2/MERRA-2_TEMP_ALL-TIME.nc4',
+                            'rename': {'lev':'plev', 'T':'ta'}},
+                'JRA-55': {'path': '/dx02/siw2111/JRA-55/JRA-55_T.nc',
+                           'rename': {'g4_lat_2':'lat', 'g4_lon_3':'lon', 'lv_HYBL1':'plev', 'initial_time0_hours': 'time', 'TMP_GDS4_HYBL_S123':'ta'}},
+                'ERA-5.1': {'path': None, # spliced by concat_era
+                            'rename': {'latitude':'lat', 'longitude':'lon', 'pressure_level':'plev', 'valid_time': 'time', 't':'ta'}}}
+
+# CMIP6 historical models by model top
+HI_MODEL_LI = ['EC-Earth3', 'EC-Earth3-CC', 'EC-Earth3-Veg', 'E3SM-1-1', 'MRI-ESM2-0', 'IPSL-CM6A-LR', 'GISS-E2-1-H', 'GISS-E2-1-G', 'INM-CM5-0',
+               'CESM2-WACCM', 'MPI-ESM1-2-HR', 'MPI-ESM1-2-LR', 'IITM-ESM', 'AWI-CM-1-1-MR', 'ACCESS-CM2', 'KACE-1-0-G', 'MIROC6']
+
+LO_MODEL_LI = ['ACCESS-ESM1-5', 'BCC-CSM2-MR', 'CAMS-CSM1-0', 'CanESM5', 'CAS-ESM2-0', 'CESM2', 'CIESM', 'CMCC-CM2-SR5', 'CMCC-ESM2', 'EC-Earth3-Veg-LR',
+               'FGOALS-f3-L', 'FGOALS-g3', 'FIO-ESM-2-0', 'GFDL-CM4', 'GFDL-ESM4', 'INM-CM4-8', 'KIOST-ESM', 'MIROC-ES2L', 'NESM3', 'NorESM2-LM', 'NorESM2-MM', 'TaiESM1']
+
+# errors of a model that cannot be pulled or regridded: not in the catalog (IndexError), member
+# or level missing (KeyError), grid or calendar problems (ValueError), network and store (OSError)
+PULL_ERRORS = (IndexError, KeyError, ValueError, OSError)
+
+# latitude band widths (degrees) of the pyramid, None = native grid
+PYRAMID_LEVELS = [None, 2, 5]
+
+# operations run on the tiers, see chunk_plan.py
+TIER_OPS = ['season', 'detrend', 'trend']
+
+# latitude bounds of the regional-mean tier
+REGIONS = {'global': (-90, 90),
+           '60-90N': (60, 90),
+           '60-90S': (-90, -60),
+           'tropics': (-30, 30)}
+
+def tier_path(name, kind = 'zonal', resolution = None):
+    # kind = 'zonal' (time, plev, lat) or 'region' (region, time, plev)
+    if resolution is None or resolution == 'native':
+        return f'{TIER_DIR}/{name}_{kind}.nc'
+    return f'{TIER_DIR}/{name}_{kind}_{resolution}deg.nc'
+
+def open_raw_rean(name):
+    # full 3-D monthly field with standard names
+    source = REAN_SOURCES[name]
+    # raw files are read through their reference index (refs.py), lock-free
+    if name == 'ERA-5.1':
+        xrds = concat_era(open_reference('ERA-5'), open_reference('ERA-5.1'))
+    else:
+        xrds = open_reference(name)
+    xrds = xrds.rename(source['rename'])
+    # the raw field is only zonally averaged (JRA-55 is regridded first), keep lon whole
+    ops = ['regrid', 'zonal_mean'] if name == 'JRA-55' else ['zonal_mean']
+    xrds = conform(xrds, ops)
+
+    if name == 'JRA-55':
+        # interpolate hybrid levels to MERRA-2 pressure levels
+        standard_lev = open_reference('MERRA-2')['lev'].values
+        xrds = xrds.interp(plev = standard_lev)
+        xrds = xrds.assign_coords(lat = xrds.coords['lat'].round(1))
+
+    xrds = xrds.sel(plev = slice(1000,1))
+    xrds = xrds.sortby('time') # sort time for MERRA2
+    xrds = xrds.sortby('lat')
+    xrds = add_time_labels(as_compute(xrds)) # float32 policy, see precision.py
+    return xrds
+
+def model_name(source_id, scenario = None):
+    # 'CESM2' or 'CESM2+ssp245' for historical continued by a scenario
+    return source_id if scenario is None else f'{source_id}+{scenario}'
+
+def open_model(source_id, institution_id = '', scenario = None):
+    # full 3-D monthly model field on hPa levels, scenario = 'ssp245' etc. continues it past 2014
+    from pangeo_pull import pangeo_pull, pangeo_pull_extended # pangeo_pull imports ingest
+    if scenario is None:
+        xrds = pangeo_pull(source_id, institution_id)
+    else:
+        xrds = pangeo_pull_extended(source_id, institution_id, scenario)
+    xrds = xrds.sel(member_id = 'r1i1p1f1')
+    plev = xrds.coords['plev'].values
+    xrds = xrds.assign_coords(plev = np.divide(plev,100).round(2)) # convert from pa to hpa
+    xrds = xrds.sel(plev = slice(1000,1))
+    if 'dcpp_init_year' in xrds.dims:
+        xrds = xrds.mean(dim = ['dcpp_init_year'])
+    xrds = add_time_labels(as_compute(xrds)) # integer labels instead of cftime attribute access
+    return xrds
+
+def region_means(zonal, lat = 'lat'):
+    # (region, time, plev) cos-lat weighted means of a zonal-mean cube
+    region_li = []
+    for region, (south, north) in REGIONS.items():
+        band = zonal.sel({lat: zonal[lat][(zonal[lat] >= south) & (zonal[lat] <= north)]})
+        region_li.append(area_weighted_mean(band, lat, 'lon'))
+    regions = xr.concat(region_li, dim = 'region')
+    regions = regions.assign_coords(region = list(REGIONS.keys()))
+    return regions
+
+def build_tiers(xrds, name, variables = ['ta'], overwrite = False, keepbits = None):
+    # compute and store the zonal-mean and regional-mean tiers of one source, compressed and,
+    # with keepbits (e.g. storage.KEEPBITS), bit-rounded (see storage.py)
+    os.makedirs(TIER_DIR, exist_ok = True)
+    zonal_name = tier_path(name, 'zonal')
+    region_name = tier_path(name, 'region')
+
+    if os.path.exists(zonal_name) and not overwrite:
+        print(f'zonal tier exists... {zonal_name}')
+    else:
+        print(f'building zonal tier... {name}')
+        zonal = zonal_mean(xrds[variables], 'lon')
+        write_compressed(zonal, zonal_name, keepbits)
+
+    if os.path.exists(region_name) and not overwrite:
+        print(f'region tier exists... {region_name}')
+    else:
+        print(f'building region tier... {name}')
+        zonal = open_planned(zonal_name, ['area_mean'])
+        write_compressed(region_means(zonal), region_name, keepbits)
+        zonal.close()
+
+    build_pyramid(name, overwrite = overwrite, keepbits = keepbits)
+
+    return zonal_name, region_name
+
+def build_pyramid(name, resolutions = PYRAMID_LEVELS, overwrite = False, keepbits = None):
+    # coarsened latitude-band levels of the zonal tier
+    zonal = open_planned(tier_path(name, 'zonal'), ['regrid'])
+    for resolution in resolutions:
+        savename = tier_path(name, 'zonal', resolution)
+        if resolution is None or (os.path.exists(savename) and not overwrite):
+            continue
+        print(f'building {resolution} deg pyramid level... {name}')
+        write_compressed(coarsen_lat(zonal, resolution), savename, keepbits)
+    zonal.close()
+
+def open_tier(name, kind = 'zonal', time_range = None, resolution = None):
+    # tiers are small, time is kept whole for seasonal grouping, detrending and trends
+    xrds = open_planned(tier_path(name, kind, resolution), TIER_OPS)
+    xrds = load_time_labels(as_compute(xrds))
+    if time_range is not None:
+        xrds = select_years(xrds, *time_range)
+    return xrds
+
+def open_source(name, time_range = None, tier = True, resolution = None):
+    # reanalysis or model: zonal-mean tier (at pyramid level resolution) if it has been built,
+    # otherwise the full field, which the reduction functions coarsen themselves
+    if tier and os.path.exists(tier_path(name, 'zonal', resolution)):
+        print(f'reading zonal tier... {name} {resolution}')
+        return open_tier(name, 'zonal', time_range, resolution)
+    if name in REAN_SOURCES:
+        xrds = open_raw_rean(name)
+    else:
+        source_id, _, scenario = name.partition('+')
+        xrds = open_model(source_id, scenario = scenario or None)
+    if time_range is not None:
+        xrds = select_years(xrds, *time_range)
+    return xrds
+
+def source_paths(name, kind = 'zonal', tier = True, resolution = None):
+    # what open_source / open_region would read, for the input hash of a sweep (sweep.py):
+    # the tier if it has been built, otherwise the raw files and their reference index,
+    # or the catalog stores of a model ('CESM2+ssp245' includes the scenario run)
+    if tier and os.path.exists(tier_path(name, kind, resolution)):
+        return [tier_path(name, kind, resolution)]
+    if name in REAN_SOURCES:
+        names = ['ERA-5', 'ERA-5.1'] if name == 'ERA-5.1' else ['MERRA-2', 'JRA-55'] if name == 'JRA-55' else [name]
+        return [path for ref in names for path in [RAW_FILES[ref], ref_path(ref)]]
+    from pangeo_pull import model_stores
+    source_id, _, scenario = name.partition('+')
+    return model_stores(source_id, ['historical', scenario] if scenario else 'historical')
+
+def open_region(name, time_range = None, tier = True):
+    # (region, time, plev) cube for area_weighted_mean consumers
+    if tier and os.path.exists(tier_path(name, 'region')):
+        print(f'reading region tier... {name}')
+        return open_tier(name, 'region', time_range)
+    zonal = zonal_mean(open_source(name, time_range, tier), 'lon')
+    return region_means(zonal[['ta']])
+
+def ingest_reans(names = ['MERRA-2', 'JRA-55', 'ERA-5.1'], overwrite = False, keepbits = None):
+    for name in names:
+        xrds = open_raw_rean(name)
+        build_tiers(xrds, name, overwrite = overwrite, keepbits = keepbits)
+        xrds.close()
+
+def ingest_models(model_li, overwrite = False, scenario = None, keepbits = None, retries = None, backoff = None):
+    # resumable, see sweep.py; with a scenario the tiers are stored as e.g. 'CESM2+ssp245'.
+    # a new catalog version of a model's stores reruns it
+    def ingest_task(source_id):
+        xrds = open_model(source_id, scenario = scenario)
+        paths = build_tiers(xrds, model_name(source_id, scenario), overwrite = overwrite, keepbits = keepbits)
+        xrds.close()
+        return list(paths)
+
+    def ingest_source(source_id):
+        return source_paths(model_name(source_id, scenario), tier = False)
+
+    os.makedirs(TIER_DIR, exist_ok = True)
+    if scenario is None:
+        return run_sweep(model_li, ingest_task, f'{TIER_DIR}/ingest_sweep.json', params = {'levels': PYRAMID_LEVELS, 'keepbits': keepbits},
+                         retries = retries, backoff = backoff, source = ingest_source)
+    return run_sweep(model_li, ingest_task, f'{TIER_DIR}/ingest_sweep_{scenario}.json', params = {'levels': PYRAMID_LEVELS, 'keepbits': keepbits, 'scenario': scenario},
+                     retries = retries, backoff = backoff, source = ingest_source)
+
+if __name__ == '__main__':
+    ingest_reans()
@@ -0,0 +1,282 @@
+import time as timer
+import numpy as np
+import xarray as xr
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# compiled kernel backend for the core reductions: mean-preserving linear detrend, OLS slope and
+# weighted mean along the last axis, each with a NaN-aware variant. With numba installed they are
+# generalized ufuncs compiled on first use and cached on disk (one fused loop, float64 accumulators);
+# otherwise the numpy versions below run. set_backend('numba' | 'numpy') picks the backend, like
+# precision.set_precision. parity_check() asserts both against scipy/xarray and benchmark() times
+# them (python kernels.py, tests/test_kernels.py).
+
+BACKEND = 'numba'
+
+_COMPILED = {}
+
+def set_backend(backend):
+    # 'numba' or 'numpy' for every later kernel call
+    global BACKEND
+    BACKEND = backend
+
+def active_backend():
+    # numba if requested and importable, else numpy
+    if BACKEND == 'numba':
+        try:
+            import numba
+        except ImportError:
+            return 'numpy'
+    return BACKEND
+
+# numpy kernels, (..., n) -> (..., n) or (...)
+
+def _np_fit(y, skipna):
+    # slope and time-mean index of the OLS fit against 0..n-1, float64 sums
+    n = y.shape[-1]
+    t = np.arange(n, dtype = np.float64)
+    if skipna:
+        valid = ~np.isnan(y)
+        y0 = np.where(valid, y, 0)
+        count = valid.sum(axis = -1, dtype = np.float64)
+        st = (valid * t).sum(axis = -1)
+        stt = (valid * t * t).sum(axis = -1)
+    else:
+        y0 = y
+        count = np.full(y.shape[:-1], float(n))
+        st = np.full(y.shape[:-1], t.sum())
+        stt = np.full(y.shape[:-1], (t * t).sum())
+    sy = y0.sum(axis = -1, dtype = np.float64)
+    sty = (y0 * t.astype(y.dtype)).sum(axis = -1, dtype = np.float64)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        slope = (count * sty - st * sy) / (count * stt - st * st)
+        tbar = st / count
+    return slope, tbar
+
+def _np_detrend(y, skipna = True):
+    slope, tbar = _np_fit(y, skipna)
+    t = np.arange(y.shape[-1])
+    return (y - (slope[..., None] * (t - tbar[..., None])).astype(y.dtype)).astype(y.dtype)
+
+def _np_slope(y, skipna = True):
+    slope, tbar = _np_fit(y, skipna)
+    return slope.astype(y.dtype)
+
+def _np_weighted_mean(y, w, skipna = True):
+    if skipna:
+        valid = ~np.isnan(y)
+        total = np.where(valid, y * w, 0).sum(axis = -1, dtype = np.float64)
+        weight = np.where(valid, w, 0).sum(axis = -1, dtype = np.float64)
+    else:
+        total = (y * w).sum(axis = -1, dtype = np.float64)
+        weight = np.broadcast_to(w, y.shape).sum(axis = -1, dtype = np.float64)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return (total / weight).astype(y.dtype)
+
+# numba kernels, each compiled on its first use and cached on disk (numba cache = True), so a
+# new worker loads the machine code instead of compiling it. skipna is a scalar argument of the
+# gufunc rather than a separate specialisation. The gufuncs reach the shared fit through the
+# module global _numba_fit, not a closure: numba cannot reuse cached closures across processes
+
+def _fit_loop(y, skipna):
+    # slope and time-mean index of the OLS fit against 0..n-1, one pass (compiled by numba)
+    count = st = stt = sy = sty = 0.0
+    for i in range(y.shape[0]):
+        v = y[i]
+        if skipna and np.isnan(v):
+            continue
+        count += 1.0
+        st += i
+        stt += i * i
+        sy += v
+        sty += i * v
+    denom = count * stt - st * st
+    if count == 0 or denom == 0:
+        return np.nan, 0.0
+    return (count * sty - st * sy) / denom, st / count
+
+_numba_fit = None
+
+def _compile(name):
+    global _numba_fit
+    from numba import guvectorize, njit
+    if _numba_fit is None:
+        _numba_fit = njit(cache = True)(_fit_loop)
+
+    if name == 'detrend':
+        @guvectorize(['void(float32[:], boolean, float32[:])', 'void(float64[:], boolean, float64[:])'], '(n),()->(n)', nopython = True, cache = True)
+        def detrend(y, skipna, out):
+            slope, tbar = _numba_fit(y, skipna)
+            for i in range(y.shape[0]):
+                out[i] = y[i] - slope * (i - tbar)
+        return detrend
+
+    if name == 'slope':
+        @guvectorize(['void(float32[:], boolean, float32[:])', 'void(float64[:], boolean, float64[:])'], '(n),()->()', nopython = True, cache = True)
+        def slope(y, skipna, out):
+            out[0] = _numba_fit(y, skipna)[0]
+        return slope
+
+    @guvectorize(['void(float32[:], float32[:], boolean, float32[:])', 'void(float64[:], float64[:], boolean, float64[:])'], '(n),(n),()->()', nopython = True, cache = True)
+    def weighted_mean(y, w, skipna, out):
+        total = weight = 0.0
+        for i in range(y.shape[0]):
+            if skipna and np.isnan(y[i]):
+                continue
+            total += y[i] * w[i]
+            weight += w[i]
+        out[0] = total / weight if weight != 0 else np.nan
+    return weighted_mean
+
+def kernel(name, skipna = True, backend = None):
+    # the detrend, slope or weighted_mean function of a backend, same call on both
+    backend = backend or active_backend()
+    if backend == 'numba':
+        if name not in _COMPILED:
+            _COMPILED[name] = _compile(name)
+        compiled = _COMPILED[name]
+        if name == 'weighted_mean':
+            return lambda y, w: compiled(y, np.asarray(w, dtype = y.dtype), skipna) # (n) weights broadcast
+        return lambda y: compiled(y, skipna)
+    numpy_kernel = {'detrend': _np_detrend, 'slope': _np_slope, 'weighted_mean': _np_weighted_mean}[name]
+    return lambda *args: numpy_kernel(*args, skipna = skipna)
+
+# xarray wrappers, one blockwise apply_ufunc per variable
+
+def _fields(xrds, dims, function):
+    # apply to every float variable with one of dims, leave the rest
+    if isinstance(xrds, xr.DataArray):
+        return function(xrds)
+    def apply_da(da):
+        if not any(dim in da.dims for dim in dims):
+            return da
+        return function(da if np.issubdtype(da.dtype, np.floating) else da.astype(np.float64))
+    return xrds.map(apply_da)
+
+def detrend(xrds, dim = 'time', skipna = True):
+    # linear detrend along dim keeping the mean (as detrend_fct)
+    def apply_da(da):
+        da = da.chunk({dim: -1}) if da.chunks else da
+        return xr.apply_ufunc(kernel('detrend', skipna), da,
+                              input_core_dims = [[dim]],
+                              output_core_dims = [[dim]],
+                              dask = 'parallelized',
+                              output_dtypes = [da.dtype],
+                              keep_attrs = True).transpose(*da.dims)
+    return _fields(xrds, [dim], apply_da)
+
+def slope(xrds, dim = 'time', skipna = True):
+    # OLS slope per step of dim
+    def apply_da(da):
+        da = da.chunk({dim: -1}) if da.chunks else da
+        return xr.apply_ufunc(kernel('slope', skipna), da,
+                              input_core_dims = [[dim]],
+                              dask = 'parallelized',
+                              output_dtypes = [da.dtype])
+    return _fields(xrds, [dim], apply_da)
+
+def weighted_mean(xrds, weights, dims, skipna = True):
+    # NaN-aware weighted mean over dims (e.g. cos(lat) over lat and lon)
+    kernel_function = kernel('weighted_mean', skipna)
+
+    def apply_da(da):
+        core = [dim for dim in dims if dim in da.dims]
+        w = weights
+        for dim in core:
+            if dim not in w.dims:
+                w = w * xr.ones_like(da[dim], dtype = w.dtype)
+        w = w.transpose(*core).drop_vars([name for name in w.coords if name not in core])
+
+        def flat(y, w):
+            # core dims collapsed into one axis for the (n),(n)->() kernel
+            y = y.reshape(y.shape[:y.ndim - len(core)] + (-1,))
+            return kernel_function(y, w.reshape(-1).astype(y.dtype))
+
+        da = da.chunk({dim: -1 for dim in core}) if da.chunks else da
+        return xr.apply_ufunc(flat, da, w,
+                              input_core_dims = [core, core],
+                              dask = 'parallelized',
+                              output_dtypes = [da.dtype])
+    return _fields(xrds, dims, apply_da)
+
+# parity and timing of the two backends
+
+def _examples(shape = (64, 420), dtype = np.float32, nan_fraction = 0.05, seed = 0):
+    rng = np.random.default_rng(seed)
+    y = (250 + 0.01 * np.arange(shape[-1]) + rng.normal(0, 1, shape)).astype(dtype)
+    y_nan = y.copy()
+    y_nan[rng.random(shape) < nan_fraction] = np.nan
+    w = np.cos(np.deg2rad(np.linspace(-90, 90, shape[-1]))).astype(dtype)
+    return y, y_nan, w
+
+TOLERANCE = {np.float32: 1e-4, np.float64: 1e-9} # absolute, for values around 250
+
+def _references(y, w):
+    # independent float64 results: scipy for detrend and slope (fitted on the valid points of
+    # every row), xarray's weighted mean, NaNs skipped in all of them
+    from scipy.stats import linregress
+    y = y.astype(np.float64)
+    t = np.arange(y.shape[-1])
+    slope = np.full(y.shape[0], np.nan)
+    detrended = np.full(y.shape, np.nan)
+    for i, row in enumerate(y):
+        valid = ~np.isnan(row)
+        slope[i] = linregress(t[valid], row[valid]).slope
+        detrended[i] = row - slope[i] * (t - t[valid].mean())
+    weighted = xr.DataArray(y, dims = ['point', 'x']).weighted(xr.DataArray(w.astype(np.float64), dims = ['x'])).mean('x', skipna = True).values
+    return {'detrend': detrended, 'slope': slope, 'weighted_mean': weighted}
+
+def _error(result, expected):
+    # max absolute difference, inf if the NaNs are not in the same places
+    result = np.asarray(result, dtype = np.float64)
+    if not np.array_equal(np.isnan(result), np.isnan(expected)):
+        return np.inf
+    return float(np.nanmax(np.abs(result - expected), initial = 0))
+
+def parity_check(dtype = np.float32):
+    # max difference of every kernel and backend from the scipy/xarray references, on complete
+    # data and with NaNs; raises AssertionError above TOLERANCE
+    from scipy.signal import detrend as scipy_detrend
+    y, y_nan, w = _examples(dtype = dtype)
+    reference = _references(y_nan, w)
+    complete = _references(y, w)
+    complete['detrend'] = scipy_detrend(y.astype(np.float64), axis = -1) + y.astype(np.float64).mean(axis = -1, keepdims = True)
+    tolerance = TOLERANCE[np.dtype(dtype).type]
+    report = {}
+    for name in ['detrend', 'slope', 'weighted_mean']:
+        for skipna, data, expected in [(False, y, complete[name]), (True, y_nan, reference[name])]:
+            args = (data, w) if name == 'weighted_mean' else (data,)
+            label = ('nan' if skipna else '') + name
+            report[label] = {backend: _error(kernel(name, skipna, backend)(*args), expected)
+                             for backend in ['numpy', 'numba'] if backend == 'numpy' or active_backend() == 'numba'}
+            print(f'{label:>16}: ' + ', '.join(f'{backend} {error:.1e}' for backend, error in report[label].items()))
+    failed = {label: errors for label, errors in report.items() if not max(errors.values()) <= tolerance}
+    assert not failed, f'kernels differ from the references by more than {tolerance}: {failed}'
+    return report
+
+def benchmark(shape = (42 * 361, 420), repeat = 5):
+    # best-of-repeat time per kernel and backend on a (plev*lat, time) block
+    y, y_nan, w = _examples(shape)
+    times = {}
+    for name in ['detrend', 'slope', 'weighted_mean']:
+        for skipna, data in [(False, y), (True, y_nan)]:
+            args = (data, w) if name == 'weighted_mean' else (data,)
+            for backend in ['numpy', 'numba']:
+                if backend == 'numba' and active_backend() != 'numba':
+                    continue
+                function = kernel(name, skipna, backend)
+                function(*args) # compile
+                best = min(_timed(function, args) for _ in range(repeat))
+                times[(('nan' if skipna else '') + name, backend)] = best
+                print(f'{("nan" if skipna else "") + name:>16} {backend:>6}: {best * 1e3:7.2f} ms')
+    return times
+
+def _timed(function, args):
+    start = timer.perf_counter()
+    function(*args)
+    return timer.perf_counter() - start
+
+if __name__ == '__main__':
+    print(f'backend: {active_backend()}')
+    parity_check()
+    parity_check(np.float64)
+    benchmark()
@@ -1,26 +1,84 @@
+import os
+import glob
 import xarray as xr
 import numpy as np
-from scipy.interpolate import interp1d
-from scipy.signal import detrend
-from scipy.stats import linregress
-from dask.diagnostics import ProgressBar
+from refs import open_reference
+from storage import write_compressed, write_zarr
+from segments import group_trend
+from kernels import detrend, weighted_mean, kernel
+from precision import weights_for
 
 # Sylvia Whang siw2111@barnard.edu, Spring 2025
 # net cdf helper functions 
+# heavy or optional libraries (zarr) are imported inside the functions that use them and no file
+# is opened at import, so a worker importing these helpers starts fast
 
-def cdf_merge(files_path, savename, concat_dim,  variable):
-    # ex. files path \home\data\*.nc
-    print(f'merging files... {files_path}')
-    xrds = xr.open_mfdataset(files_path, combine = 'nested', concat_dim = concat_dim, chunks = 'auto')
-    xrds = xrds[[variable]] # select temperature
+def subset(variables, levels = None, plev = 'lev'):
+    # preprocess hook for open_mfdataset: keep only the requested variables (and levels) of each
+    # file before anything is concatenated
+    variables = [variables] if isinstance(variables, str) else list(variables)
+    def preprocess(xrds):
+        xrds = xrds[variables]
+        if levels is not None:
+            xrds = xrds.sel({plev: levels})
+        return xrds
+    return preprocess
+
+def cdf_merge(files_path, savename, concat_dim,  variable, keepbits = None, levels = None, plev = 'lev', append = False):
+    # ex. files path \home\data\*.nc, variable may be a list.
+    # files are opened in parallel and subset on open; savename ending in .zarr is written
+    # chunk-parallel and append = True adds only files not yet in the store. Output is lossless
+    # unless keepbits is given (bit-rounded, float32, see storage.py)
+    files = sorted(glob.glob(files_path)) if isinstance(files_path, str) else list(files_path)
+    zarr_out = savename.rstrip('/').endswith('.zarr')
+    merged = []
+    if append:
+        if not zarr_out:
+            raise ValueError(f'appending needs a .zarr store, not {savename}')
+        if os.path.exists(savename):
+            merged = xr.open_zarr(savename).attrs.get('merged_files', [])
+            files = [f for f in files if f not in merged]
+            if not files:
+                print(f'nothing to append to... {savename}')
+                return None
+        else:
+            append = False # first run creates the store
+
+    print(f'merging {len(files)} files into... {os.path.abspath(savename)}')
+    xrds = xr.open_mfdataset(files, combine = 'nested', concat_dim = concat_dim, chunks = {},
+                             parallel = True, preprocess = subset(variable, levels, plev))
     print(xrds)
 
-    print(f"saving to... {savename}")
-    xrds.to_netcdf(savename) # Export netcdf file
-    print(f'saved as... {savename}')
-    
+    if not zarr_out:
+        write_compressed(xrds, savename, keepbits, time = concat_dim)
+        return xrds
+
+    if append:
+        # whole-store chunks stay aligned: the first new chunk fills the partial last one
+        existing = xr.open_zarr(savename)
+        xrds = xrds.sel({concat_dim: xrds[concat_dim] > existing[concat_dim][-1]})
+        size = existing[list(existing.data_vars)[0]].encoding['chunks'][0]
+        fill = size - existing.sizes[concat_dim] % size
+        xrds = xrds.chunk({concat_dim: _append_chunks(xrds.sizes[concat_dim], fill, size)})
+        write_zarr(xrds.drop_vars([name for name in xrds.coords if concat_dim not in xrds[name].dims]), savename, keepbits, append_dim = concat_dim)
+    else:
+        xrds = xrds.chunk({concat_dim: 12}) # one year of monthly fields per chunk
+        write_zarr(xrds, savename, keepbits)
+
+    # record which files are in the store, so the next append skips them
+    import zarr
+    group = zarr.open_group(savename, mode = 'a', zarr_format = 2)
+    group.attrs['merged_files'] = merged + files
+    zarr.consolidate_metadata(savename)
     return xrds
 
+def _append_chunks(n, fill, size):
+    # (fill, size, size, ..., rest) along the append dimension
+    chunks = [min(fill, n)]
+    while sum(chunks) < n:
+        chunks.append(min(size, n - sum(chunks)))
+    return tuple(chunks)
+
 def sort_coordinate(xrds):
     xrds = xrds.sortby('time') # sort time for MERRA2
 
@@ -39,58 +97,95 @@ def replace_coordinate(xrds):
 
     return xrds
 
+def zonal_mean(xrds, lon):
+    # zonal mean, skipped if xrds is already a zonal-mean cube (no lon dimension)
+    if lon not in xrds.dims:
+        return xrds
+    return xrds.mean(dim = lon)
+
 def area_weighted_mean(xrds, lat, lon):
-    # create weights
-    weights = np.cos(np.deg2rad(xrds[lat]))
-    weights.name = "weights"
+    # create weights, in the data dtype so float32 fields stay float32
+    weights = weights_for(xrds, lat)
     
-    # take weighted mean
-    xrds_weighted = xrds.weighted(weights)
-    weighted_mean = xrds_weighted.mean(dim = [lat, lon])
-    return weighted_mean
+    # take NaN-aware weighted mean with the compiled kernel (kernels.py), lon is skipped for zonal-mean cubes
+    dims = [dim for dim in [lat, lon] if dim in xrds.dims]
+    return weighted_mean(xrds, weights, dims)
+
+def coarsen_lat(xrds, resolution, lat = 'lat'):
+    # area-weighted (cos lat) means over latitude bands of width resolution degrees
+    # resolution = None keeps the native grid
+    if resolution is None or resolution == 'native':
+        return xrds
+    edges = np.arange(-90, 90 + resolution, resolution)
+    centers = (edges[:-1] + edges[1:]) / 2
+    band = np.clip(np.digitize(xrds[lat].values, edges[1:-1]), 0, len(centers) - 1)
+    occupied = np.unique(band)
+
+    # (band, lat) weight matrix, applied as one contraction over lat
+    matrix = np.zeros((len(occupied), len(band)), dtype = weights_for(xrds, lat).dtype)
+    matrix[np.searchsorted(occupied, band), np.arange(len(band))] = np.cos(np.deg2rad(xrds[lat].values))
+    matrix = xr.DataArray(matrix, dims = ['band', lat])
+
+    def band_mean(da):
+        total = xr.dot(da.fillna(0), matrix, dim = lat)
+        weights = xr.dot(da.notnull(), matrix, dim = lat)
+        coarse = (total / weights).transpose(*[dim if dim != lat else 'band' for dim in da.dims])
+        return coarse
+
+    if isinstance(xrds, xr.Dataset):
+        coarse = xrds[[name for name in xrds.data_vars if lat in xrds[name].dims]].map(band_mean)
+    else:
+        coarse = band_mean(xrds)
+    coarse = coarse.rename({'band': lat}).assign_coords({lat: centers[occupied]})
+    return coarse
 
 def area_weighted_mean_2(xrds, lat):
     # create weights
-    weights = np.cos(np.deg2rad(xrds[lat]))
-    weights.name = "weights"
+    weights = weights_for(xrds, lat)
     
     # take weighted mean
-    xrds_weighted = xrds.weighted(weights)
-    weighted_mean = xrds_weighted.mean(dim = [lat])
-    return weighted_mean
-
-def detrend_fct(xrds):
-    xrds = xrds.dropna(dim = 'plev', how = 'any') # find a better way to do this.
-    const = xrds['ta'].mean(dim = 'time')
-    detrended_temp = xr.apply_ufunc(
-    detrend, xrds['ta'],
-    kwargs={"axis": xrds['ta'].get_axis_num('time'), "type": "linear"},
-    dask="parallelized")
-    xrds['ta'] = detrended_temp + const
+    return weighted_mean(xrds, weights, [lat])
+
+def field_names(xrds, time = 'time'):
+    # float data variables along time, i.e. the fields (not bounds or labels)
+    return [name for name in xrds.data_vars if time in xrds[name].dims and np.issubdtype(xrds[name].dtype, np.floating)]
+
+def drop_nan_levels(xrds, plev = 'plev', by = None):
+    # levels with missing values are masked per variable (e.g. O3 levels no longer hide ta and
+    # ua ones) and per entry of the by dimensions (e.g. per source of a stacked cube); only levels
+    # missing everywhere are dropped. For one variable and no by this is
+    # xrds.dropna(dim = plev, how = 'any')
+    keep = {plev} | set([by] if isinstance(by, str) else by or [])
+    def mask(da):
+        if plev not in da.dims:
+            return da
+        return da.where(da.notnull().all([dim for dim in da.dims if dim not in keep]))
+    if isinstance(xrds, xr.DataArray):
+        if by is None:
+            return xrds.dropna(dim = plev, how = 'any')
+        return mask(xrds).dropna(dim = plev, how = 'all')
+    return xrds.map(mask, keep_attrs = True).dropna(dim = plev, how = 'all')
+
+def detrend_fct(xrds, plev = 'plev'):
+    xrds = drop_nan_levels(xrds, plev)
+    # linear detrend keeping the mean, in the data dtype (scipy's detrend upcasts to float64),
+    # every float variable (ta, ua, o3 ...) in the same pass, compiled kernel (kernels.py)
+    xrds = xrds.assign(detrend(xrds[field_names(xrds)], 'time'))
     return xrds
 
 def linear_fit(x):
-    fit = linregress(np.arange(len(x)), x)
-    return fit.slope
+    # OLS slope against 0..n-1 (was linregress), NaN-aware
+    return kernel('slope')(np.asarray(x, dtype = float))
 
-def find_trend(xrds):
-    xrds = xrds.dropna(dim = 'plev', how = 'any') # find a better way to do this.
+def find_trend(xrds, plev = 'plev'):
+    xrds = drop_nan_levels(xrds, plev)
     print(xrds)
     
-    xrds = xrds.groupby('time.year').mean(dim = 'time')
-    trend = xr.apply_ufunc(linear_fit, 
-    xrds['ta'].chunk(dict(year  = -1)),
-    input_core_dims=[['year']],
-    vectorize = True,
-    dask="parallelized")
-    
-    xrds['ta'] = trend
-    xrds = xrds.chunk('auto')
-
-    xrds = xrds.mean(dim = 'year')
+    # slope of the annual means, float64 sums but the data dtype out (linregress upcasts)
+    xrds = group_trend(xrds[field_names(xrds)], 'time')
     xrds = xrds * 10 # convert /year to /decade
 
-    return xrds # trend K/decade
+    return xrds # trend per decade (K/decade for ta)
 
 def difference(model, rean):
     # select common pressure levels
@@ -122,9 +217,13 @@ def interpolate_plev(xrds1, xrds2):
     print(xrds1_interp)
     return xrds1_interp
 
-def concat_era(era5 = xr.open_dataset('/dx02/siw2111/ERA-5/ERA-5_T.nc', chunks = 'auto'), era51 = xr.open_dataset('/dx02/siw2111/ERA-5/ERA-5.1/ERA5-1-gridded.nc', chunks = 'auto')):
-    # insert era5.1 2000-2006 data into era5
-    
+def concat_era(era5 = None, era51 = None):
+    # insert era5.1 2000-2006 data into era5, files opened on call (not at import)
+    if era5 is None:
+        era5 = open_reference('ERA-5')
+    if era51 is None:
+        era51 = open_reference('ERA-5.1')
+
     era5_pre = era5.sel(valid_time = slice('1980-01-01', '1999-12-01'))
     era5_post = era5.sel(valid_time = slice('2006-02-01', '2024-01-01'))
     era51_concat = xr.concat([era5_pre, era51, era5_post], dim = 'valid_time')
@@ -160,7 +259,7 @@ def interpolate(xrds1, xrds2):
     return xrds1_interp
 
 if __name__ == '__main__':
-    xrds = xr.open_dataset('/dx02/siw2111/MERRA-2/MERRA-2_TEMP_ALL-TIME.nc4', chunks = 'auto')
+    xrds = open_reference('MERRA-2')
     xrds = xrds.sortby('time')
     xrds = xrds.sel(time = slice('1980-01-01', '2014-01-12'))
     xrds = xrds.rename({'lat':'lat', 'lon':'lon', 'lev':'plev', 'time': 'time', 'T':'ta'})
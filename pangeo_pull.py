@@ -1,23 +1,31 @@
-import intake
-from intake import open_catalog
+import os
 import xarray as xr
-from matplotlib import pyplot as plt
 import numpy as np
-from reanalyses_plots import plot_annual
-from ncf_funct import sort_coordinate, area_weighted_mean, concat_era
-from matplotlib.ticker import MultipleLocator
+from ncf_funct import sort_coordinate, area_weighted_mean
+from ingest import open_region, HI_MODEL_LI, LO_MODEL_LI, PULL_ERRORS
+from plan import run
+from refs import open_reference
 
 # Sylvia Whang siw2111@barnard.edu, Spring 2025. 
 # function pangeo_pull to access models from panGeo database -- made to access one dataset at a time. 
 # trend_plot used to make time series of all models together as in Figs 6-17 of phonebook.
+# intake and matplotlib are imported on use, so workers pulling or reducing data never load them.
 
-def pangeo_pull(source_id = 'GISS-E2-1G', institution_id = 'NASA-GISS', variable_id = 'ta', experiment_id = 'historical', grid_label = 'gn', table_id = 'Amon', dict = False):
-# Load the catalog
-    url = 'https://storage.googleapis.com/cmip6/pangeo-cmip6.json'
-    #print(url)
-    cat = intake.open_esm_datastore(url, progressbar = True) # cat = catalogue
-    #print(cat)
-    cat_subset = cat.search(
+CATALOG_URL = 'https://storage.googleapis.com/cmip6/pangeo-cmip6.json'
+
+_catalog = None
+
+def open_catalog():
+    # the pangeo CMIP6 catalog, read once per process
+    global _catalog
+    if _catalog is None:
+        import intake
+        _catalog = intake.open_esm_datastore(CATALOG_URL, progressbar = True) # cat = catalogue
+    return _catalog
+
+def catalog_search(source_id, variable_id = 'ta', experiment_id = 'historical', table_id = 'Amon'):
+    cat = open_catalog()
+    return cat.search(
         experiment_id = experiment_id,
         variable_id = variable_id,
         #grid_label = grid_label,
@@ -26,6 +34,24 @@ def pangeo_pull(source_id = 'GISS-E2-1G', institution_id = 'NASA-GISS', variable
         #institution_id = institution_id, 
         member_id = 'r1i1p1f1'
     )
+
+def model_stores(source_id, experiment_id = 'historical', variable_id = 'ta', table_id = 'Amon'):
+    # zarr stores and catalog versions of a model, the identity of its inputs for sweep.py;
+    # experiment_id and variable_id may be lists (e.g. historical and a scenario)
+    stores = []
+    for experiment in np.atleast_1d(experiment_id):
+        for variable in np.atleast_1d(variable_id):
+            df = catalog_search(source_id, str(variable), str(experiment), table_id).df
+            if len(df) == 0:
+                raise IndexError(f'{source_id} {experiment} {variable} {table_id} is not in the catalog')
+            stores += [{'zstore': row.zstore, 'version': getattr(row, 'version', None)} for row in df.itertuples()]
+    return stores
+
+def pangeo_pull(source_id = 'GISS-E2-1G', institution_id = 'NASA-GISS', variable_id = 'ta', experiment_id = 'historical', grid_label = 'gn', table_id = 'Amon', dict = False, readahead = False):
+# Load the catalog
+    cat = open_catalog()
+    #print(cat)
+    cat_subset = catalog_search(source_id, variable_id, experiment_id, table_id)
     print(cat_subset)
     print(cat_subset.df.head())
     unique = cat_subset.unique()
@@ -34,9 +60,14 @@ def pangeo_pull(source_id = 'GISS-E2-1G', institution_id = 'NASA-GISS', variable
 
     # convert to dictionary of xarray datasets. 
     cat.esmcat.aggregation_control
-    dset_dict = cat_subset.to_dataset_dict(
-        xarray_open_kwargs={"consolidated": True, "decode_times": True, "use_cftime": True}
-    )
+    if readahead:
+        # stores read through chunk_fetch (concurrent range requests, readahead in dask order;
+        # compute with chunk_fetch.compute) instead of the default fsspec store
+        dset_dict = readahead_dataset_dict(cat_subset.df)
+    else:
+        dset_dict = cat_subset.to_dataset_dict(
+            xarray_open_kwargs={"consolidated": True, "decode_times": True, "use_cftime": True}
+        )
     print(dset_dict)
     print(f' number of files: {len(dset_dict)}')
     
@@ -48,15 +79,72 @@ def pangeo_pull(source_id = 'GISS-E2-1G', institution_id = 'NASA-GISS', variable
 
     return(xrds)
 
+def readahead_dataset_dict(df):
+    # to_dataset_dict keys and member_id dimension, one ReadaheadStore per zarr store
+    from chunk_fetch import open_remote
+    dset_dict = {}
+    keys = ['activity_id', 'institution_id', 'source_id', 'experiment_id', 'table_id', 'grid_label']
+    for key, rows in df.groupby(keys):
+        members = [open_remote(row.zstore, decode_times = xr.coders.CFDatetimeCoder(use_cftime = True)).expand_dims(member_id = [row.member_id])
+                   for row in rows.itertuples()]
+        dset_dict['.'.join(key)] = xr.concat(members, dim = 'member_id') if len(members) > 1 else members[0]
+    return dset_dict
+
+def model_calendar(xrds, time = 'time'):
+    # calendar of a decoded (cftime or datetime64) or encoded time axis
+    values = xrds[time].values
+    if np.issubdtype(values.dtype, np.datetime64):
+        return 'proleptic_gregorian'
+    calendar = getattr(values[0], 'calendar', None) or xrds[time].encoding.get('calendar', 'standard')
+    return 'standard' if calendar == 'gregorian' else calendar
+
+def check_stitch(historical, scenario, time = 'time'):
+    # calendars and grids must match before the scenario can continue the historical run
+    calendars = (model_calendar(historical, time), model_calendar(scenario, time))
+    if calendars[0] != calendars[1]:
+        raise ValueError(f'calendars differ: historical {calendars[0]}, scenario {calendars[1]}')
+    for coord in ['lat', 'lon', 'plev']:
+        if coord not in historical.coords:
+            continue
+        a, b = historical[coord].values, scenario[coord].values
+        if a.shape != b.shape or not np.allclose(a, b):
+            raise ValueError(f'{coord} grids differ: historical {a.shape}, scenario {b.shape}')
+
+def concat_scenario(historical, scenario, time = 'time'):
+    # model counterpart of concat_era: historical (to 2014) continued by an ssp run (2015 on).
+    # both stay lazy, only the chunk lists are joined; overlapping scenario months are dropped
+    check_stitch(historical, scenario, time)
+    scenario = scenario.isel({time: scenario[time].values > historical[time].values[-1]})
+    names = [name for name in historical.data_vars if name in scenario.data_vars]
+    scenario = scenario.assign_coords({coord: historical[coord] for coord in ['lat', 'lon', 'plev'] if coord in historical.coords})
+    stitched = xr.concat([historical[names], scenario[names]], dim = time,
+                         data_vars = 'minimal', coords = 'minimal', compat = 'override', join = 'exact')
+    return stitched
+
+def pangeo_pull_extended(source_id, institution_id = '', scenario = 'ssp245', variable_id = 'ta', table_id = 'Amon'):
+    # historical + scenario record of one model, e.g. for 1980-2024 comparisons with ERA-5.1
+    historical = pangeo_pull(source_id, institution_id, variable_id = variable_id, table_id = table_id)
+    future = pangeo_pull(source_id, institution_id, variable_id = variable_id, experiment_id = scenario, table_id = table_id)
+    members = np.intersect1d(historical['member_id'].values, future['member_id'].values)
+    historical, future = historical.sel(member_id = members), future.sel(member_id = members)
+    if 'dcpp_init_year' in historical.dims:
+        historical = historical.mean(dim = ['dcpp_init_year'])
+    if 'dcpp_init_year' in future.dims:
+        future = future.mean(dim = ['dcpp_init_year'])
+    return concat_scenario(historical, future)
+
 # make a plot
-def group_year(xrds, time, lat, lon, model = True): # pre-process data for each pressure level
-    xrds = xrds.groupby(f'{time}.year').mean()
-    xrds = area_weighted_mean(xrds, lat, lon)
+def group_year(xrds, time, lat, lon, model = True, sel = {}, variable = 'ta'): # pre-process data for each pressure level
+    # annual global means; the plan runs the subsets and the area mean before the annual mean
+    year_plan = [('vars', [variable]), ('group_mean', time, 'year'), ('area_mean', lat, lon)]
+    if sel:
+        year_plan.append(('sel', sel))
     if model:
-        xrds = xrds.sel(member_id = 'r1i1p1f1')
-    return xrds
+        year_plan.append(('sel', {'member_id': 'r1i1p1f1'}))
+    return run(xrds, year_plan)
 
 def line_plot():
+    from matplotlib import pyplot as plt
     model = pangeo_pull('GISS-E2-1-G')
     plev = model.coords['plev'].values
     model = model.assign_coords(plev = np.divide(plev,100).round(1)) # convert from pa to hpa
@@ -71,7 +159,7 @@ def line_plot():
     print(model)
     xr.plot.line(model['ta'], x = 'time', color = 'b', label = 'GISS-E2-1-G monthly mean' , zorder = 5)
 
-    merra2 = xr.open_dataset('/dx02/siw2111/MERRA-2/MERRA-2_TEMP_ALL-TIME.nc4', chunks = 'auto')
+    merra2 = open_reference('MERRA-2')
     merra2 = sort_coordinate(merra2) # sort time    
     merra2 = area_weighted_mean(merra2, 'lat', 'lon')
     merra2 = merra2.sel(lev =1e+01)
@@ -88,132 +176,87 @@ def line_plot():
     plt.savefig('/home/siw2111/cmip6_reanalyses_comp/model_plots/04-03-2025/GISS_MERRA_line.png')
 
 
-def trend_plot(level, savename):
-    # set color map
-    fig = plt.figure(figsize = (7,5))
-    ax = fig.add_subplot()
-    '''number_models = 20
-    colormap = plt.cm.nipy_spectral
-    colors = colormap(np.linspace(0, 1, number_models))
-    ax.set_prop_cycle('color', colors)'''
-    
-    hi_model_li = ['EC-Earth3',
-                    'EC-Earth3-CC',  
-                    'EC-EARTH3-Veg',
-                    'E3SM-1-1', 
-                    'MRI-ESM2-0',
-                    'IPSL-CM6A-LR',
-                    'GISS-E2-1-H', 
-                    'GISS-E2-1-G',
-                    'INM-CM5-0',
-                    'CESM2-WACCM', 
-                    'MPI-ESM1-2-HR', 
-                    'MPI-ESM1-2-LR',
-                    'IITM-ESM',
-                    'AWI-CM-1-1-MR', 
-                    'ACCESS-CM2',
-                    'KACE-1-0-G', 
-                    'MIROC6'] 
-         
-    lo_model_li = ['ACCESS-ESM1-5',
-                'BCC-CSM2-MR', 
-                'CAMS-CSM1-0',
-                'CanESM5',
-                'CAS-ESM2-0',
-                'CESM2',
-                'CIESM',
-                'CMCC-CM2-SR5', 
-                'CMCC-ESM2',
-                'EC-Earth3-Veg-LR',
-                'FGOALS-f3-L',
-                'FGOALS-g3', 
-                'FIO-ESM-2-0',
-                'GFDL-CM4',
-                'GFDL-ESM4', 
-                'INM-CM4-8',
-                'KIOST-ESM',
-                'MIROC-ES2L',
-                'NESM3',
-                'NorESM2-LM',
-                'NorESM2-MM',
-                'TaiESM1']
-    i = 0
-    for id in lo_model_li:
-        try:
-            print(f'plotting {id}----------------------------------')
-            model = pangeo_pull(id, '')
-            plev = model.coords['plev'].values
-            model = model.assign_coords(plev = np.divide(plev,100).round(1)) # convert from pa to hpa
-                        
-            model_10 = group_year(model.sel(plev = level), time = 'time', lon = 'lon', lat = 'lat') # annual mean, mean over latitude, longitude
-            
-            if i == 0:
-                ax.plot(model_10['year'], model_10['ta'], label = 'low-top', linewidth = 0.75, color = 'b', zorder = 5, linestyle = 'dotted')
-                model.close()
-            else: 
-                ax.plot(model_10['year'], model_10['ta'], linewidth = 0.75, color = 'b', linestyle = 'dotted')
-        
-        except:
-            print(f'error: unable to plot {id}')
-            continue
-        i+= 1
-    
-    i = 0
-    for id in hi_model_li:
-        try: 
-            print(f'plotting {id}----------------------------------')
-            model = pangeo_pull(id, '')
-            plev = model.coords['plev'].values
-            model = model.assign_coords(plev = np.divide(plev,100).round(1)) # convert from pa to hpa
-            
-            model_10 = group_year(model.sel(plev = level), time = 'time', lon = 'lon', lat = 'lat') # annual mean, mean over latitude, longitude
-            if i == 0:
-                ax.plot(model_10['year'], model_10['ta'], label = 'high-top', linewidth = 0.75, color = 'r', zorder = 1)
-                model.close()
-            else: 
-                ax.plot(model_10['year'], model_10['ta'], linewidth = 0.75, color = 'r')
-        except:
-            print(f'error: unable to plot {id}')
-            continue
-        i+=1
+def region_year(name, levels, regions, variable = 'ta'):
+    # (region, plev, year) annual means of every requested level and region of one source,
+    # read once from the region tier and computed together. levels the source lacks (e.g. a
+    # model top below 1 hPa) come back as NaN, so the other levels still get its line
+    xrds = open_region(name)
+    levels = list(np.atleast_1d(levels))
+    available = [level for level in levels if np.isin(level, xrds['plev'].values)]
+    if len(available) < len(levels):
+        print(f'{name} has no {sorted(set(levels) - set(available))} hPa level(s)')
+    year_plan = [('vars', [variable]), ('sel', {'region': regions}), ('sel', {'plev': available}), ('group_mean', 'time', 'year')]
+    series = run(xrds, year_plan).compute()
+    xrds.close()
+    return series.reindex(plev = levels)
 
-    era5 = concat_era()
-    era5_10 = group_year(era5.sel(pressure_level = level), time = 'valid_time', lon = 'longitude', lat = 'latitude', model = False)
-    xr.plot.line(era5_10['t'], x = 'year', label = 'reanalysis', color = 'k', linewidth = 0.75, zorder = 10)
-    era5.close()
+def trend_plot(levels, savename, regions = ['global']):
+    # one figure per (level, region); levels and regions may be single values or lists.
+    # savename may contain {level} and {region}, otherwise they are appended to the file name
+    from matplotlib import pyplot as plt
+    from matplotlib.ticker import MultipleLocator
+    levels = list(np.atleast_1d(levels))
+    regions = list(np.atleast_1d(regions))
+    panels = [(level, region) for level in levels for region in regions]
 
-    merra2 = xr.open_dataset('/dx02/siw2111/MERRA-2/MERRA-2_TEMP_ALL-TIME.nc4', chunks = 'auto')
-    merra2 = sort_coordinate(merra2) # sort time
-    merra2_10 = group_year(merra2.sel(lev = level), time = 'time', lon = 'lon', lat = 'lat', model = False)
-    xr.plot.line(merra2_10['T'], x = 'year', color = 'k', linewidth = 0.75)
-    merra2.close()
+    figs = {}
+    for panel in panels:
+        fig = plt.figure(figsize = (7,5))
+        ax = fig.add_subplot()
+        figs[panel] = (fig, ax)
+    labelled = set()
 
-    jra55 = xr.open_dataset('/dx02/siw2111/JRA-55/JRA-55_T_interpolated.nc', chunks = 'auto')
-    jra55_10 = group_year(jra55.sel(pressure_level = level), time = 'initial_time0_hours', lon = 'longitude', lat = 'latitude', model = False)
-    xr.plot.line(jra55_10['TMP_GDS4_HYBL_S123'], x = 'year', color = 'k', linewidth = 0.75)
-    jra55.close()
+    def add_lines(series, label, **kwargs):
+        for panel, (fig, ax) in figs.items():
+            level, region = panel
+            line = series.sel(plev = level, region = region)
+            if (panel, label) not in labelled:
+                ax.plot(line['year'], line['ta'], label = label, **kwargs)
+                labelled.add((panel, label))
+            else:
+                ax.plot(line['year'], line['ta'], **kwargs)
 
-    plt.title(f'Temperature as a Function of Time at {level} hpa ')
-   
-    plt.xlabel('time YYYY')
-    plt.xlim(1980,2014)
+    for top, model_li, style in [('low-top', LO_MODEL_LI, {'linewidth': 0.75, 'color': 'b', 'zorder': 5, 'linestyle': 'dotted'}),
+                                 ('high-top', HI_MODEL_LI, {'linewidth': 0.75, 'color': 'r', 'zorder': 1})]:
+        for id in model_li:
+            try:
+                print(f'plotting {id}----------------------------------')
+                add_lines(region_year(id, levels, regions), top, **style)
+            except PULL_ERRORS as e:
+                print(f'error: unable to plot {id}: {e}')
+                continue
 
-    ax.set_ylabel('temperature K')
-    print(f'saving to...{savename}')
-    
-    fig.subplots_adjust(right=0.8) # 0.7 normally
-    fig.legend(ncols = 1, fontsize = 'small', loc = 7)
-    ax.yaxis.set_major_locator(MultipleLocator(5))  # Tick every 5 on y-axis
-    ax.yaxis.set_minor_locator(MultipleLocator(1))  # Tick every 5 on y-axis
-    ax.yaxis.set_ticks_position('both')  
+    # reanalyses from the regional-mean tier
+    for name in ['ERA-5.1', 'MERRA-2', 'JRA-55']:
+        add_lines(region_year(name, levels, regions), 'reanalysis', color = 'k', linewidth = 0.75, zorder = 10)
+
+    for (level, region), (fig, ax) in figs.items():
+        if region == 'global':
+            ax.set_title(f'Temperature as a Function of Time at {level} hpa ')
+        else:
+            ax.set_title(f'Temperature as a Function of Time at {level} hpa, {region}')
+        ax.set_xlabel('time YYYY')
+        ax.set_xlim(1980,2014)
+        ax.set_ylabel('temperature K')
 
-    plt.savefig(savename, dpi = 300)
+        fig.subplots_adjust(right=0.8) # 0.7 normally
+        fig.legend(ncols = 1, fontsize = 'small', loc = 7)
+        ax.yaxis.set_major_locator(MultipleLocator(5))  # Tick every 5 on y-axis
+        ax.yaxis.set_minor_locator(MultipleLocator(1))  # Tick every 5 on y-axis
+        ax.yaxis.set_ticks_position('both')  
 
-    plt.close()
+        name = savename.format(level = level, region = region)
+        if len(panels) > 1 and name == savename:
+            root, ext = os.path.splitext(savename)
+            name = f'{root}_{level}hpa_{region}{ext}'
+        print(f'saving to...{name}')
+        fig.savefig(name, dpi = 300)
+        plt.close(fig)
 
 
 # make a climatoligcal plot
 def plot_climatology(xrds, savename):
+    from reanalyses_plots import plot_annual
     xrds_zonal = xrds.sel(time = slice('1980-01-01', '2014-12-01'))
     xrds_zonal = xrds_zonal.sel(member_id = 'r1i1p1f1')
     plev = xrds_zonal.coords['plev'].values
@@ -229,7 +272,8 @@ def plot_climatology(xrds, savename):
                 variable = 'ta')
 
 if __name__ == '__main__':
-    trend_plot(10, '/home/siw2111/cmip6_reanalyses_comp/model_plots/05-22-2025/10_line_1980-2014.png')
+    trend_plot([1, 5, 10, 50, 70, 100], '/home/siw2111/cmip6_reanalyses_comp/model_plots/05-22-2025/{level}_line_{region}_1980-2014.png',
+               regions = ['global', '60-90N', '60-90S'])
 
 
 
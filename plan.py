@@ -0,0 +1,151 @@
+import numpy as np
+from ncf_funct import zonal_mean, area_weighted_mean, coarsen_lat, drop_nan_levels
+from segments import group_mean, group_detrend, label_values
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# reduction plans: a chain of helper calls written as a list of op tuples, e.g.
+#   [('vars', ['ta']), ('group_mean', 'time', 'year'), ('area_mean', 'lat', 'lon'), ('sel', {'plev': 10})]
+# Spatial means, time means, subsets and detrending are linear, so ops that act on different
+# dimensions commute. optimize() moves subsets first and spatial reductions before time
+# reductions, so the expensive time ops see the smallest array. The result is the same up to
+# floating point. Levels with missing values are dropped by an explicit ('drop_nan_levels', ...)
+# op, as detrend_fct does; it needs the whole field, so only level subsets move ahead of it, and
+# it stays in the plan when the detrend after it is removed.
+#
+# ops:
+#   ('vars', [names])               keep data variables
+#   ('sel', {dim: value})           label subset, one dimension per op after optimize()
+#   ('label_sel', time, label, v)   keep times whose label (season, month, year ...) is in v
+#   ('zonal_mean', lon)
+#   ('area_mean', lat, lon)         cos(lat) weighted, lon skipped if already zonal
+#   ('coarsen', lat, resolution)    latitude bands (coarsen_lat)
+#   ('mean', [dims])
+#   ('group_mean', time, label)     segments.group_mean
+#   ('detrend', time, label)        segments.group_detrend, label None = whole series
+#   ('drop_nan_levels', plev, by)   ncf_funct.drop_nan_levels, levels with any missing value,
+#                                   judged per entry of the by dimensions (by optional)
+
+PRIORITY = {'vars': 0, 'sel': 0, 'label_sel': 0,
+            'zonal_mean': 1, 'area_mean': 1, 'coarsen': 1, 'mean': 1,
+            'group_mean': 2, 'detrend': 2, 'drop_nan_levels': 2}
+
+def op_dims(op):
+    # dimensions an op reads along, reduces or creates
+    kind = op[0]
+    if kind == 'vars':
+        return set()
+    if kind == 'sel':
+        return set(op[1])
+    if kind in ['zonal_mean']:
+        return {op[1]}
+    if kind == 'area_mean':
+        return {op[1], op[2]}
+    if kind == 'coarsen':
+        return {op[1]}
+    if kind == 'mean':
+        return set(op[1])
+    # label_sel, group_mean, detrend
+    return {op[1], op[2]} - {None}
+
+def commute(a, b):
+    # a time subset by label commutes with grouped ops on the same label (they work per group)
+    for x, y in [(a, b), (b, a)]:
+        if x[0] == 'label_sel' and y[0] in ['group_mean', 'detrend'] and x[1:3] == y[1:3]:
+            return True
+        # which levels are complete depends on every other dimension: only subsets of the level
+        # (keeping the level dimension) and by dimensions can pass the level drop
+        if x[0] == 'drop_nan_levels':
+            plev, by = x[1], x[2] if len(x) > 2 else None
+            if y[0] != 'sel' or not set(y[1]) <= {plev} | set([by] if isinstance(by, str) else by or []):
+                return False
+            return plev not in y[1] or isinstance(y[1][plev], slice) or np.ndim(y[1][plev]) > 0
+    return not (op_dims(a) & op_dims(b))
+
+def _split(plan):
+    # one dimension per sel so each subset can move on its own
+    split = []
+    for op in plan:
+        if op[0] == 'sel' and len(op[1]) > 1:
+            split += [('sel', {dim: value}) for dim, value in op[1].items()]
+        else:
+            split.append(op)
+    return split
+
+def _push_label_sel(plan):
+    # sel(season = 'DJF') after a seasonal group_mean also becomes a time subset ahead of it,
+    # so only DJF months are detrended and averaged
+    pushed = list(plan)
+    for i, op in enumerate(plan):
+        if op[0] != 'sel':
+            continue
+        (dim, value), = op[1].items()
+        for j in range(i - 1, -1, -1):
+            if plan[j][0] == 'group_mean' and plan[j][2] == dim:
+                values = list(np.atleast_1d(value))
+                pushed.insert(pushed.index(plan[j]), ('label_sel', plan[j][1], dim, values))
+                break
+    return pushed
+
+def _drop_redundant_detrend(plan):
+    # detrending keeps each group's mean, so a detrend straight before the mean of the same groups
+    # does nothing; a drop_nan_levels ahead of it is kept
+    kept = []
+    for i, op in enumerate(plan):
+        if op[0] == 'detrend' and i + 1 < len(plan):
+            after = plan[i + 1]
+            if after[0] == 'group_mean' and after[1:3] == op[1:3]:
+                continue
+            if op[2] is None and after[0] == 'mean' and list(after[1]) == [op[1]]:
+                continue
+        kept.append(op)
+    return kept
+
+def optimize(plan):
+    # stable insertion sort by priority: every op moves left past the ops it commutes with,
+    # as far as the last more expensive op it can get ahead of
+    plan = _push_label_sel(_split(plan))
+    for i in range(1, len(plan)):
+        op = plan[i]
+        target = i
+        j = i - 1
+        while j >= 0 and commute(op, plan[j]):
+            if PRIORITY[plan[j][0]] > PRIORITY[op[0]]:
+                target = j
+            j -= 1
+        plan.insert(target, plan.pop(i))
+    return _drop_redundant_detrend(plan)
+
+def run_op(xrds, op):
+    kind = op[0]
+    if kind == 'vars':
+        return xrds[op[1]]
+    if kind == 'sel':
+        return xrds.sel(op[1])
+    if kind == 'label_sel':
+        time, label, values = op[1:]
+        return xrds.isel({time: np.isin(label_values(xrds, time, label), values)})
+    if kind == 'zonal_mean':
+        return zonal_mean(xrds, op[1])
+    if kind == 'area_mean':
+        return area_weighted_mean(xrds, op[1], op[2])
+    if kind == 'coarsen':
+        return coarsen_lat(xrds, op[2], op[1])
+    if kind == 'mean':
+        return xrds.mean(dim = op[1])
+    if kind == 'group_mean':
+        return group_mean(xrds, op[1], op[2])
+    if kind == 'detrend':
+        return group_detrend(xrds, op[1], op[2])
+    if kind == 'drop_nan_levels':
+        return drop_nan_levels(xrds, *op[1:])
+    raise ValueError(f'unknown op {kind}')
+
+def run(xrds, plan, reorder = True, verbose = False):
+    # lazy: every op is an xarray/dask call, nothing is computed here
+    if reorder:
+        plan = optimize(plan)
+    if verbose:
+        print('plan: ' + ' -> '.join(op[0] for op in plan))
+    for op in plan:
+        xrds = run_op(xrds, op)
+    return xrds
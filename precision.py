@@ -0,0 +1,69 @@
+import numpy as np
+import xarray as xr
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# precision policy. Monthly fields are stored and computed in float32 (half the memory and
+# bandwidth of float64); weights and other factors follow the data dtype so nothing promotes.
+# Sums in the mean/detrend/trend kernels (segments.py) accumulate per group in float64, so
+# long records do not lose precision. Coordinates (lat, plev, time) stay float64: they are
+# small and never broadcast against the data. validation_report() compares against float64.
+
+PRECISION = 'float32'
+
+def set_precision(precision):
+    # 'float32' or 'float64' for every later open/compute
+    global PRECISION
+    PRECISION = precision
+
+def compute_dtype():
+    return np.dtype(PRECISION)
+
+def as_compute(xrds):
+    # cast float data variables to the policy dtype, lazily
+    def cast(da):
+        if np.issubdtype(da.dtype, np.floating) and da.dtype != compute_dtype():
+            return da.astype(compute_dtype())
+        return da
+    if isinstance(xrds, xr.DataArray):
+        return cast(xrds)
+    return xrds.map(cast, keep_attrs = True)
+
+def weights_for(xrds, lat):
+    # cos(lat) area weights in the dtype of the data
+    weights = np.cos(np.deg2rad(xrds[lat]))
+    if isinstance(xrds, xr.Dataset):
+        dtypes = [da.dtype for da in xrds.data_vars.values() if np.issubdtype(da.dtype, np.floating)]
+    else:
+        dtypes = [xrds.dtype]
+    weights = weights.astype(np.result_type(*dtypes) if dtypes else compute_dtype())
+    weights.name = 'weights'
+    return weights
+
+def validation_report(xrds, variable = 'ta', time = 'time', lat = 'lat', lon = 'lon'):
+    # run the main reductions in float32 and float64 and print max absolute differences
+    from ncf_funct import zonal_mean, area_weighted_mean
+    from segments import group_mean, group_detrend, group_trend
+
+    kernels = {'zonal mean': lambda x: zonal_mean(x, lon),
+               'area mean': lambda x: area_weighted_mean(x, lat, lon),
+               'seasonal mean': lambda x: group_mean(zonal_mean(x, lon), time, 'season'),
+               'seasonal detrend': lambda x: group_detrend(zonal_mean(x, lon), time, 'season'),
+               'trend K/decade': lambda x: group_trend(zonal_mean(x, lon), time) * 10}
+
+    xrds = xrds[[variable]]
+    single = xrds.astype(np.float32)
+    double = xrds.astype(np.float64)
+    report = {}
+    print(f'float32 {single[variable].nbytes / 2**20:.0f} MiB, float64 {double[variable].nbytes / 2**20:.0f} MiB')
+    for name, kernel in kernels.items():
+        result32 = kernel(single)[variable]
+        result64 = kernel(double)[variable]
+        error = float(abs(result32.astype(np.float64) - result64).max())
+        scale = float(abs(result64).max())
+        report[name] = {'dtype': str(result32.dtype), 'max_error': error, 'relative': error / scale if scale else 0}
+        print(f'{name:>18}: {str(result32.dtype):>8} max error {error:.2e} (relative {report[name]["relative"]:.1e})')
+    return report
+
+if __name__ == '__main__':
+    from ingest import open_source
+    validation_report(open_source('MERRA-2', ('1980', '2014')))
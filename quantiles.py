@@ -0,0 +1,188 @@
+import numpy as np
+import xarray as xr
+from segments import label_values
+from storage import write_compressed
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# streaming per-gridpoint quantile sketches (merging t-digest). Each (label, plev, lat) point keeps
+# at most delta/2 + 1 weighted centroids, small in the tails and large near the median, built one
+# time block at a time and merged across blocks, models or reanalyses. Compression is vectorized
+# over all points: centroids are sorted, given a cluster index from the t-digest scale function
+# k(q) = delta/(2 pi) asin(2q - 1), and merged with one np.bincount. Percentiles come from the
+# stored sketch, e.g. the 5th and 95th percentile polar-night temperature, without re-reading data.
+
+DELTA = 100 # compression, more centroids = more accurate tails
+TIME_BLOCK = 120 # months per block when the data is not dask-chunked in time
+
+def n_centroids(delta = DELTA):
+    return int(np.ceil(delta / 2)) + 1
+
+def _compress(means, weights, delta):
+    # (..., n) centroids -> (..., n_centroids) merged centroids, empty slots have weight 0
+    size = n_centroids(delta)
+    weights = np.where(np.isnan(means), 0, weights)
+    order = np.argsort(np.where(weights > 0, means, np.inf), axis = -1)
+    means = np.take_along_axis(means, order, axis = -1)
+    weights = np.take_along_axis(weights, order, axis = -1)
+
+    total = weights.sum(axis = -1, keepdims = True)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        q = (np.cumsum(weights, axis = -1) - weights / 2) / total
+    k = delta / (2 * np.pi) * (np.arcsin(np.clip(2 * np.nan_to_num(q) - 1, -1, 1)) + np.pi / 2)
+    cluster = np.minimum(k.astype(int), size - 1)
+
+    # one bincount over every (point, cluster) pair
+    points = np.arange(np.prod(means.shape[:-1], dtype = int)).reshape(means.shape[:-1] + (1,))
+    index = (points * size + cluster).ravel()
+    length = points.size * size
+    weight = np.bincount(index, weights.ravel(), minlength = length)
+    moment = np.bincount(index, (np.where(weights > 0, means, 0) * weights).ravel(), minlength = length)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean = moment / weight
+    shape = means.shape[:-1] + (size,)
+    return mean.reshape(shape), weight.reshape(shape)
+
+def _block_kernel(y, codes, n_groups, delta):
+    # sketch of one time block: every value is a centroid of weight 1 in its group
+    member = codes[None, :] == np.arange(n_groups)[:, None] # (group, time)
+    weights = (member & ~np.isnan(y[..., None, :])).astype(np.float64)
+    means = np.broadcast_to(y[..., None, :], weights.shape).astype(np.float64)
+    empty = weights.sum(axis = -1) == 0
+    vmin = np.where(empty, np.nan, np.where(weights > 0, means, np.inf).min(axis = -1))
+    vmax = np.where(empty, np.nan, np.where(weights > 0, means, -np.inf).max(axis = -1))
+    mean, weight = _compress(means, weights, delta)
+    return mean, weight, vmin, vmax
+
+def _merge_kernel(means, weights, delta):
+    return _compress(means, weights, delta)
+
+def _compress_xr(sketch, delta):
+    # merge the centroids of a sketch whose centroid axis holds several sketches
+    sketch = sketch.chunk({'centroid': -1}) if sketch['mean'].chunks else sketch
+    mean, weight = xr.apply_ufunc(_merge_kernel, sketch['mean'], sketch['weight'],
+                                  input_core_dims = [['centroid'], ['centroid']],
+                                  output_core_dims = [['centroid'], ['centroid']],
+                                  exclude_dims = {'centroid'},
+                                  kwargs = {'delta': delta},
+                                  dask = 'parallelized',
+                                  dask_gufunc_kwargs = {'output_sizes': {'centroid': n_centroids(delta)}},
+                                  output_dtypes = [np.float64, np.float64])
+    return xr.Dataset({'mean': mean, 'weight': weight, 'min': sketch['min'], 'max': sketch['max']}, attrs = {'delta': delta})
+
+def _combine(sketches, delta):
+    # two or more sketches with the same points -> one, centroids concatenated then compressed
+    # join = 'exact': every sketch must be on the same grid, nothing is outer-joined
+    stacked = xr.Dataset({'mean': xr.concat([s['mean'] for s in sketches], dim = 'centroid', join = 'exact'),
+                          'weight': xr.concat([s['weight'] for s in sketches], dim = 'centroid', join = 'exact'),
+                          'min': xr.concat([s['min'] for s in sketches], dim = 'part', join = 'exact').min('part'),
+                          'max': xr.concat([s['max'] for s in sketches], dim = 'part', join = 'exact').max('part')})
+    return _compress_xr(stacked, delta)
+
+def build_sketch(da, time = 'time', label = 'season', delta = DELTA):
+    # (..., label, centroid) sketch of a DataArray, label = 'season', 'month' or None (all times)
+    labels = label_values(da, time, label)
+    groups, codes = np.unique(labels, return_inverse = True)
+    dim = label or 'group'
+    da = da.drop_vars([name for name in da.coords if name != time and da[name].dims == (time,)])
+
+    # time blocks: the dask chunks if there are any
+    if da.chunks:
+        bounds = np.cumsum((0,) + da.chunksizes[time])
+    else:
+        bounds = np.r_[np.arange(0, da.sizes[time], TIME_BLOCK), da.sizes[time]]
+
+    sketches = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        block = da.isel({time: slice(start, stop)})
+        mean, weight, vmin, vmax = xr.apply_ufunc(_block_kernel, block,
+                                                  input_core_dims = [[time]],
+                                                  output_core_dims = [[dim, 'centroid'], [dim, 'centroid'], [dim], [dim]],
+                                                  kwargs = {'codes': codes[start:stop], 'n_groups': len(groups), 'delta': delta},
+                                                  dask = 'parallelized',
+                                                  dask_gufunc_kwargs = {'output_sizes': {dim: len(groups), 'centroid': n_centroids(delta)}},
+                                                  output_dtypes = [np.float64] * 4)
+        sketches.append(xr.Dataset({'mean': mean, 'weight': weight, 'min': vmin, 'max': vmax}))
+
+    # pairwise tree merge of the block sketches
+    while len(sketches) > 1:
+        sketches = [_combine(sketches[i:i + 2], delta) if i + 1 < len(sketches) else sketches[i] for i in range(0, len(sketches), 2)]
+    sketch = sketches[0].assign_coords({dim: groups})
+    sketch.attrs['delta'] = delta
+    return sketch
+
+def merge_sketches(sketches, dim = None, delta = None):
+    # one sketch from a list of sketches (e.g. several reanalyses or models), or from the
+    # slices along dim of a single sketch (e.g. 'source'). All must share one grid (interpolate
+    # the fields first, e.g. zonal_sketch(..., plev, lat)), otherwise a ValueError is raised
+    if dim is not None:
+        sketches = [sketches.isel({dim: i}, drop = True) for i in range(sketches.sizes[dim])]
+    try:
+        xr.align(*sketches, join = 'exact')
+    except ValueError as e:
+        raise ValueError(f'sketches are on different grids, build them on a common grid first: {e}')
+    if delta is None:
+        delta = sketches[0].attrs.get('delta', DELTA)
+    return _combine(sketches, delta)
+
+def _quantile_kernel(means, weights, vmin, vmax, q):
+    # interpolate between centroid centres, anchored at the min and max
+    order = np.argsort(np.where(weights > 0, means, np.inf), axis = -1)
+    means = np.take_along_axis(means, order, axis = -1)
+    weights = np.take_along_axis(weights, order, axis = -1)
+    total = weights.sum(axis = -1, keepdims = True)
+    centres = np.cumsum(weights, axis = -1) - weights / 2
+    # empty slots sit at the top end with the max value
+    means = np.where(weights > 0, means, vmax[..., None])
+    positions = np.concatenate([np.zeros_like(total), centres, total], axis = -1)
+    values = np.concatenate([vmin[..., None], means, vmax[..., None]], axis = -1)
+
+    out = []
+    for quantile in np.atleast_1d(q):
+        target = quantile * total
+        upper = np.clip((positions < target).sum(axis = -1, keepdims = True), 1, positions.shape[-1] - 1)
+        x0, x1 = np.take_along_axis(positions, upper - 1, axis = -1), np.take_along_axis(positions, upper, axis = -1)
+        y0, y1 = np.take_along_axis(values, upper - 1, axis = -1), np.take_along_axis(values, upper, axis = -1)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            frac = np.where(x1 > x0, (target - x0) / (x1 - x0), 0)
+        out.append((y0 + frac * (y1 - y0))[..., 0])
+    out = np.stack(out, axis = -1)
+    return np.where(total > 0, out, np.nan)
+
+def sketch_quantile(sketch, q):
+    # (..., quantile) percentiles of a sketch, q in [0, 1] as in xarray's quantile
+    return xr.apply_ufunc(_quantile_kernel, sketch['mean'], sketch['weight'], sketch['min'], sketch['max'],
+                          input_core_dims = [['centroid'], ['centroid'], [], []],
+                          output_core_dims = [['quantile']],
+                          kwargs = {'q': q},
+                          dask = 'parallelized',
+                          dask_gufunc_kwargs = {'output_sizes': {'quantile': len(np.atleast_1d(q))}},
+                          output_dtypes = [np.float64]).assign_coords(quantile = np.atleast_1d(q))
+
+def save_sketch(sketch, savename):
+    # stored like the tiers; 12 kept bits leave counts below 4096 exact
+    write_compressed(sketch, savename, check_trend = False)
+    return savename
+
+def zonal_sketch(name, time_range = None, variable = 'ta', label = 'season', savename = None, plev = None, lat = None):
+    # (label, plev, lat) sketch of one source's zonal-mean field, from its tier if built;
+    # with plev and lat the field is interpolated to that grid first, so sketches merge
+    from ingest import open_source, TIER_DIR
+    from ncf_funct import zonal_mean
+    from cubes import to_common_grid
+    xrds = zonal_mean(open_source(name, time_range)[[variable]], 'lon')
+    if plev is not None and lat is not None:
+        xrds = to_common_grid(xrds, plev, lat)
+    sketch = build_sketch(xrds[variable], 'time', label)
+    if savename is None:
+        savename = f'{TIER_DIR}/{name}_{variable}_{label}_sketch.nc'
+    save_sketch(sketch, savename)
+    return sketch
+
+if __name__ == '__main__':
+    # 5th and 95th percentile polar-night (JJA, 60-90S) temperature of the reanalyses, each
+    # sketched on the grid of the reanalysis cube (common levels, latitudes of the first source)
+    from cubes import build_rean_cube
+    cube = build_rean_cube(('1980', '2014'), ['MERRA-2', 'JRA-55', 'ERA-5.1'])
+    sketches = [zonal_sketch(name, ('1980', '2014'), plev = cube['plev'].values, lat = cube['lat'].values) for name in cube['source'].values]
+    combined = merge_sketches(sketches)
+    print(sketch_quantile(combined.sel(season = 'JJA', lat = slice(-90, -60)), [0.05, 0.95]).compute())
@@ -0,0 +1,178 @@
+import json
+import time as timer
+import numpy as np
+import xarray as xr
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+from ncf_funct import area_weighted_mean
+from ingest import open_region, open_tier, TIER_DIR, HI_MODEL_LI, LO_MODEL_LI
+from cubes import month_start, REAN_LI
+from segments import group_mean
+from storage import write_compressed
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# query API over precomputed regional and zonal-band time series. build_series() stores the
+# (source, region, plev, time) monthly and (source, region, plev, year) annual means of every
+# source once; query() answers from memory with integer index lookups, e.g.
+#   query('MERRA-2', '60-90S', 10, ('1980', '2014'))                   annual series
+#   query(['MERRA-2', 'ERA-5.1', 'JRA-55'], 'global', [10, 50])        batch over sources and levels
+# serve() exposes the same through a small local http endpoint for dashboards.
+
+BAND_WIDTH = 10 # degrees, zonal bands stored next to the regions
+
+_STORE = {}
+
+def band_label(south, north):
+    # '0-10N', '10-20S' ...
+    if north <= 0:
+        return f'{-north}-{-south}S'
+    return f'{south}-{north}N'
+
+def band_means(zonal, lat = 'lat', width = BAND_WIDTH):
+    # (region, time, plev) cos-lat weighted means of zonal bands
+    band_li = []
+    labels = []
+    for south in range(-90, 90, width):
+        band = zonal.sel({lat: zonal[lat][(zonal[lat] >= south) & (zonal[lat] <= south + width)]})
+        band_li.append(area_weighted_mean(band, lat, 'lon'))
+        labels.append(band_label(south, south + width))
+    bands = xr.concat(band_li, dim = 'region')
+    return bands.assign_coords(region = labels)
+
+def source_series(name, variable = 'ta'):
+    # (region, time, plev) regions and bands of one source on first-of-month times
+    regions = open_region(name)[[variable]]
+    bands = band_means(open_tier(name, 'zonal')[[variable]])
+    series = xr.concat([regions, bands], dim = 'region', coords = 'minimal', compat = 'override')
+    series = series.drop_vars([name for name in series.coords if name not in ['region', 'time', 'plev']])
+    return month_start(series)
+
+def build_series(names = REAN_LI + HI_MODEL_LI + LO_MODEL_LI, savename = None, variable = 'ta'):
+    # one store for all sources, levels are the union (NaN where a source has no level)
+    if savename is None:
+        savename = f'{TIER_DIR}/series.nc'
+    series_li = []
+    id_li = []
+    for name in names:
+        try:
+            print(f'collecting series... {name}')
+            series_li.append(source_series(name, variable))
+            id_li.append(name)
+        except Exception as e:
+            print(f'error: unable to collect {name}: {e}')
+            continue
+
+    monthly = xr.concat(series_li, dim = 'source', join = 'outer').assign_coords(source = id_li)
+    monthly = monthly.transpose('source', 'region', 'plev', 'time')
+    annual = group_mean(monthly, 'time', 'year').transpose('source', 'region', 'plev', 'year')
+    store = xr.Dataset({'monthly': monthly[variable], 'annual': annual[variable]})
+    write_compressed(store, savename, check_trend = False)
+    _STORE.pop(savename, None)
+    return savename
+
+def load_series(savename = None):
+    # store in memory with label -> position lookups, read once per session
+    if savename is None:
+        savename = f'{TIER_DIR}/series.nc'
+    if savename not in _STORE:
+        start = timer.perf_counter()
+        store = xr.load_dataset(savename)
+        years = store['time'].values.astype('datetime64[Y]').astype(int) + 1970
+        _STORE[savename] = {'monthly': store['monthly'].values,
+                            'annual': store['annual'].values,
+                            'source': store['source'].values,
+                            'region': store['region'].values,
+                            'plev': store['plev'].values,
+                            'time': store['time'].values,
+                            'time_year': years,
+                            'year': store['year'].values,
+                            'index': {dim: {key: i for i, key in enumerate(store[dim].values.tolist())}
+                                      for dim in ['source', 'region', 'plev']}}
+        print(f'loaded {savename} in {timer.perf_counter() - start:.2f} s')
+    return _STORE[savename]
+
+def _positions(store, dim, keys):
+    scalar = np.ndim(keys) == 0
+    keys = np.atleast_1d(keys).tolist()
+    try:
+        positions = [store['index'][dim][key] for key in keys]
+    except KeyError as e:
+        raise KeyError(f'{dim} {e} not in the series store, available: {list(store["index"][dim])}')
+    return scalar, positions
+
+def query(sources, regions = 'global', plevs = 10, time_range = None, freq = 'annual', savename = None):
+    # slice of the store; scalar arguments drop their dimension (like .sel)
+    store = load_series(savename)
+    values = store[freq]
+    years = store['year'] if freq == 'annual' else store['time_year']
+    keep = np.ones(len(years), dtype = bool)
+    if time_range is not None:
+        keep = (years >= int(time_range[0])) & (years <= int(time_range[1]))
+
+    dims = []
+    coords = {}
+    index = []
+    for dim, keys in [('source', sources), ('region', regions), ('plev', plevs)]:
+        scalar, positions = _positions(store, dim, keys)
+        index.append(positions[0] if scalar else positions)
+        if scalar:
+            coords[dim] = store[dim][positions[0]]
+        else:
+            dims.append(dim)
+            coords[dim] = store[dim][positions]
+    time_dim = 'year' if freq == 'annual' else 'time'
+    dims.append(time_dim)
+    coords[time_dim] = store[time_dim][keep]
+
+    # one fancy-indexing step: lists become an open mesh, scalars drop their axis
+    mesh = [np.array(i) if np.ndim(i) else i for i in index]
+    if sum(np.ndim(i) > 0 for i in mesh) > 1:
+        mesh = _open_mesh(mesh)
+    selected = values[tuple(mesh)][..., keep]
+    return xr.DataArray(selected, dims = dims, coords = coords, name = 'ta')
+
+def _open_mesh(mesh):
+    # np.ix_ for the list-valued indices, scalars left in place
+    lists = [i for i in mesh if np.ndim(i)]
+    grids = list(np.ix_(*lists))
+    return [grids.pop(0) if np.ndim(i) else i for i in mesh]
+
+class QueryHandler(BaseHTTPRequestHandler):
+    # GET /query?source=MERRA-2,JRA-55&region=60-90S&plev=10&start=1980&end=2014&freq=annual
+    savename = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/query':
+            self.send_error(404)
+            return
+        params = {key: value[0] for key, value in parse_qs(url.query).items()}
+
+        def listed(key, default, cast = str):
+            values = [cast(value) for value in params.get(key, default).split(',')]
+            return values if len(values) > 1 else values[0]
+
+        try:
+            time_range = (params['start'], params['end']) if 'start' in params else None
+            result = query(listed('source', 'MERRA-2'), listed('region', 'global'), listed('plev', '10', float),
+                           time_range, params.get('freq', 'annual'), self.savename)
+        except (KeyError, ValueError) as e:
+            self.send_error(400, str(e))
+            return
+        body = json.dumps({'dims': list(result.dims),
+                           'coords': {dim: [str(value) for value in result[dim].values] for dim in result.dims},
+                           'values': np.where(np.isnan(result.values), None, result.values).tolist()}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve(port = 8050, savename = None):
+    load_series(savename) # read before the first request
+    QueryHandler.savename = savename
+    print(f'serving series queries on http://localhost:{port}/query')
+    HTTPServer(('localhost', port), QueryHandler).serve_forever()
+
+if __name__ == '__main__':
+    build_series()
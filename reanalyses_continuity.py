@@ -1,22 +1,25 @@
 import xarray as xr
-import matplotlib.pyplot as plt
-from matplotlib.colors import BoundaryNorm, ListedColormap
 import numpy as np
 from ncf_funct import area_weighted_mean, concat_era
+from harmonics import harmonic_anomaly
+from chunk_plan import conform
+from refs import open_reference
 
 # Sylvia Whang siw2111@barnard.edu, Spring 2025
 # Functions to recreate plots in Figure 3.3 of S-RIP, Global-mean temperature anomolies from monthly climatology. 
 
 def plot(xrds, savename, variable, lat, lon, lev, time):
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import BoundaryNorm, ListedColormap
     # try plotting MERRA2    
-    xrds = xrds.unify_chunks()
+    xrds = conform(xrds, ['area_mean', 'anomaly'], names = {'lat': lat, 'lon': lon, 'time': time})
     # find temperature anomaly at each pressure level from monthly climatological mean
     xrds = xrds[[variable]]
     xrds[variable] = xrds[variable]- 273  # convert K to celcius
-    xrds = area_weighted_mean(xrds, lat, lon).groupby(f'{time}.month')
-    xrds_clim_mean = xrds.mean(time)
-    print(xrds_clim_mean)
-    xrds_anom = xrds- xrds_clim_mean
+    xrds = area_weighted_mean(xrds, lat, lon)
+    # 6 harmonics = full monthly climatology, fitted together with the trend so the
+    # within-year part of the trend does not leak into the climatology
+    xrds_anom = harmonic_anomaly(xrds, time, k = 6)
     print(xrds_anom)
 
     # custom color map
@@ -46,7 +49,7 @@ def plot(xrds, savename, variable, lat, lon, lev, time):
 
 if __name__ == '__main__':
     
-    xrds = concat_era()
+    xrds = concat_era(open_reference('ERA-5'), open_reference('ERA-5.1'))
     xrds = xrds.sel(pressure_level = slice(1000,1))
     xrds = xrds.sel(valid_time = slice('1980-01-01','2024-01-01'))
     savename = '/home/siw2111/cmip6_reanalyses_comp/reanalyses_plots/03-03-2025/ERA51_anomaly_1980-2024.png'
@@ -1,13 +1,17 @@
+import os
+import dask
 import xarray as xr
-import matplotlib.pyplot as plt
 import numpy as np
-from ncf_funct import detrend_fct, difference, find_trend, concat_era
+from ncf_funct import detrend_fct, difference, find_trend, concat_era, zonal_mean, coarsen_lat, drop_nan_levels
+from ingest import open_source
+from cubes import build_rean_cube, pairwise_differences, difference_extremes
+from segments import group_mean, group_detrend, group_trend
 from datetime import datetime
-import colorcet as cc
 
 # Sylvia Whang siw2111@barnard.edu Spring 2025
 # Functions to make plots comparing reanalsyes as in Figs 2-3 of phonebook 
 # Helper Functions to find annual and seasonal zonal means and trends. 
+# matplotlib and colorcet are imported by the plotting functions only, the helpers stay plot-free.
 
 '''        Variable Names
             ERA5,              MERRA2,    JRA55 
@@ -19,238 +23,264 @@ Temperature: 't'       ,         'T'      'TMP_GDS4_HYBL_S123'
 U-wind        'u'       ,        'U'          
 Ozone:         'o3'               'O3'                       '''
 
-# helper functions
+# per-variable units and contour configuration, keyed by standard name; the names used in
+# each file (table above) are aliases. scale converts the stored units to the plotted ones.
+# each figure has its own contours: zonal_means (plot_zonal_means, vmin/vmax and a number of
+# levels), annual (plot_annual), compare and difference (compare_rean). cmap is a colorcet or
+# matplotlib colormap name resolved when plotting (see colormap)
+VARIABLE_CONFIG = {'ta': {'long_name': 'Temperature', 'units': 'K', 'scale': 1,
+                          'zonal_means': {'vmin': 185, 'vmax': 275, 'levels': 19, 'cmap': 'jet'},
+                          'annual': {'levels': [180, 185, 190, 195, 200, 205, 210, 215, 220, 225, 230, 235, 240, 245, 250, 255, 260, 265, 270, 275, 280, 285, 290, 295, 300],
+                                     'cmap': 'rainbow_bgyr_10_90_c83'},
+                          'compare': {'levels': [175, 180, 185, 190, 195, 200, 205, 210, 215, 220, 225, 230, 235, 240, 245, 250, 255, 260, 265, 270, 275, 280, 285, 290, 295, 300],
+                                      'cmap': 'rainbow4'},
+                          'difference': {'levels': [-50, -30, -20, -18, -16, -14, -12, -10, -8, -6, -4, -2, -1, 1, 2, 4, 6, 8, 10, 12, 14, 16, 18, 20, 30, 50],
+                                         'cmap': 'CET_D9'}},
+                   'ua': {'long_name': 'Zonal Wind', 'units': 'm/s', 'scale': 1,
+                          'zonal_means': {'vmin': -60, 'vmax': 60, 'levels': 25, 'cmap': 'CET_D9'},
+                          'annual': {'levels': [-60, -50, -40, -30, -25, -20, -15, -10, -5, 0, 5, 10, 15, 20, 25, 30, 40, 50, 60],
+                                     'cmap': 'CET_D9'},
+                          'compare': {'levels': [-60, -50, -40, -30, -25, -20, -15, -10, -5, 0, 5, 10, 15, 20, 25, 30, 40, 50, 60],
+                                      'cmap': 'CET_D9'},
+                          'difference': {'levels': [-20, -15, -10, -8, -6, -4, -2, -1, 1, 2, 4, 6, 8, 10, 15, 20],
+                                         'cmap': 'CET_D9'}},
+                   'o3': {'long_name': 'Ozone', 'units': 'ppmv', 'scale': 1e6 * 28.97 / 48.00, # kg/kg to ppmv
+                          'zonal_means': {'vmin': 0, 'vmax': 12, 'levels': 25, 'cmap': 'rainbow4'},
+                          'annual': {'levels': [0, 0.5, 1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5, 5, 5.5, 6, 6.5, 7, 7.5, 8, 9, 10, 11, 12],
+                                     'cmap': 'rainbow4'},
+                          'compare': {'levels': [0, 0.5, 1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5, 5, 5.5, 6, 6.5, 7, 7.5, 8, 9, 10, 11, 12],
+                                      'cmap': 'rainbow4'},
+                          'difference': {'levels': [-2, -1.5, -1, -0.8, -0.6, -0.4, -0.2, -0.1, 0.1, 0.2, 0.4, 0.6, 0.8, 1, 1.5, 2],
+                                         'cmap': 'CET_D9'}}}
+
+VARIABLE_ALIASES = {'T': 'ta', 't': 'ta', 'TMP_GDS4_HYBL_S123': 'ta',
+                    'U': 'ua', 'u': 'ua',
+                    'O3': 'o3'}
+
+def variable_config(variable):
+    return VARIABLE_CONFIG[VARIABLE_ALIASES.get(variable, variable)]
+
+def colormap(name):
+    # colorcet colormap from its name, colorcet is loaded on the first plot; other names
+    # (e.g. 'jet') are passed on to matplotlib
+    import colorcet as cc
+    return cc.cm[name] if name in cc.cm else name
+
+def variable_list(variable):
+    # 'ta' or ['T', 'U', 'O3']
+    return [variable] if isinstance(variable, str) else list(variable)
 
-def annual_zonal_mean(xrds, lon, time, variable):
-    xrds = xrds[[variable]]
-    zonal_mean_xrds = xrds.mean(dim = [lon, time])
+# helper functions
+# all helpers accept full fields or zonal-mean tier cubes (see ingest.py)
+# resolution = latitude band width in degrees for quick-look figures, None = native grid
+# variable may be a list: every variable is reduced in the same lazy graph, so one compute
+# reads each chunk once for all of them (see zonal_products)
+
+def annual_zonal_mean(xrds, lon, time, variable, resolution = None, plev = 'plev'):
+    xrds = xrds[variable_list(variable)]
+    zonal_mean_xrds = coarsen_lat(zonal_mean(xrds, lon), resolution).mean(dim = time)
     #print(zonal_mean_xrds)
     return zonal_mean_xrds
 
-def annual_zonal_mean_detrended(xrds, lon, time, variable):
-    xrds = xrds[[variable]]
-    xrds = xrds.mean(dim = lon)
-    xrds = detrend_fct(xrds)
+def annual_zonal_mean_detrended(xrds, lon, time, variable, resolution = None, plev = 'plev'):
+    xrds = xrds[variable_list(variable)]
+    xrds = coarsen_lat(zonal_mean(xrds, lon), resolution)
+    xrds = detrend_fct(xrds, plev)
     zonal_mean_xrds = xrds.mean(dim = time)
     
     return zonal_mean_xrds
 
-def seasonal_zonal_mean(xrds, lon, time, variable):
-    xrds = xrds[[variable]]
-    seasonal_xrds = xrds.groupby(f"{time}.season").mean(time)        
-    seasonal_xrds = seasonal_xrds.mean(dim = [lon])
+def seasonal_zonal_mean(xrds, lon, time, variable, resolution = None, plev = 'plev'):
+    xrds = xrds[variable_list(variable)]
+    xrds = coarsen_lat(zonal_mean(xrds, lon), resolution)
+    seasonal_xrds = group_mean(xrds, time, 'season')
     #print(seasonal_xrds)
     return seasonal_xrds
 
-def seasonal_zonal_mean_detrended(xrds, lon, time, variable):
-    xrds = xrds[[variable]]
-    xrds = xrds.mean(dim = [lon])
+def seasonal_zonal_mean_detrended(xrds, lon, time, variable, resolution = None, plev = 'plev'):
+    xrds = xrds[variable_list(variable)]
+    xrds = coarsen_lat(zonal_mean(xrds, lon), resolution)
 
-    seasonal_xrds = xrds.groupby(f"{time}.season").map(detrend_fct)
-    seasonal_xrds = seasonal_xrds.groupby(f"{time}.season").mean(dim = time)
+    xrds = drop_nan_levels(xrds, plev)
+    seasonal_xrds = group_mean(group_detrend(xrds, time, 'season'), time, 'season')
     
     return seasonal_xrds
 
-def seasonal_zonal_trend(xrds, lon, time, variable):
+def seasonal_zonal_trend(xrds, lon, time, variable, resolution = None, plev = 'plev'):
     print(f'finding seasonal trends...')
-    xrds = xrds[[variable]]
-    xrds = xrds.mean(dim = lon)
-    seasonal_xrds = xrds.groupby(f"{time}.season").map(find_trend)    
+    xrds = xrds[variable_list(variable)]
+    xrds = coarsen_lat(zonal_mean(xrds, lon), resolution)
+    xrds = drop_nan_levels(xrds, plev)
+    seasonal_xrds = group_trend(xrds, time, 'season') * 10 # per decade, all seasons in one pass
     return seasonal_xrds
 
-def annual_zonal_trend(xrds, lon, time, variable):
+def annual_zonal_trend(xrds, lon, time, variable, resolution = None, plev = 'plev'):
     print(f'finding annual trend...')
-    xrds = xrds[[variable]]
-    xrds = xrds.mean(dim = lon)
-    xrds = find_trend(xrds)
+    xrds = xrds[variable_list(variable)]
+    xrds = coarsen_lat(zonal_mean(xrds, lon), resolution)
+    xrds = find_trend(xrds, plev)
     return xrds
 
+ZONAL_PRODUCTS = {'annual': annual_zonal_mean,
+                  'annual_detrended': annual_zonal_mean_detrended,
+                  'seasonal': seasonal_zonal_mean,
+                  'seasonal_detrended': seasonal_zonal_mean_detrended,
+                  'seasonal_trend': seasonal_zonal_trend,
+                  'annual_trend': annual_zonal_trend}
+
+def zonal_products(xrds, lon, time, variable, products = ['annual', 'seasonal'], resolution = None, plev = 'plev'):
+    # {product: Dataset of all variables}, computed together: the shared read and zonal mean
+    # run once for every variable and product
+    lazy = {product: ZONAL_PRODUCTS[product](xrds, lon, time, variable, resolution, plev) for product in products}
+    return dict(zip(lazy.keys(), dask.compute(*lazy.values())))
+
+def figure_name(savename, variable, n_variables):
+    # savename may contain {variable}, otherwise it is appended when there are several
+    name = savename.format(variable = variable)
+    if n_variables > 1 and name == savename:
+        root, ext = os.path.splitext(savename)
+        name = f'{root}_{variable}{ext}'
+    return name
+
 # plotting functions
 
-def plot_zonal_means(xrds, savename, lat, lon, lev, time, variable, title):
-    # Goal create a 1 x 5 plot of climatological zonal means
-    fig, axes = plt.subplots(nrows=5, ncols=1, figsize=(10, 25), sharex = False, layout = 'constrained')
-    vmin, vmax, levels, cmap = 185, 275, 19, 'jet' # configure
-    
-    annual_xrds = annual_zonal_mean(xrds, lon, time, variable, title)
+def plot_zonal_means(xrds, savename, lat, lon, lev, time, variable, title, resolution = None):
+    # Goal create a 1 x 5 plot of climatological zonal means, one figure per variable
+    import matplotlib.pyplot as plt
+    variables = variable_list(variable)
+    products = zonal_products(xrds, lon, time, variables, ['annual', 'seasonal'], resolution, lev)
     #annual_xrds = xr.open_dataset('/dx02/siw2111/MERRA-2/MERRA2_T_zonal_annual')
-    print(annual_xrds)
-    xr.plot.contourf(annual_xrds[variable],
-            x = lat,
-            y = lev, 
-            yincrease =  False,
-            add_colorbar=True,
-            add_labels = False,
-            ax=axes[0],
-            vmin= vmin,
-            vmax= vmax,
-            cmap= cmap,
-            extend="both",
-            levels = levels,
-            yscale = 'log',
-            ylim = (1000, 1))
-    xr.plot.contour(annual_xrds[variable],
-            x = lat,
-            y = lev, 
-            yincrease =  False,
-            add_colorbar= False,
-            add_labels = False,
-            ax=axes[0],
-            vmin= vmin,
-            vmax= vmax,
-            colors ="k",
-            levels = levels,
-            yscale = 'log',
-            ylim = (1000, 1))
-    annual_xrds.close()
-    
-    axes[0].set_ylim(1000,1)
-    axes[0].set_ylabel('Pressure (hPa)', fontsize = 15)
-    axes[0].set_title('Annual', fontsize = 15)
-    
-    seasonal_xrds  = seasonal_zonal_mean(xrds, lon, time, variable, title)
-    #seasonal_xrds = xr.open_dataset('/dx02/siw2111/JRA-55/JRA55_T_zonal_seasonal')
-    print(seasonal_xrds)
-    for i, season in enumerate(("DJF", "MAM", "JJA", "SON")):
-        xr.plot.contourf(seasonal_xrds[variable].sel(season=season), 
-            x = lat,
-            y = lev, 
-            yincrease =  False,
-            add_colorbar=True,
-            add_labels = False,
-            ax=axes[i + 1],
-            vmin= vmin,
-            vmax= vmax,
-            cmap= cmap,
-            extend="both",
-            levels = levels,
-            yscale = 'log',
-            ylim = (1000, 1))
-        xr.plot.contour(seasonal_xrds[variable].sel(season = season),
-            x = lat,
-            y = lev, 
-            yincrease =  False,
-            add_colorbar= False,
-            add_labels = False,
-            ax=axes[i + 1],
-            vmin= vmin,
-            vmax= vmax,
-            colors ="k",
-            levels = levels,
-            yscale = 'log',
-            ylim = (1000, 1))
+    print(products['annual'])
+
+    for variable in variables:
+        config = variable_config(variable)
+        contours = config['zonal_means']
+        vmin, vmax, levels, cmap = contours['vmin'], contours['vmax'], contours['levels'], colormap(contours['cmap']) # configure
+        annual = products['annual'][variable] * config['scale']
+        seasonal = products['seasonal'][variable] * config['scale']
+
+        fig, axes = plt.subplots(nrows=5, ncols=1, figsize=(10, 25), sharex = False, layout = 'constrained')
+        for i, (label, field) in enumerate([('Annual', annual)] + [(season, seasonal.sel(season = season)) for season in ("DJF", "MAM", "JJA", "SON")]):
+            xr.plot.contourf(field,
+                x = lat,
+                y = lev, 
+                yincrease =  False,
+                add_colorbar=True,
+                cbar_kwargs= {'label': config['units']},
+                add_labels = False,
+                ax=axes[i],
+                vmin= vmin,
+                vmax= vmax,
+                cmap= cmap,
+                extend="both",
+                levels = levels,
+                yscale = 'log',
+                ylim = (1000, 1))
+            xr.plot.contour(field,
+                x = lat,
+                y = lev, 
+                yincrease =  False,
+                add_colorbar= False,
+                add_labels = False,
+                ax=axes[i],
+                vmin= vmin,
+                vmax= vmax,
+                colors ="k",
+                levels = levels,
+                yscale = 'log',
+                ylim = (1000, 1))
 
-        axes[i+1].set_ylabel('Pressure (hPa)', fontsize = 15)
-        axes[i+1].set_title(season, fontsize = 15)
-        axes[i+1].set_ylim(1000, 1)
-    seasonal_xrds.close()
+            axes[i].set_ylabel('Pressure (hPa)', fontsize = 15)
+            axes[i].set_title(label, fontsize = 15)
+            axes[i].set_ylim(1000, 1)
 
-    axes[4].set_xlabel('Latitude (Deg N)', fontsize = 15)
-    fig.suptitle("CMIP6 Zonal Mean Temperature 2000-2014" , fontsize= 20)
-    
-    print(f' saving to... {savename}')
-    plt.savefig(savename, dpi = 250)
+        axes[4].set_xlabel('Latitude (Deg N)', fontsize = 15)
+        fig.suptitle(f"CMIP6 Zonal Mean {config['long_name']} 2000-2014" , fontsize= 20)
+        
+        name = figure_name(savename, variable, len(variables))
+        print(f' saving to... {name}')
+        fig.savefig(name, dpi = 250)
+        plt.close(fig)
+
+def plot_annual(xrds, lon, lat, lev, time, variable, savename, resolution = None):
+    # one figure per variable, all annual means from one compute
+    import matplotlib.pyplot as plt
+    variables = variable_list(variable)
+    annual_xrds = zonal_products(xrds, lon, time, variables, ['annual'], resolution, lev)['annual']
+
+    for variable in variables:
+        config = variable_config(variable)
+        boundaries = config['annual']['levels']
+        label = f"{config['long_name']}, {config['units']}"
+        plt.figure(figsize = (12,6), layout = 'constrained')
+        xr.plot.contourf(annual_xrds[variable] * config['scale'],
+                x = lat,
+                y = lev, 
+                yincrease =  False,
+                add_colorbar=True,
+                cbar_kwargs= {'label':label, 'drawedges':True, 'ticks':boundaries},
+                levels = boundaries,
+                add_labels = False,
+                cmap= colormap(config['annual']['cmap']),
+                extend="neither",
+                yscale = 'log',
+                ylim = (1000, 1))
+        cs = xr.plot.contour(annual_xrds[variable] * config['scale'],
+                x = lat,
+                y = lev, 
+                yincrease =  False,
+                add_colorbar= False,
+                add_labels = False,
+                linewidths = 0.5,
+                colors ="k",
+                levels = boundaries,
+                yscale = 'log',
+                ylim = (1000, 1))
+        plt.clabel(cs, cs.levels, fontsize=10)
+        
+        cbar = plt.gca().collections[0].colorbar  # Get the colorbar object
+        cbar.ax.tick_params(length=0)
+        cbar.ax.set_ylabel(label, fontsize=12) 
 
-def plot_annual(xrds, lon, lat, lev, time, variable, savename):
-    annual_xrds = annual_zonal_mean(xrds, lon, time, variable)
+        plt.ylim(1000,1)
+        plt.ylabel('Pressure, hPa', fontsize = 12)
+        plt.xlabel('Latitude, deg N', fontsize = 12)
+        plt.title(f"GISS-E2-1-G Zonal Mean {config['long_name']} (Annual 1980-2014)", fontsize = 15)
 
-    boundaries = [180, 185, 190, 195, 200, 205, 210, 215, 220, 225, 230, 235, 240, 245, 250, 255, 260, 265, 270, 275, 280, 285, 290, 295, 300]
-    plt.figure(figsize = (12,6), layout = 'constrained')
-    xr.plot.contourf(annual_xrds[variable],
-            x = lat,
-            y = lev, 
-            yincrease =  False,
-            add_colorbar=True,
-            cbar_kwargs= {'label':'Temperature, K', 'drawedges':True, 'ticks':boundaries},
-            levels = boundaries,
-            add_labels = False,
-            cmap= cc.cm.rainbow_bgyr_10_90_c83,
-            extend="neither",
-            yscale = 'log',
-            ylim = (1000, 1))
-    cs = xr.plot.contour(annual_xrds[variable],
-            x = lat,
-            y = lev, 
-            yincrease =  False,
-            add_colorbar= False,
-            add_labels = False,
-            linewidths = 0.5,
-            colors ="k",
-            levels = boundaries,
-            yscale = 'log',
-            ylim = (1000, 1))
-    plt.clabel(cs, cs.levels, fontsize=10)
+        name = figure_name(savename, variable, len(variables))
+        print(f'saving to... {name}')
+        plt.savefig(name, dpi = 300)
+        plt.close()
     annual_xrds.close()
-    
-    cbar = plt.gca().collections[0].colorbar  # Get the colorbar object
-    cbar.ax.tick_params(length=0)
-    cbar.ax.set_ylabel('Temperature, K', fontsize=12) 
-
-    plt.ylim(1000,1)
-    plt.ylabel('Pressure, hPa', fontsize = 12)
-    plt.xlabel('Latitude, deg N', fontsize = 12)
-    plt.title('GISS-E2-1-G Zonal Mean Temperature (Annual 1980-2014)', fontsize = 15)
-
-    print(f'saving to... {savename}')
-    plt.savefig(savename, dpi = 300)
 
 
 # Compare climatology and trends of JRA-55 or ERA-5.1 reanlayses to MERRA-2
 
 # calculate climatology or trends and compute difference. 
-def load_reans(time_range:tuple):
-
-    time_slice = slice(f'{time_range[0]}-01-01', f'{time_range[1]}-12-01')
-
-    # load reanalysis
-    rean = xr.open_dataset('/dx02/siw2111/MERRA-2/MERRA-2_TEMP_ALL-TIME.nc4', chunks = 'auto')
-    rean = rean.rename({'lat':'lat', 'lon':'lon', 'lev':'plev', 'time': 'time', 'T':'ta'})
-    rean = rean.sel(plev = slice(1000,1))
-    
-    rean = rean.sortby('time')
-    rean = rean.sel(time = time_slice)
-    
-   # load ERA-5.1
-    '''model = concat_era()
-    model = model.rename({'latitude':'lat', 'longitude':'lon', 'pressure_level':'plev', 'valid_time': 'time', 't':'ta'})'''
-
-    # load JRA-55
-    model = xr.open_dataset('/dx02/siw2111/JRA-55/JRA-55_T.nc', chunks = 'auto')
-    model = model.rename({'g4_lat_2':'lat', 'g4_lon_3':'lon', 'lv_HYBL1':'plev', 'initial_time0_hours': 'time', 'TMP_GDS4_HYBL_S123':'ta'})
-    
-    rean_lev = rean['plev']
-    model = model.interp(plev = rean_lev)
-    
-    model = model.sel(plev = slice(1000,1))
-    model =model.sel(time = time_slice)
-
-    # if finding trends...
-    '''annual_model = annual_zonal_trend(model, 'lon', 'time', 'ta')
-    seasonal_model = seasonal_zonal_trend(model, 'lon', 'time', 'ta')
-
-    annual_rean = annual_zonal_trend(rean, 'lon', 'time', 'ta')
-    seasonal_rean = seasonal_zonal_trend(rean, 'lon', 'time', 'ta')'''
+def load_reans(time_range:tuple, resolution = None, name = 'JRA-55', ref = 'MERRA-2', trend = False, variable = 'ta'):
+    # resolution = 2 or 5 for draft figures from the coarse pyramid levels
+    # all reanalyses are reduced together on a common grid (see cubes.py), name and ref pick the pair
 
-    # if finding means...
-    annual_model = annual_zonal_mean(model, 'lon', 'time', 'ta')
-    seasonal_model = seasonal_zonal_mean(model, 'lon', 'time', 'ta')
+    cube = build_rean_cube(time_range, variable = variable, resolution = resolution)
 
-    annual_rean = annual_zonal_mean(rean, 'lon', 'time', 'ta')
-    seasonal_rean = seasonal_zonal_mean(rean, 'lon', 'time', 'ta')
+    if trend:
+        annual = annual_zonal_trend(cube, 'lon', 'time', variable, resolution)
+        seasonal = seasonal_zonal_trend(cube, 'lon', 'time', variable, resolution)
+    else:
+        annual = annual_zonal_mean(cube, 'lon', 'time', variable, resolution)
+        seasonal = seasonal_zonal_mean(cube, 'lon', 'time', variable, resolution)
 
-    xrds_li = [(annual_model, annual_rean), (seasonal_model, seasonal_rean)]
-    diff_li = []
+    annual_model = annual.sel(source = name)
+    seasonal_model = seasonal.sel(source = name)
 
-    for model, rean in xrds_li:
-        diff = difference(model, rean)
-        print(diff)
-        diff_li.append(diff)
+    annual_rean = annual.sel(source = ref)
+    seasonal_rean = seasonal.sel(source = ref)
 
-    annual_diff = diff_li[0] 
-    seasonal_diff = diff_li[1] 
+    annual_diff = pairwise_differences(annual).sel(source = name, other = ref)
+    seasonal_diff = pairwise_differences(seasonal).sel(source = name, other = ref)
+    diff_li = [annual_diff, seasonal_diff]
 
-    maximum = max(float(diff_li[0]['ta'].max()), float(diff_li[1]['ta'].max()))
-    minimum = max(float(diff_li[0]['ta'].min()), float(diff_li[1]['ta'].min()))
+    maximum, minimum = difference_extremes(diff_li, variable)
 
     print(f'maximum difference: {maximum} \n minimum difference: {minimum}')
 
@@ -259,23 +289,26 @@ def load_reans(time_range:tuple):
     return data, maximum, minimum
 
 # make 3 x 5 plot of reanalyses and their differences, anually and in the four seasons.  
-def compare_rean(data, savename, time_range):
+def compare_rean(data, savename, time_range, name = 'JRA-55', ref = 'MERRA-2', variable = 'ta'):
+    # contours and colormaps from VARIABLE_CONFIG[variable]['compare'] and ['difference']
+    import matplotlib.pyplot as plt
 
-    annual_model, annual_rean, annual_diff, seasonal_model, seasonal_rean, seasonal_diff = data
+    config = variable_config(variable)
+    annual_model, annual_rean, annual_diff, seasonal_model, seasonal_rean, seasonal_diff = [xrds[variable] * config['scale'] for xrds in data]
     fig, axes = plt.subplots(nrows = 5, ncols = 3, figsize = (25, 20), 
                              sharex = True, sharey = False, layout = 'constrained')
 
-    fig.suptitle(f'Zonal Mean Temperature \n in {time_range[0]}-{time_range[1]}', fontsize = 20)
+    fig.suptitle(f"Zonal Mean {config['long_name']} \n in {time_range[0]}-{time_range[1]}", fontsize = 20)
     #fig.suptitle(f'Temperature Trend \n in {time_range[0]}-{time_range[1]}', fontsize = 20)
 
 
     k = 0
-    for name, annual, seasonal in [('ERA-5.1', annual_model, seasonal_model), ('MERRA2',annual_rean, seasonal_rean)]:
+    for label, annual, seasonal in [(name, annual_model, seasonal_model), (ref, annual_rean, seasonal_rean)]:
         # plot model
-        boundaries = [175, 180, 185, 190, 195, 200, 205, 210, 215, 220, 225, 230, 235, 240, 245, 250, 255, 260, 265, 270, 275, 280, 285, 290, 295, 300] # means
+        boundaries = config['compare']['levels'] # means
         #boundaries = [-5,-3.0, -2, -1.8,-1.6, -1.4, -1.2, -1, -0.8, -0.6, -0.4, -0.2, 0.2, 0.4, 0.6, 0.8, 1, 1.2, 1.4, 1.6, 1.8, 2.0, 3.0, 5] # trends
 
-        cf = xr.plot.contourf(annual['ta'],
+        cf = xr.plot.contourf(annual,
                 x = 'lat',
                 y = 'plev', 
                 yincrease =  False,
@@ -283,13 +316,13 @@ def compare_rean(data, savename, time_range):
                 cbar_kwargs= {'drawedges':True, 'ticks':boundaries},
                 levels = boundaries,
                 add_labels = False,
-                cmap= cc.cm.rainbow4,
+                cmap= colormap(config['compare']['cmap']),
                 #cmap = cmr.prinsenvlag_r,
                 extend="both",
                 yscale = 'log',
                 ylim = (1000, 1),
                 ax = axes[0,k])
-        cs = xr.plot.contour(annual['ta'],
+        cs = xr.plot.contour(annual,
                 x = 'lat',
                 y = 'plev', 
                 yincrease =  False,
@@ -306,13 +339,13 @@ def compare_rean(data, savename, time_range):
         annual.close()
 
         axes[0,0].set_ylabel('Pressure, hPa', fontsize = 15)
-        axes[0,k].set_title(f'{name} \nAnnual', fontsize = 15)
+        axes[0,k].set_title(f'{label} \nAnnual', fontsize = 15)
 
         cbar = cf.colorbar  # Get the colorbar object
         cbar.ax.tick_params(length=0)
 
         for i, season in enumerate(("DJF", "MAM", "JJA", "SON")):
-            cf = xr.plot.contourf(seasonal['ta'].sel(season=season), 
+            cf = xr.plot.contourf(seasonal.sel(season=season), 
                 x = 'lat',
                 y = 'plev', 
                 yincrease =  False,
@@ -320,14 +353,14 @@ def compare_rean(data, savename, time_range):
                 cbar_kwargs= {'drawedges':True, 'ticks':boundaries},
                 levels = boundaries,
                 add_labels = False,
-                cmap= cc.cm.rainbow4,
+                cmap= colormap(config['compare']['cmap']),
                 #cmap = cmr.prinsenvlag_r,
                 extend="both",
                 yscale = 'log',
                 ylim = (1000, 1),
                 xlim = (-89, 89),
                 ax = axes[i + 1,k])
-            cs = xr.plot.contour(seasonal['ta'].sel(season = season),
+            cs = xr.plot.contour(seasonal.sel(season = season),
                 x = 'lat',
                 y = 'plev', 
                 yincrease =  False,
@@ -352,10 +385,10 @@ def compare_rean(data, savename, time_range):
         k+=1
 
     # plot difference
-    boundaries = [-50,-30, -20,-18, -16,-14, -12, -10, -8, -6, -4, -2, -1, 1, 2, 4, 6, 8, 10, 12, 14, 16, 18, 20,30, 50] # means
+    boundaries = config['difference']['levels'] # means
     #boundaries = [-5,-3.0, -2, -1.8,-1.6, -1.4, -1.2, -1, -0.8, -0.6, -0.4, -0.2, 0.2, 0.4, 0.6, 0.8, 1, 1.2, 1.4, 1.6, 1.8, 2.0, 3.0, 5] # for trends
 
-    cf = xr.plot.contourf(annual_diff['ta'],
+    cf = xr.plot.contourf(annual_diff,
             x = 'lat',
             y = 'plev', 
             yincrease =  False,
@@ -363,14 +396,14 @@ def compare_rean(data, savename, time_range):
             cbar_kwargs= {'drawedges':True, 'ticks':boundaries},
             levels = boundaries,
             add_labels = False,
-            cmap= cc.cm.CET_D9,
+            cmap= colormap(config['difference']['cmap']),
             #cmap = cmr.prinsenvlag_r,
             extend="neither",
             yscale = 'log',
             ylim = (1000, 1),
             xlim = (-89, 89),
             ax = axes[0,k])
-    cs = xr.plot.contour(annual_diff['ta'],
+    cs = xr.plot.contour(annual_diff,
             x = 'lat',
             y = 'plev', 
             yincrease =  False,
@@ -393,7 +426,7 @@ def compare_rean(data, savename, time_range):
     cbar.ax.tick_params(length=0)
 
     for i, season in enumerate(("DJF", "MAM", "JJA", "SON")):
-        cf = xr.plot.contourf(seasonal_diff['ta'].sel(season=season), 
+        cf = xr.plot.contourf(seasonal_diff.sel(season=season), 
             x = 'lat',
             y = 'plev', 
             yincrease =  False,
@@ -401,14 +434,14 @@ def compare_rean(data, savename, time_range):
             cbar_kwargs= {'drawedges':True, 'ticks':boundaries},
             levels = boundaries,
             add_labels = False,
-            cmap= cc.cm.CET_D9,
+            cmap= colormap(config['difference']['cmap']),
             #cmap = cmr.prinsenvlag_r,
             extend="neither",
             yscale = 'log',
             ylim = (1000, 1),
             xlim = (-89, 89),
             ax = axes[i + 1,k])
-        cs = xr.plot.contour(seasonal_diff['ta'].sel(season = season),
+        cs = xr.plot.contour(seasonal_diff.sel(season = season),
             x = 'lat',
             y = 'plev', 
             yincrease =  False,
@@ -442,9 +475,10 @@ if __name__ == '__main__':
     start = datetime.now()
     model = 'JRA-55'
     time_range = ('1980','2014')
-    data, maximum, minimum = load_reans(time_range)
+    variable = 'ta'
+    data, maximum, minimum = load_reans(time_range, name = model, variable = variable)
     savename = f'/home/siw2111/cmip6_reanalyses_comp/model_plots/05-27-2025/{model}_{time_range[0]}-{time_range[1]}_{maximum}{minimum}.png'
-    compare_rean(data, savename, time_range)
+    compare_rean(data, savename, time_range, name = model, variable = variable)
         
     end = datetime.now()
         
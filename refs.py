@@ -0,0 +1,76 @@
+import os
+import json
+import xarray as xr
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# kerchunk reference index of the raw reanalysis files. One scan records the byte range of every
+# chunk in each NetCDF/HDF5 file as json; the files are then opened as virtual zarr datasets
+# through fsspec's reference filesystem. Reads go straight to the byte ranges, without the
+# netCDF4/HDF5 library and its global lock, so dask threads read chunks in parallel.
+# Nothing is copied: the index only points into the original files.
+# needs kerchunk (pip install kerchunk) to build the index; opening needs fsspec and zarr.
+
+REF_DIR = '/dx02/siw2111/refs'
+
+RAW_FILES = {'MERRA-2': '/dx02/siw2111/MERRA-2/MERRA-2_TEMP_ALL-TIME.nc4',
+             'JRA-55': '/dx02/siw2111/JRA-55/JRA-55_T.nc',
+             'JRA-55_interpolated': '/dx02/siw2111/JRA-55/JRA-55_T_interpolated.nc',
+             'ERA-5': '/dx02/siw2111/ERA-5/ERA-5_T.nc',
+             'ERA-5.1': '/dx02/siw2111/ERA-5/ERA-5.1/ERA5-1-gridded.nc'}
+
+def ref_path(name):
+    return f'{REF_DIR}/{name}.json'
+
+def file_format(path):
+    # 'hdf5' (netCDF4) or 'netcdf3' from the file signature
+    with open(path, 'rb') as f:
+        magic = f.read(8)
+    if magic.startswith(b'\x89HDF'):
+        return 'hdf5'
+    if magic.startswith(b'CDF'):
+        return 'netcdf3'
+    raise ValueError(f'{path} is neither HDF5 nor netCDF3')
+
+def build_reference(path, savename, inline_threshold = 300):
+    # byte-range references of every chunk of one file; small arrays (coordinates)
+    # below inline_threshold bytes are stored in the json itself
+    if file_format(path) == 'hdf5':
+        from kerchunk.hdf import SingleHdf5ToZarr
+        refs = SingleHdf5ToZarr(path, inline_threshold = inline_threshold).translate()
+    else:
+        from kerchunk.netCDF3 import NetCDF3ToZarr
+        refs = NetCDF3ToZarr(path, inline_threshold = inline_threshold).translate()
+
+    with open(savename, 'w') as f:
+        json.dump(refs, f)
+    print(f'saved as... {savename}')
+    return savename
+
+def build_references(names = list(RAW_FILES.keys()), overwrite = False):
+    # one-time scan of the raw files
+    os.makedirs(REF_DIR, exist_ok = True)
+    for name in names:
+        savename = ref_path(name)
+        if os.path.exists(savename) and not overwrite:
+            print(f'reference exists... {savename}')
+            continue
+        print(f'scanning... {RAW_FILES[name]}')
+        build_reference(RAW_FILES[name], savename)
+
+def open_reference(name, chunks = {}):
+    # virtual zarr dataset of a raw file, chunks = {} keeps the file's own chunking.
+    # falls back to the netCDF4 backend when no index has been built
+    savename = ref_path(name)
+    if not os.path.exists(savename):
+        print(f'no reference index for {name}, reading through netCDF4... {RAW_FILES[name]}')
+        return xr.open_dataset(RAW_FILES[name], chunks = 'auto')
+    print(f'reading reference index... {savename}')
+    return xr.open_dataset('reference://',
+                           engine = 'zarr',
+                           chunks = chunks,
+                           backend_kwargs = {'consolidated': False,
+                                             'zarr_format': 2,
+                                             'storage_options': {'fo': savename, 'remote_protocol': 'file'}})
+
+if __name__ == '__main__':
+    build_references()
@@ -0,0 +1,210 @@
+import xarray as xr
+import numpy as np
+from time_index import add_time_labels
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# segmented-reduction groupby (flox-style). Group labels are sorted once and every group's
+# sufficient statistics (count, sum y, sum t, sum t^2, sum t*y) come from one np.add.reduceat
+# over the time axis, so means, detrending and trends for all seasons/months/years run in a
+# single blockwise pass instead of one dask subgraph per group. group_year_mean and group_trend
+# share one (group, year) slot layout. check_group_trend() compares the
+# trends with a per-group fit (python segments.py).
+
+def label_values(xrds, time, label):
+    # label array along time, e.g. 'season', 'month', 'year' or 'season_year'; None = one group
+    if label is None:
+        return np.zeros(xrds.sizes[time], dtype = int)
+    if label not in xrds.coords:
+        xrds = add_time_labels(xrds, time)
+    return np.asarray(xrds[label].values)
+
+def segments(labels):
+    # sort once: group codes, stable sort order, segment starts and position within each group
+    groups, codes = np.unique(labels, return_inverse = True)
+    order = np.argsort(codes, kind = 'stable')
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    rank = np.arange(len(codes)) - starts[np.cumsum(np.r_[False, sorted_codes[1:] != sorted_codes[:-1]])]
+    position = np.empty(len(codes))
+    position[order] = rank # 0, 1, 2 ... within each group, in time order
+    return groups, codes, order, starts, position
+
+def _center(y):
+    # y minus its mean over time, so float32 products and sums stay small (see precision.py)
+    valid = ~np.isnan(y)
+    total = np.where(valid, y, 0).sum(axis = -1, keepdims = True, dtype = np.float64)
+    shift = (total / np.maximum(valid.sum(axis = -1, keepdims = True), 1)).astype(y.dtype)
+    return y - shift, shift
+
+def _sums(y, order, starts, t):
+    # (..., n_group, 5) sufficient statistics [n, sum y, sum t, sum t^2, sum t*y], NaN-aware.
+    # elementwise work stays in the data dtype, the per-group accumulators are float64
+    ys = y[..., order]
+    ts = np.broadcast_to(t[order].astype(y.dtype), ys.shape)
+    valid = ~np.isnan(ys)
+    y0 = np.where(valid, ys, 0)
+    t0 = np.where(valid, ts, 0)
+    sums = [np.add.reduceat(values, starts, axis = -1, dtype = np.float64) for values in [valid, y0, t0, t0 * t0, t0 * y0]]
+    return np.stack(sums, axis = -1)
+
+def _fit(sums):
+    # group mean, slope and intercept from the sufficient statistics
+    n, sy, st, stt, sty = [sums[..., i] for i in range(5)]
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean = sy / n
+        slope = (n * sty - st * sy) / (n * stt - st * st)
+        intercept = (sy - slope * st) / n
+    return mean, slope, intercept
+
+def _mean_kernel(y, order, starts, position):
+    yc, shift = _center(y)
+    mean, slope, intercept = _fit(_sums(yc, order, starts, position))
+    return (mean + shift).astype(y.dtype)
+
+def _detrend_kernel(y, codes, order, starts, position):
+    # linear detrend within every group, keeping the group mean (as detrend_fct)
+    yc, shift = _center(y)
+    mean, slope, intercept = [fit.astype(y.dtype) for fit in _fit(_sums(yc, order, starts, position))]
+    return y - (intercept[..., codes] + slope[..., codes] * position.astype(y.dtype)) + mean[..., codes]
+
+def _anomaly_kernel(y, codes, order, starts, position):
+    yc, shift = _center(y)
+    mean, slope, intercept = _fit(_sums(yc, order, starts, position))
+    return yc - mean.astype(y.dtype)[..., codes]
+
+def _slot_means(y, order, starts, n_groups, n_years):
+    # (..., n_groups, n_years) float64 means of the full (group, year) grid from differences of one
+    # cumulative sum at the slot bounds, so empty slots (start == next start) come out NaN and
+    # never shorten their neighbours
+    n = y.shape[-1]
+    ys = y[..., order]
+    valid = ~np.isnan(ys)
+    y0 = np.where(valid, ys, 0)
+    padded = np.r_[starts, n]
+    zero = np.zeros(y.shape[:-1] + (1,))
+    count = np.diff(np.concatenate([zero, np.cumsum(valid, axis = -1, dtype = np.float64)], axis = -1)[..., padded], axis = -1)
+    total = np.diff(np.concatenate([zero, np.cumsum(y0, axis = -1, dtype = np.float64)], axis = -1)[..., padded], axis = -1)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        inner = total / count
+    return inner.reshape(inner.shape[:-1] + (n_groups, n_years))
+
+def _year_mean_kernel(y, order, starts, n_groups, n_years):
+    return _slot_means(y, order, starts, n_groups, n_years).astype(y.dtype)
+
+def _trend_kernel(y, order, starts, n_groups, n_years):
+    # OLS slope of every group's year means
+    inner = _slot_means(y, order, starts, n_groups, n_years)
+
+    t = np.arange(n_years, dtype = np.float64)
+    valid = ~np.isnan(inner)
+    k = valid.sum(axis = -1)
+    m = np.where(valid, inner, 0)
+    tv = np.where(valid, t, 0)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        slope = (k * (tv * m).sum(-1) - tv.sum(-1) * m.sum(-1)) / (k * (tv * tv).sum(-1) - tv.sum(-1) ** 2)
+    return slope.astype(y.dtype)
+
+def _apply(xrds, time, kernel, kwargs, out_dim = None, out_size = None):
+    # run a kernel over the whole time axis of every variable with a time dimension;
+    # out_dim and out_size may be lists for several output dimensions
+    out_dims = [out_dim] if isinstance(out_dim, str) else out_dim
+    out_sizes = [out_size] if isinstance(out_dim, str) else out_size
+    def apply_da(da):
+        if time not in da.dims:
+            return da
+        if da.chunks:
+            da = da.chunk({time: -1})
+        if out_dim is None:
+            return xr.apply_ufunc(kernel, da,
+                                  input_core_dims = [[time]],
+                                  output_core_dims = [[time]],
+                                  kwargs = kwargs,
+                                  dask = 'parallelized',
+                                  output_dtypes = [da.dtype]).transpose(*da.dims)
+        return xr.apply_ufunc(kernel, da,
+                              input_core_dims = [[time]],
+                              output_core_dims = [out_dims],
+                              kwargs = kwargs,
+                              dask = 'parallelized',
+                              dask_gufunc_kwargs = {'output_sizes': dict(zip(out_dims, out_sizes))},
+                              output_dtypes = [da.dtype])
+    if isinstance(xrds, xr.Dataset):
+        return xrds.map(apply_da, keep_attrs = True)
+    return apply_da(xrds)
+
+def _drop_labels(xrds, time):
+    return xrds.drop_vars([name for name in xrds.coords if name != time and xrds[name].dims == (time,)])
+
+def group_mean(xrds, time, label):
+    # = xrds.groupby(label).mean(time) for every group in one pass
+    groups, codes, order, starts, position = segments(label_values(xrds, time, label))
+    out = _apply(_drop_labels(xrds, time), time, _mean_kernel, {'order': order, 'starts': starts, 'position': position}, label, len(groups))
+    return out.assign_coords({label: groups})
+
+def group_detrend(xrds, time, label):
+    # = xrds.groupby(label).map(detrend_fct) for every group in one pass
+    groups, codes, order, starts, position = segments(label_values(xrds, time, label))
+    return _apply(xrds, time, _detrend_kernel, {'codes': codes, 'order': order, 'starts': starts, 'position': position})
+
+def group_anomaly(xrds, time, label):
+    # = xrds.groupby(label) - xrds.groupby(label).mean(time), e.g. anomalies from the monthly climatology
+    groups, codes, order, starts, position = segments(label_values(xrds, time, label))
+    return _apply(xrds, time, _anomaly_kernel, {'codes': codes, 'order': order, 'starts': starts, 'position': position})
+
+def _year_slots(xrds, time, label, year):
+    # every (group, year) pair is one segment, all sorted once; unused slots get an empty segment
+    # and gaps in the record stay gaps
+    years = label_values(xrds, time, year)
+    year_index = years - years.min()
+    n_years = int(year_index.max()) + 1
+    if label is None:
+        groups, label_codes = np.array(['annual']), np.zeros(len(years), dtype = int)
+    else:
+        groups, label_codes = np.unique(label_values(xrds, time, label), return_inverse = True)
+
+    combined = label_codes * n_years + year_index
+    order = np.argsort(combined, kind = 'stable')
+    sorted_codes = combined[order]
+    starts = np.searchsorted(sorted_codes, np.arange(len(groups) * n_years))
+    kwargs = {'order': order, 'starts': starts, 'n_groups': len(groups), 'n_years': n_years}
+    return groups, years.min() + np.arange(n_years), kwargs
+
+def group_year_mean(xrds, time, label = None, year = 'year'):
+    # (label, year) means, = xrds.groupby(label).map(lambda group: group.groupby(year).mean(time))
+    # in one pass (label = None for the year means alone); years missing from a group are NaN
+    groups, years, kwargs = _year_slots(xrds, time, label, year)
+    out = _apply(_drop_labels(xrds, time), time, _year_mean_kernel, kwargs, ['group', year], [len(groups), len(years)])
+    out = out.rename({'group': label or 'group'}).assign_coords({label or 'group': groups, year: years})
+    if label is None:
+        out = out.isel(group = 0, drop = True)
+    return out
+
+def group_trend(xrds, time, label = None, year = 'year'):
+    # trend per year of the year-mean series of every group (label = None for the annual trend),
+    # year = 'season_year' counts December with the following January and February
+    groups, years, kwargs = _year_slots(xrds, time, label, year)
+    out = _apply(_drop_labels(xrds, time), time, _trend_kernel, kwargs, 'group', len(groups))
+    out = out.rename({'group': label or 'group'}).assign_coords({label or 'group': groups})
+    if label is None:
+        out = out.isel(group = 0, drop = True)
+    return out
+
+def check_group_trend(start = '1980-01', stop = '1983-08', seed = 0):
+    # group_trend against a per-group OLS fit of the year means (np.polyfit) on a record ending
+    # mid-year, so that empty (group, year) slots follow the last data of some groups
+    rng = np.random.default_rng(seed)
+    time = np.arange(np.datetime64(start, 'M'), np.datetime64(stop, 'M') + 1).astype('datetime64[ns]')
+    da = xr.DataArray(250 + 0.05 * np.arange(len(time)) + rng.normal(0, 1, (3, len(time))),
+                      dims = ['lat', 'time'], coords = {'lat': [-60, 0, 60], 'time': time})
+    trend = group_trend(da, 'time', 'season', 'season_year')
+    labelled = add_time_labels(da, 'time')
+    for season in trend['season'].values:
+        group = labelled.where(labelled['season'] == season, drop = True)
+        year_mean = group.groupby('season_year').mean('time')
+        expected = np.polyfit(year_mean['season_year'].values, year_mean.values.T, 1)[0]
+        error = float(np.abs(trend.sel(season = season).values - expected).max())
+        print(f'{season}: max error {error:.1e}')
+        assert error < 1e-8, f'group_trend {season} differs from the per-season fit by {error}'
+
+if __name__ == '__main__':
+    check_group_trend()
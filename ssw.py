@@ -0,0 +1,198 @@
+import os
+import dask
+import numpy as np
+import pandas as pd
+import xarray as xr
+from ncf_funct import zonal_mean, area_weighted_mean, subset
+from time_index import time_labels, day_number
+from ingest import TIER_DIR, HI_MODEL_LI, LO_MODEL_LI
+from storage import write_compressed
+from sweep import run_sweep
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# sudden stratospheric warmings from daily data. Daily ta/ua ('day' table for the models, daily
+# files for the reanalyses) are subset to 10 hPa on open and reduced chunk by chunk to two series,
+# the 60N zonal-mean zonal wind and the 60-90N polar-cap temperature, so the 3-D daily field is
+# never held in memory. Events follow Charlton and Polvani (2007): the wind at 60N, 10 hPa turns
+# easterly between November and March, at least 20 westerly days separate events, and winds
+# return westerly for 10 consecutive days before 30 April (otherwise it is the final warming).
+# Only the series and the event catalog are stored.
+
+SSW_DIR = f'{TIER_DIR}/ssw'
+
+LEVEL = 10 # hPa
+WIND_LAT = 60
+CAP_LAT = 60
+SEPARATION = 20 # westerly days between events
+RECOVERY = 10 # westerly days before the end of April, else final warming
+WINTER_MONTHS = [11, 12, 1, 2, 3]
+
+# daily reanalysis files (one per month), names as in ingest.REAN_SOURCES
+REAN_DAILY = {'MERRA-2': {'path': '/dx02/siw2111/MERRA-2/daily/MERRA-2_*.nc4',
+                          'variables': ['T', 'U'], 'lev': 'lev',
+                          'rename': {'lev': 'plev', 'T': 'ta', 'U': 'ua'}},
+              'JRA-55': {'path': '/dx02/siw2111/JRA-55/daily/JRA-55_*.nc',
+                         'variables': ['TMP_GDS0_ISBL', 'UGRD_GDS0_ISBL'], 'lev': 'lv_ISBL1',
+                         'rename': {'g0_lat_1': 'lat', 'g0_lon_2': 'lon', 'lv_ISBL1': 'plev', 'initial_time0_hours': 'time',
+                                    'TMP_GDS0_ISBL': 'ta', 'UGRD_GDS0_ISBL': 'ua'}},
+              'ERA-5.1': {'path': '/dx02/siw2111/ERA-5/daily/ERA-5_*.nc',
+                          'variables': ['t', 'u'], 'lev': 'pressure_level',
+                          'rename': {'latitude': 'lat', 'longitude': 'lon', 'pressure_level': 'plev', 'valid_time': 'time', 't': 'ta', 'u': 'ua'}}}
+
+def series_path(name, level = LEVEL):
+    return f'{SSW_DIR}/{name}_{level}hPa_daily.nc'
+
+def catalog_path(name, level = LEVEL):
+    return f'{SSW_DIR}/{name}_{level}hPa_ssw.csv'
+
+def reduce_daily(xrds, level = LEVEL):
+    # (time) 60N zonal-mean wind and polar-cap temperature at one level, lazily
+    xrds = xrds.sel(plev = level, method = 'nearest')
+    wind = zonal_mean(xrds['ua'].sel(lat = WIND_LAT, method = 'nearest'), 'lon')
+    cap = xrds[['ta']].sel(lat = xrds['lat'][xrds['lat'] >= CAP_LAT])
+    temperature = area_weighted_mean(cap, 'lat', 'lon')['ta']
+    series = xr.Dataset({'u60': wind.drop_vars([name for name in wind.coords if name != 'time']),
+                         'tcap': temperature.drop_vars([name for name in temperature.coords if name != 'time'])})
+    return series
+
+def open_daily_rean(name, level = LEVEL):
+    # daily files subset to ta/ua at the level as each file is opened (ncf_funct.subset)
+    source = REAN_DAILY[name]
+    time = next((key for key, value in source['rename'].items() if value == 'time'), 'time')
+    xrds = xr.open_mfdataset(source['path'], combine = 'nested', concat_dim = time,
+                             chunks = {}, parallel = True, preprocess = subset(source['variables'], [level], source['lev']))
+    xrds = xrds.rename(source['rename']).sortby('time').sortby('lat')
+    return xrds
+
+def open_daily_model(source_id, level = LEVEL):
+    # ta and ua from the CMIP6 'day' table, plev in Pa
+    from pangeo_pull import pangeo_pull
+    fields = []
+    for variable in ['ta', 'ua']:
+        xrds = pangeo_pull(source_id, variable_id = variable, table_id = 'day')
+        xrds = xrds.sel(member_id = 'r1i1p1f1')
+        if 'dcpp_init_year' in xrds.dims:
+            xrds = xrds.mean(dim = ['dcpp_init_year'])
+        xrds = xrds.assign_coords(plev = np.divide(xrds.coords['plev'].values, 100).round(2)) # convert from pa to hpa
+        fields.append(xrds[[variable]].sel(plev = [level], method = 'nearest'))
+    return xr.merge(fields, join = 'inner', compat = 'override')
+
+def daily_series(name, level = LEVEL, overwrite = False):
+    # reduced series of one source, computed in one pass and stored
+    savename = series_path(name, level)
+    if os.path.exists(savename) and not overwrite:
+        print(f'series exists... {savename}')
+        return xr.load_dataset(savename)
+    xrds = open_daily_rean(name, level) if name in REAN_DAILY else open_daily_model(name, level)
+    series = reduce_daily(xrds, level)
+    print(f'reducing daily fields... {name}')
+    (series,) = dask.compute(series)
+    os.makedirs(SSW_DIR, exist_ok = True)
+    write_compressed(series, savename, check_trend = False)
+    return series
+
+def day_labels(time):
+    # (year, month, day) integer arrays for datetime64 or cftime daily times
+    values = np.asarray(time)
+    year, month = time_labels(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        day = (values.astype('datetime64[D]') - values.astype('datetime64[M]')).astype(np.int64) + 1
+        return year, month, day
+    import cftime
+    calendar = values[0].calendar
+    days = np.floor(cftime.date2num(values, 'days since 1970-01-01', calendar = calendar)).astype(np.int64)
+    days = days + day_number(1970, 1, 1, calendar)
+    return year, month, days - day_number(year, month, 1, calendar) + 1
+
+def _runs(mask):
+    # (start, length) of every run of True
+    edges = np.diff(np.r_[0, mask.astype(np.int8), 0])
+    starts = np.flatnonzero(edges == 1)
+    return starts, np.flatnonzero(edges == -1) - starts
+
+def _window_mean(values, starts, stops):
+    # mean of values[start:stop] for many windows at once
+    total = np.r_[0, np.nancumsum(values)]
+    count = np.r_[0, np.cumsum(~np.isnan(values))]
+    starts, stops = np.clip(starts, 0, len(values)), np.clip(stops, 0, len(values))
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return (total[stops] - total[starts]) / (count[stops] - count[starts])
+
+def detect_ssw(u, time, tcap = None):
+    # Charlton-Polvani central dates from a daily (time) wind series, all candidates at once
+    u = np.asarray(u, dtype = np.float64)
+    year, month, day = day_labels(time)
+    winter = year + (month >= 7) # the winter of Dec 1999 and Jan 2000 is 2000
+    easterly = u < 0
+    westerly = u > 0
+
+    # candidates: first easterly day of a reversal in November-March
+    onset = np.flatnonzero(easterly & ~np.r_[False, easterly[:-1]])
+    onset = onset[np.isin(month[onset], WINTER_MONTHS)]
+
+    # separation: at least SEPARATION westerly days since the last winter easterly day before
+    # onset, otherwise the reversal belongs to the previous event (summer easterlies do not count)
+    last_easterly = np.maximum.accumulate(np.where(easterly, np.arange(len(u)), -1))
+    before = np.r_[-1, last_easterly[:-1]][onset]
+    separated = (before < 0) | (onset - before - 1 >= SEPARATION) | ~np.isin(month[np.maximum(before, 0)], WINTER_MONTHS)
+
+    # final warming: a run of RECOVERY westerly days must be complete by 30 April of the winter
+    run_start, run_length = _runs(westerly)
+    long_start = run_start[run_length >= RECOVERY]
+    recovery = np.searchsorted(long_start, onset) # first long westerly run after onset
+    recovery_end = np.where(recovery < len(long_start), long_start[np.minimum(recovery, len(long_start) - 1)] + RECOVERY - 1, len(u))
+    april = np.flatnonzero(month <= 4)
+    april_end = april[np.searchsorted(winter[april], winter[onset], side = 'right') - 1]
+    recovered = recovery_end <= april_end
+
+    events = onset[separated & recovered]
+    # event properties: easterly duration, strongest easterly, polar-cap warming
+    run_e_start, run_e_length = _runs(easterly)
+    duration = run_e_length[np.searchsorted(run_e_start, events)]
+    u_min = np.array([u[i:i + d].min() for i, d in zip(events, duration)]) if len(events) else np.array([])
+    catalog = pd.DataFrame({'year': year[events], 'month': month[events], 'day': day[events], 'winter': winter[events],
+                            'index': events, 'duration': duration, 'u_min': u_min})
+    if tcap is not None:
+        tcap = np.asarray(tcap, dtype = np.float64)
+        # mean polar-cap temperature of the 10 days after minus the 10 days before the central date
+        catalog['tcap_change'] = _window_mean(tcap, events, events + 10) - _window_mean(tcap, events - 10, events)
+    return catalog
+
+def ssw_frequency(catalog, series):
+    # events per winter over the complete winters of the series
+    year, month, day = day_labels(series['time'].values)
+    winter = year + (month >= 7)
+    complete = [w for w in np.unique(winter) if set(WINTER_MONTHS) <= set(month[winter == w])]
+    return len(catalog[catalog['winter'].isin(complete)]) / max(len(complete), 1)
+
+def ssw_task(name, level = LEVEL, overwrite = False):
+    series = daily_series(name, level, overwrite)
+    catalog = detect_ssw(series['u60'].values, series['time'].values, series['tcap'].values)
+    savename = catalog_path(name, level)
+    catalog.insert(0, 'source', name)
+    catalog.to_csv(savename, index = False)
+    print(f'saved as... {savename}: {len(catalog)} events, {ssw_frequency(catalog, series):.2f} per winter')
+    return [series_path(name, level), savename]
+
+def daily_source(name):
+    # daily files of a reanalysis or catalog stores of a model, for the sweep's input hash
+    if name in REAN_DAILY:
+        return [REAN_DAILY[name]['path']]
+    from pangeo_pull import model_stores
+    return model_stores(name, variable_id = ['ta', 'ua'], table_id = 'day')
+
+def ssw_sweep(names = list(REAN_DAILY.keys()) + HI_MODEL_LI + LO_MODEL_LI, level = LEVEL, overwrite = False, retries = None, backoff = None):
+    # resumable over every reanalysis and model (see sweep.py), then one combined catalog
+    os.makedirs(SSW_DIR, exist_ok = True)
+    failed = run_sweep(names, lambda name: ssw_task(name, level, overwrite), f'{SSW_DIR}/ssw_sweep.json',
+                       params = {'level': level, 'separation': SEPARATION, 'recovery': RECOVERY},
+                       retries = retries, backoff = backoff, source = daily_source)
+    catalogs = [pd.read_csv(catalog_path(name, level)) for name in names if name not in failed]
+    combined = pd.concat(catalogs, ignore_index = True)
+    savename = f'{SSW_DIR}/all_{level}hPa_ssw.csv'
+    combined.to_csv(savename, index = False)
+    print(f'saved as... {savename}')
+    return combined
+
+if __name__ == '__main__':
+    ssw_sweep()
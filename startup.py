@@ -0,0 +1,56 @@
+import os
+import sys
+import json
+import subprocess
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# import-time benchmark. Each module is imported in a fresh interpreter (as a dask worker or sweep
+# task would) and timed, and the heavy libraries it pulled in are listed. Compute modules should
+# not load plotting (matplotlib, colorcet, cmasher), catalog (intake) or other heavy libraries
+# at import; those are imported inside the functions that need them. python startup.py
+
+COMPUTE_MODULES = ['time_index', 'segments', 'precision', 'kernels', 'storage', 'refs', 'chunk_plan', 'sweep',
+                   'ncf_funct', 'ingest', 'plan', 'cubes', 'bootstrap', 'harmonics', 'quantiles', 'query', 'ssw', 'pangeo_pull']
+PLOT_MODULES = ['reanalyses_plots', 'climatology', 'trends', 'summary_figs', 'reanalyses_continuity']
+
+HEAVY = ['matplotlib', 'colorcet', 'cmasher', 'intake', 'intake_esm', 'scipy', 'zarr', 'numba', 'kerchunk', 'dask.diagnostics']
+
+_PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+def import_time(module, baseline = 'xarray', repeat = 3):
+    # best-of-repeat seconds to import module after baseline (xarray, which every module needs),
+    # and the heavy libraries loaded on the way
+    results = []
+    for _ in range(repeat):
+        code = f'import {baseline}\n' + _PROBE.format(module = module, heavy = HEAVY) if baseline else _PROBE.format(module = module, heavy = HEAVY)
+        out = subprocess.run([sys.executable, '-c', code], capture_output = True, text = True,
+                             cwd = os.path.dirname(os.path.abspath(__file__)))
+        if out.returncode != 0:
+            return {'seconds': float('nan'), 'loaded': [], 'error': out.stderr.strip().splitlines()[-1]}
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return min(results, key = lambda result: result['seconds'])
+
+def startup_report(modules = COMPUTE_MODULES + PLOT_MODULES, repeat = 3):
+    # seconds and heavy imports per module; compute modules loading plotting libraries are flagged
+    base = import_time('xarray', baseline = None, repeat = repeat)
+    print(f'{"xarray (baseline)":>22}: {base["seconds"]:6.3f} s')
+    report = {}
+    for module in modules:
+        result = import_time(module, repeat = repeat)
+        report[module] = result
+        flag = ''
+        if module in COMPUTE_MODULES and set(result['loaded']) & {'matplotlib', 'colorcet', 'cmasher', 'intake'}:
+            flag = '  <- loads plotting/catalog libraries'
+        if 'error' in result:
+            flag = f'  <- {result["error"]}'
+        print(f'{module:>22}: {result["seconds"]:6.3f} s  {", ".join(result["loaded"]) or "-"}{flag}')
+    return report
+
+if __name__ == '__main__':
+    startup_report()
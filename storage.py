@@ -0,0 +1,150 @@
+import os
+import dask
+import numpy as np
+import xarray as xr
+from segments import group_trend
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# compressed storage for intermediate and derived products, written with shuffle + zstd (zlib
+# when the netCDF library has no zstd filter). By default this is lossless: values and dtype are
+# kept. keepbits is the lossy option: float variables are bit-rounded to keepbits significant
+# mantissa bits (round to nearest, ties to even) and, for keepbits <= 23, stored as float32. The
+# zeroed trailing bits compress well, so files shrink several-fold. Every write reports the
+# compression against float64; rounded writes also report the maximum rounding error and check
+# that K/decade trends change by less than TREND_TOLERANCE. write_zarr() is the appendable
+# variant: chunks are written in parallel (no netCDF lock) and later months are appended along
+# time without a rewrite.
+
+# suggested keepbits for cached intermediates: relative error <= 2^-13, about 0.03 K at 250 K
+KEEPBITS = 12
+FLOAT32_BITS = 23 # mantissa bits of float32
+COMPRESSION = 'zstd'
+COMPLEVEL = 4
+TREND_TOLERANCE = 0.01 # K/decade, well below the 0.1-1 K/decade trends in the figures
+
+def bitround(values, keepbits = KEEPBITS):
+    # all but keepbits mantissa bits zeroed, in the dtype of values; NaN and inf unchanged
+    values = np.asarray(values)
+    drop = np.finfo(values.dtype).nmant - keepbits
+    if drop <= 0:
+        return values
+    uint = np.dtype(f'u{values.dtype.itemsize}').type
+    bits = values.view(uint).copy()
+    half = uint(1 << (drop - 1))
+    mask = ~uint((1 << drop) - 1)
+    bits += half - uint(1) + ((bits >> uint(drop)) & uint(1))
+    bits &= mask
+    rounded = bits.view(values.dtype)
+    return np.where(np.isfinite(values), rounded, values)
+
+def stored_dtype(keepbits):
+    # float32 only when rounding to at most its mantissa was asked for, otherwise the data dtype
+    if keepbits is not None and keepbits <= FLOAT32_BITS:
+        return 'float32'
+    return None
+
+def round_dataset(xrds, keepbits = KEEPBITS):
+    # bit-round every float data variable, lazily; keepbits = None leaves xrds unchanged
+    if keepbits is None:
+        return xrds
+    def round_da(da):
+        if not np.issubdtype(da.dtype, np.floating):
+            return da
+        return xr.apply_ufunc(bitround, da,
+                              kwargs = {'keepbits': keepbits},
+                              dask = 'parallelized',
+                              output_dtypes = [da.dtype],
+                              keep_attrs = True)
+    return xrds.map(round_da, keep_attrs = True)
+
+def encoding(xrds, compression = COMPRESSION, complevel = COMPLEVEL, keepbits = None):
+    # shuffle and compression for every float data variable, float32 when bit-rounded
+    enc = {}
+    for name, da in xrds.data_vars.items():
+        if np.issubdtype(da.dtype, np.floating):
+            enc[name] = {'compression': compression, 'complevel': complevel, 'shuffle': True}
+            if stored_dtype(keepbits):
+                enc[name]['dtype'] = stored_dtype(keepbits)
+    return enc
+
+def zarr_encoding(xrds, complevel = COMPLEVEL, keepbits = None):
+    # blosc zstd with byte shuffle (built into numcodecs, always available), float32 when bit-rounded
+    from numcodecs import Blosc
+    enc = {}
+    for name, da in xrds.data_vars.items():
+        if np.issubdtype(da.dtype, np.floating):
+            enc[name] = {'compressors': [Blosc(cname = 'zstd', clevel = complevel, shuffle = Blosc.SHUFFLE)]}
+            if stored_dtype(keepbits):
+                enc[name]['dtype'] = stored_dtype(keepbits)
+    return enc
+
+def available(compression):
+    # fall back to zlib when the netCDF library was built without the filter plugin
+    if compression == 'zlib':
+        return compression
+    import netCDF4
+    nc = netCDF4.Dataset('filter_check.nc', 'w', diskless = True, persist = False)
+    has_filter = getattr(nc, f'has_{compression.split("_")[0]}_filter')()
+    nc.close()
+    if not has_filter:
+        print(f'{compression} filter not available, using zlib')
+        return 'zlib'
+    return compression
+
+def _trend_change(xrds, rounded, time):
+    # largest change of the annual trend (K/decade) caused by rounding
+    names = [name for name in xrds.data_vars if time in xrds[name].dims and np.issubdtype(xrds[name].dtype, np.floating)]
+    if not names:
+        return None
+    change = [abs(group_trend(rounded[[name]], time)[name] - group_trend(xrds[[name]], time)[name]).max() * 10 for name in names]
+    return xr.concat(change, dim = 'variable').max()
+
+def write_compressed(xrds, savename, keepbits = None, compression = COMPRESSION, complevel = COMPLEVEL, time = 'time', check_trend = True):
+    # write compressed and report the compression; with keepbits, bit-round first and report the
+    # max error and trend change, all in one compute
+    if isinstance(xrds, xr.DataArray):
+        xrds = xrds.to_dataset()
+    floats = [name for name in xrds.data_vars if np.issubdtype(xrds[name].dtype, np.floating)]
+    rounded = round_dataset(xrds, keepbits)
+    max_error = None
+    trend_change = None
+    if keepbits is not None:
+        dtype = stored_dtype(keepbits) or float
+        max_error = xr.concat([abs(rounded[name].astype(dtype).astype(float) - xrds[name]).max() for name in floats], dim = 'variable').max()
+        trend_change = _trend_change(xrds, rounded, time) if check_trend and time in xrds.dims else None
+
+    print(f'saving to... {savename}')
+    compression = available(compression)
+    write = rounded.to_netcdf(savename, encoding = encoding(rounded, compression, complevel, keepbits), compute = False)
+    write, max_error, trend_change = dask.compute(write, max_error, trend_change)
+
+    stats = {'keepbits': keepbits,
+             'ratio': xrds[floats].astype(np.float64).nbytes / os.path.getsize(savename),
+             'max_error': 0.0 if max_error is None else float(max_error),
+             'trend_change': None if trend_change is None else float(trend_change)}
+    print(f'saved as... {savename}: {stats["ratio"]:.1f}x smaller than float64, '
+          f'max error {stats["max_error"]:.2g}, keepbits {keepbits}')
+    if stats['trend_change'] is not None:
+        print(f'max trend change {stats["trend_change"]:.2g} K/decade (tolerance {TREND_TOLERANCE})')
+        if stats['trend_change'] > TREND_TOLERANCE:
+            print(f'warning: trend change above tolerance, raise keepbits for {savename}')
+    return stats
+
+def store_size(path):
+    # bytes on disk of a zarr directory
+    return sum(os.path.getsize(os.path.join(root, f)) for root, dirs, files in os.walk(path) for f in files)
+
+def write_zarr(xrds, savename, keepbits = None, complevel = COMPLEVEL, append_dim = None):
+    # write chunk by chunk in parallel, bit-rounded if keepbits is given; append_dim adds to an
+    # existing store (which keeps its dtype)
+    if isinstance(xrds, xr.DataArray):
+        xrds = xrds.to_dataset()
+    rounded = round_dataset(xrds, keepbits)
+    if append_dim is None:
+        print(f'saving to... {savename}')
+        rounded.to_zarr(savename, mode = 'w', encoding = zarr_encoding(rounded, complevel, keepbits), zarr_format = 2, consolidated = True)
+    else:
+        print(f'appending {rounded.sizes[append_dim]} {append_dim} steps to... {savename}')
+        rounded.to_zarr(savename, append_dim = append_dim, zarr_format = 2, consolidated = True)
+    print(f'saved as... {savename}: {store_size(savename) / 2**20:.1f} MiB, keepbits {keepbits}')
+    return savename
@@ -1,10 +1,11 @@
+import os
 import xarray as xr
-import matplotlib.pyplot as plt
 import numpy as np
-from reanalyses_plots import seasonal_zonal_mean, seasonal_zonal_mean_detrended, annual_zonal_mean, annual_zonal_mean_detrended, annual_zonal_trend
-from pangeo_pull import pangeo_pull
-from ncf_funct import concat_era, area_weighted_mean_2
-from matplotlib.ticker import MultipleLocator
+from reanalyses_plots import annual_zonal_trend
+from ncf_funct import concat_era
+from cubes import reduce_reans, build_model_cube, open_model_cube, ensemble_stats
+from plan import run
+from ingest import HI_MODEL_LI, LO_MODEL_LI, TIER_DIR
 
 # 5/26/2026 by Sylvia Whang siw2111@barnard.edu
 # Summary Plots for model climatology and trends (see Figs 18, 19, 57 in phonebook). 
@@ -13,131 +14,129 @@ from matplotlib.ticker import MultipleLocator
 # second plot: Tropopause (200hPa, 10hPa) versus upper stratosphere (10hPa, 1hPa) in the tropics (-30 deg N, 30 deg N)
 # high-top models in red, low-top models in blue, reanalyses in red. 
 
+# reanalysis period and detrending as plotted before the reanalysis cube: records cut to the
+# model period, the first reanalysis of each figure left trended, the others detrended
+REAN_TIME = ('1980-01-01', '2014-01-12')
+SUMMARY_1_DETREND = {'ERA-5.1': False, 'JRA-55': True, 'MERRA-2': True}
+SUMMARY_2_DETREND = {'JRA-55': False, 'MERRA-2': True}
+
+STACK_DIMS = ['source', 'model'] # cube dimensions reduced separately, see cubes.py
+
+# {name: (lat, plev, season)} boxes of the two figures, lat from south to north
+POLE_BOXES = {'npole': (slice(60, 90), slice(500, 1), 'DJF'),
+              'spole': (slice(-90, -60), slice(500, 1), 'JJA')}
+TROPIC_BOXES = {'cold_point': (slice(-30, 30), slice(200, 10), None),
+                'upper_strat': (slice(-30, 30), slice(10, 1), None)}
+
+def box_mean(xrds, lat, plev, season = None, detrend = True):
+    return box(xrds, lat, plev, season, detrend).values
+
+def box(xrds, lat, plev, season = None, detrend = True):
+    # lazy (detrended) seasonal mean, or annual mean for season = None, over a lat/plev box, one
+    # value per source or model of a cube. written as a plan so the box is cut out and averaged
+    # before the time operations
+    label = None if season is None else 'season'
+    by = [dim for dim in STACK_DIMS if dim in xrds.dims]
+    box_plan = [('vars', ['ta']), ('zonal_mean', 'lon')]
+    if detrend:
+        box_plan += [('drop_nan_levels', 'plev', by), ('detrend', 'time', label)] # as detrend_fct
+    if season is None:
+        box_plan.append(('mean', ['time']))
+    else:
+        box_plan += [('group_mean', 'time', 'season'), ('sel', {'season': season})]
+    box_plan += [('sel', {'lat': lat, 'plev': plev}), ('area_mean', 'lat', 'lon'), ('mean', ['plev'])]
+    return run(xrds, box_plan)['ta'].reset_coords(drop = True)
+
 def poles(model):
  # extract poles
-    model = model.sel(plev = slice(500,1))
-    model = seasonal_zonal_mean_detrended(model, 'lon', 'time', 'ta')
-    npole = model.sel(season = 'DJF', lat = slice(60, 90), plev = slice(800,1))
-    npole = area_weighted_mean_2(npole, 'lat')
-    npole = npole.mean(dim = 'plev').variables['ta'].values[0]
+    npole = box_mean(model, slice(60, 90), slice(500, 1), 'DJF')[0]
     print(f'npole: {npole}')
             
-    spole = model.sel(season = 'JJA', lat = slice(-90, -60), plev = slice(800,1))
-    spole = area_weighted_mean_2(spole, 'lat')
-    spole = spole.mean(dim = 'plev').variables['ta'].values[0]
+    spole = box_mean(model, slice(-90, -60), slice(500, 1), 'JJA')[0]
     print(f'spole: {spole}')
 
     return npole, spole
 
 def poles_rean(model, detrend = True):
  # extract poles
-    model = model.sel(plev = slice(500,1))
-    if detrend:
-        model = seasonal_zonal_mean_detrended(model, 'lon', 'time', 'ta')
-    else:
-        model = seasonal_zonal_mean(model, 'lon', 'time', 'ta')
-
     if model.lat[0] < model.lat[1]:
-        npole = model.sel(season = 'DJF', lat = slice(60, 90), plev = slice(500,1))
-        spole = model.sel(season = 'JJA', lat = slice(-90, -60), plev = slice(500,1))
+        npole = box_mean(model, slice(60, 90), slice(500, 1), 'DJF', detrend)
+        spole = box_mean(model, slice(-90, -60), slice(500, 1), 'JJA', detrend)
     else:
-        npole = model.sel(season = 'DJF', lat = slice(90, 60), plev = slice(500,1))
-        spole = model.sel(season = 'JJA', lat = slice(-60, -90), plev = slice(500,1))
-
-    npole = area_weighted_mean_2(npole, 'lat')
-    npole = npole.mean(dim = 'plev').variables['ta'].values
+        npole = box_mean(model, slice(90, 60), slice(500, 1), 'DJF', detrend)
+        spole = box_mean(model, slice(-60, -90), slice(500, 1), 'JJA', detrend)
     print(f'npole: {npole}')
-            
-    spole = area_weighted_mean_2(spole, 'lat')
-    spole = spole.mean(dim = 'plev').variables['ta'].values
     print(f'spole: {spole}')
 
     return npole, spole
 
-def summary_1(hi_model_li, lo_model_li, savename):
+def model_cube(hi_model_li, lo_model_li, time_range = REAN_TIME, overwrite = False):
+    # stacked (model, time, plev, lat) cube of the models (cubes.py) for the years of time_range,
+    # built once and reopened while it covers every requested model (or records it as failed)
+    years = (time_range[0][:4], time_range[1][:4])
+    savename = f'{TIER_DIR}/models_{years[0]}-{years[1]}.nc'
+    requested = list(hi_model_li) + list(lo_model_li)
+    if os.path.exists(savename) and not overwrite:
+        cube = open_model_cube(years, savename)
+        tried = list(cube['model'].values) + list(np.atleast_1d(cube.attrs.get('failed', [])))
+        if set(requested) <= set(tried):
+            print(f'reading model cube... {savename}')
+            return cube.sel(model = [id for id in requested if id in cube['model']], time = slice(*time_range))
+        cube.close()
+    cube = build_model_cube(years, hi_model_li, lo_model_li, savename = savename)
+    return cube.sel(time = slice(*time_range))
+
+def model_boxes(hi_model_li, lo_model_li, boxes, time_range = REAN_TIME):
+    # box means of every model in one compute from the model cube, and their high-top and
+    # low-top composites (cubes.ensemble_stats)
+    cube = model_cube(hi_model_li, lo_model_li, time_range)
+    points = xr.Dataset({name: box(cube, lat, plev, season) for name, (lat, plev, season) in boxes.items()})
+    points = points.assign_coords(top = cube['top']).compute()
+    stats, composites, top_diff = ensemble_stats(points)
+    print(points.to_dataframe())
+    print(f'high-top minus low-top: ' + ', '.join(f'{name} {float(top_diff[name]):.2f}' for name in boxes))
+    cube.close()
+    return points, composites
+
+def plot_models(ax, points, composites, x, y):
+    # every model in its top colour, the high-top and low-top composites as stars
+    for top, color in [('high', 'r'), ('low', 'b')]:
+        members = points.sel(model = points['top'] == top)
+        ax.scatter(members[x], members[y], s = 35, c = color, marker = 'o', alpha = 0.5, label = f'{top}-top')
+        if top in composites['top']:
+            ax.scatter(composites[x].sel(top = top), composites[y].sel(top = top), s = 150, c = color, marker = '*',
+                       edgecolors = 'k', label = f'{top}-top mean')
+
+def lat_box(xrds, lat):
+    # south-to-north latitude slice, reversed for north-to-south grids (JRA-55, ERA-5.1)
+    if xrds['lat'][0] < xrds['lat'][1]:
+        return lat
+    return slice(lat.stop, lat.start)
+
+def rean_boxes(rean_detrend, boxes, time_range = REAN_TIME):
+    # box means of every reanalysis, each averaged on its own latitude grid as before the
+    # reanalysis cube and then stacked along source (cubes.reduce_reans), one compute
+    def reduce(name, rean):
+        rean = rean.sel(time = slice(*time_range))
+        return xr.Dataset({box_name: box(rean, lat_box(rean, lat), plev, season, rean_detrend[name])
+                           for box_name, (lat, plev, season) in boxes.items()})
+    points = reduce_reans(reduce, names = list(rean_detrend))
+    print(points.to_dataframe())
+    return points
+
+def summary_1(hi_model_li, lo_model_li, savename, rean_detrend = SUMMARY_1_DETREND, time_range = REAN_TIME):
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import MultipleLocator
     fig = plt.figure(figsize = (7,5))
     ax = fig.add_subplot()
 
-    # plot reanalyses
-
-    merra2 = xr.open_dataset('/dx02/siw2111/MERRA-2/MERRA-2_TEMP_ALL-TIME.nc4', chunks = 'auto')
-    merra2 = merra2.rename({'lat':'lat', 'lon':'lon', 'lev':'plev', 'time': 'time', 'T':'ta'})
-    merra2 = merra2.sel(plev = slice(1000,1))
-    merra2 = merra2.sortby('time')
-
-    era5 = concat_era()
-    era5 = era5.rename({'latitude':'lat', 'longitude':'lon', 'pressure_level':'plev', 'valid_time': 'time', 't':'ta'})
-
-    jra55 = xr.open_dataset('/dx02/siw2111/JRA-55/JRA-55_T.nc', chunks = 'auto')
-    jra55 = jra55.rename({'g4_lat_2':'lat', 'g4_lon_3':'lon', 'lv_HYBL1':'plev', 'initial_time0_hours': 'time', 'TMP_GDS4_HYBL_S123':'ta'})
-    standard_lev = merra2['plev']
-    jra55 = jra55.interp(plev = standard_lev)
-    lat = jra55.coords['lat']
-    jra55 = jra55.assign_coords(lat = lat.round(1)) # convert from pa to hpa
-    
-    rean_li = [era5, jra55, merra2]
-
-    i = 0
-    for rean in rean_li:
-        print(rean)
-        rean = rean.sel(time = slice('1980-01-01', '2014-01-12'))
-
-        if i == 0:
-            npole, spole = poles_rean(rean, detrend = False)
-            ax.scatter(spole, npole, s = 35, c = 'k', marker = 'o', alpha = 0.5, label = 'reanalysis')
-            print(f'plotted!')
-        else:
-            npole, spole = poles_rean(rean, detrend = True)
-            ax.scatter(spole, npole, s = 35, c = 'k', marker = 'o', alpha = 0.5)
-            print(f'plotted!')
-        i +=1
-        rean.close()
-
-    # plot high-top models
-    i = 0
-    for id in hi_model_li:
-        print(f'{id}')
-        try: 
-            model = pangeo_pull(id, '')
-            model = model.sel(time = slice('1980-01-01', '2014-01-12'))
-            plev = model.coords['plev'].values
-            model = model.assign_coords(plev = np.divide(plev,100).round(1)) # convert from pa to hpa
-            
-            # extract poles
-            npole, spole = poles(model)
-
-            if i == 0:
-                ax.scatter(spole, npole, s = 35, c = 'r', marker = 'o', alpha = 0.5, label = 'high-top')
-            else: 
-                ax.scatter(spole, npole, s = 35, c = 'r', marker = 'o', alpha = 0.5)
-            i+=1
-        except:
-            print(f'unable to plot... {id}')
-        
-        model.close()
+    # plot reanalyses, each averaged on its own grid and reduced in one compute
+    reans = rean_boxes(rean_detrend, POLE_BOXES, time_range)
+    ax.scatter(reans['spole'], reans['npole'], s = 35, c = 'k', marker = 'o', alpha = 0.5, label = 'reanalysis')
 
-    # plot low-top models  
-    i = 0
-    for id in lo_model_li:
-        print(f'{id}')
-        try: 
-            model = pangeo_pull(id, '')
-            model = model.sel(time = slice('1980-01-01', '2014-01-12'))
-            plev = model.coords['plev'].values
-            model = model.assign_coords(plev = np.divide(plev,100).round(1)) # convert from pa to hpa
-            
-            # extract poles
-            npole, spole = poles(model)
-
-            if i == 0:
-                ax.scatter(spole, npole, s = 35, c = 'b', marker = 'o', alpha = 0.5, label = 'low-top')
-            else: 
-                ax.scatter(spole, npole, s = 35, c = 'b', marker = 'o', alpha = 0.5)
-            i+=1
-        except:
-            print(f'unable to plot... {id}')
-        
-        model.close()
+    # plot models, reduced together from the model cube
+    points, composites = model_boxes(hi_model_li, lo_model_li, POLE_BOXES, time_range)
+    plot_models(ax, points, composites, 'spole', 'npole')
           
     plt.title('CMIP6 Models Mean Temperature at the Poles')
     plt.xlabel('S Pole JJA')
@@ -154,129 +153,41 @@ def summary_1(hi_model_li, lo_model_li, savename):
     return
 
 def tropics(model):
-    model = model.sel(plev = slice(200,1))
-    model = model.sel(lat = slice(-30,30))
-    model = annual_zonal_mean_detrended(model, 'lon', 'time', 'ta')
-    
-    cold_point = model.sel(plev = slice(200,10))
-    cold_point = area_weighted_mean_2(cold_point, 'lat')
-    cold_point = cold_point.mean(dim = 'plev').variables['ta'].values[0]
+    cold_point = box_mean(model, slice(-30, 30), slice(200, 10))[0]
     print(f'cold point: {cold_point}')
             
-    upper_strat = model.sel(plev = slice(10,1))
-    upper_strat = area_weighted_mean_2(upper_strat, 'lat')
-    upper_strat = upper_strat.mean(dim = 'plev').variables['ta'].values[0]
+    upper_strat = box_mean(model, slice(-30, 30), slice(10, 1))[0]
     print(f'upper stratosphere: {upper_strat}')
 
     return cold_point, upper_strat
 
 def tropics_rean(model, detrend = True):
-    model = model.sel(plev = slice(200,1))
     if model.lat[0] < model.lat[1]:
-        model = model.sel(lat = slice(-30,30))
+        lat = slice(-30, 30)
     else: 
-        model = model.sel(lat = slice(30, -30))
+        lat = slice(30, -30)
     
-    if detrend:
-        model = annual_zonal_mean_detrended(model, 'lon', 'time', 'ta')
-    else: 
-        model = annual_zonal_mean(model, 'lon', 'time', 'ta')
-    
-    cold_point = model.sel(plev = slice(200,10))
-    cold_point = area_weighted_mean_2(cold_point, 'lat')
-    cold_point = cold_point.mean(dim = 'plev').variables['ta'].values
+    cold_point = box_mean(model, lat, slice(200, 10), detrend = detrend)
     print(f'cold point: {cold_point}')
             
-    upper_strat = model.sel(plev = slice(10,1))
-    upper_strat = area_weighted_mean_2(upper_strat, 'lat')
-    upper_strat = upper_strat.mean(dim = 'plev').variables['ta'].values
+    upper_strat = box_mean(model, lat, slice(10, 1), detrend = detrend)
     print(f'upper stratosphere: {upper_strat}')
 
     return cold_point, upper_strat
 
-def summary_2(hi_model_li, lo_model_li, savename):
+def summary_2(hi_model_li, lo_model_li, savename, rean_detrend = SUMMARY_2_DETREND, time_range = REAN_TIME):
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import MultipleLocator
     fig = plt.figure(figsize = (7,5))
     ax = fig.add_subplot()
 
-    # plot reanalyses
-    '''era5 = concat_era()
-    era5 = era5.rename({'latitude':'lat', 'longitude':'lon', 'pressure_level':'plev', 'valid_time': 'time', 't':'ta'})'''
-
-    merra2 = xr.open_dataset('/dx02/siw2111/MERRA-2/MERRA-2_TEMP_ALL-TIME.nc4', chunks = 'auto')
-    merra2 = merra2.rename({'lat':'lat', 'lon':'lon', 'lev':'plev', 'time': 'time', 'T':'ta'})
-    merra2 = merra2.sel(plev = slice(1000,1))
-    merra2 = merra2.sortby('time')
-
-    jra55 = xr.open_dataset('/dx02/siw2111/JRA-55/JRA-55_T.nc', chunks = 'auto')
-    jra55 = jra55.rename({'g4_lat_2':'lat', 'g4_lon_3':'lon', 'lv_HYBL1':'plev', 'initial_time0_hours': 'time', 'TMP_GDS4_HYBL_S123':'ta'})
-    standard_lev = merra2['plev']
-    jra55 = jra55.interp(plev = standard_lev)
-    lat = jra55.coords['lat']
-    jra55 = jra55.assign_coords(lat = lat.round(1)) # convert from pa to hpa
-    
-    rean_li = [jra55, merra2]
+    # plot reanalyses, each averaged on its own grid and reduced in one compute
+    reans = rean_boxes(rean_detrend, TROPIC_BOXES, time_range)
+    ax.scatter(reans['cold_point'], reans['upper_strat'], s = 35, c = 'k', marker = 'o', alpha = 0.5, label = 'reanalysis')
 
-    i = 0
-    for rean in rean_li:
-        print(rean)
-        rean = rean.sel(time = slice('1980-01-01', '2014-01-12'))
-
-        if i == 0:
-            cold_point, upper_strat = tropics_rean(rean, detrend = False)
-            ax.scatter(cold_point, upper_strat, s = 35, c = 'k', marker = 'o', alpha = 0.5, label = 'reanalysis')
-            print(f'plotted!')
-        else: 
-            cold_point, upper_strat = tropics_rean(rean, detrend = True)
-            ax.scatter(cold_point, upper_strat, s = 35, c = 'k', marker = 'o', alpha = 0.5)
-            print('plotted!')
-        i +=1
-        rean.close()
-
-    # plot high-top models
-    i = 0
-    for id in hi_model_li:
-        print(f'{id}')
-        try: 
-            model = pangeo_pull(id, '')
-            model = model.sel(time = slice('1980-01-01', '2014-01-12'))
-            plev = model.coords['plev'].values
-            model = model.assign_coords(plev = np.divide(plev,100).round(1)) # convert from pa to hpa
-            
-            # extract means
-            cold_point, upper_strat = tropics(model)
-
-            if i == 0:
-                ax.scatter(cold_point, upper_strat, s = 35, c = 'r', marker = 'o', alpha = 0.5, label = 'high-top')
-            else: 
-                ax.scatter(cold_point, upper_strat, s = 35, c = 'r', marker = 'o', alpha = 0.5)
-            i+=1
-        except:
-            print(f'unable to plot... {id}')
-        
-        model.close()
-
-    # plot low-top models  
-    i = 0
-    for id in lo_model_li:
-        print(f'{id}')
-        try: 
-            model = pangeo_pull(id, '')
-            model = model.sel(time = slice('1980-01-01', '2014-01-12'))
-            plev = model.coords['plev'].values
-            model = model.assign_coords(plev = np.divide(plev,100).round(1)) # convert from pa to hpa
-            
-            # extract means
-            cold_point, upper_strat = tropics(model)
-
-            if i == 0:
-                ax.scatter(cold_point, upper_strat, s = 35, c = 'b', marker = 'o', alpha = 0.5, label = 'low-top')
-            else: 
-                ax.scatter(cold_point, upper_strat, s = 35, c = 'b', marker = 'o', alpha = 0.5)
-            i+=1
-        except:
-            print(f'unable to plot... {id}')
-        
-        model.close()
+    # plot models, reduced together from the model cube
+    points, composites = model_boxes(hi_model_li, lo_model_li, TROPIC_BOXES, time_range)
+    plot_models(ax, points, composites, 'cold_point', 'upper_strat')
           
     
     plt.title('CMIP6 Models Temperature Trends in the Tropics')
@@ -293,45 +204,7 @@ def summary_2(hi_model_li, lo_model_li, savename):
     return
 
 if __name__ == '__main__':
-    hi_model_li = ['EC-Earth3',
-                        'EC-Earth3-CC',  
-                        'EC-EARTH3-Veg',
-                        'E3SM-1-1', 
-                        'MRI-ESM2-0',
-                        'IPSL-CM6A-LR',
-                        'GISS-E2-1-H', 
-                        'GISS-E2-1-G',
-                        'INM-CM5-0',
-                        'CESM2-WACCM', 
-                        'MPI-ESM1-2-HR', 
-                        'MPI-ESM1-2-LR',
-                        'IITM-ESM',
-                        'AWI-CM-1-1-MR', 
-                        'ACCESS-CM2',
-                        'KACE-1-0-G', 
-                        'MIROC6'] 
-            
-    lo_model_li = ['ACCESS-ESM1-5',
-                    'BCC-CSM2-MR', 
-                    'CAMS-CSM1-0',
-                    'CanESM5',
-                    'CAS-ESM2-0',
-                    'CESM2',
-                    'CIESM',
-                    'CMCC-CM2-SR5', 
-                    'CMCC-ESM2',
-                    'EC-Earth3-Veg-LR',
-                    'FGOALS-f3-L',
-                    'FGOALS-g3', 
-                    'FIO-ESM-2-0',
-                    'GFDL-CM4',
-                    'GFDL-ESM4', 
-                    'INM-CM4-8',
-                    'KIOST-ESM',
-                    'MIROC-ES2L',
-                    'NESM3',
-                    'NorESM2-LM',
-                    'NorESM2-MM',
-                    'TaiESM1']
+    hi_model_li = HI_MODEL_LI
+    lo_model_li = LO_MODEL_LI
     
     summary_2(hi_model_li, lo_model_li, '/home/siw2111/cmip6_reanalyses_comp/model_plots/05-27-2025/summary_2_trends.png')
\ No newline at end of file
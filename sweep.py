@@ -0,0 +1,135 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import traceback
+from datetime import datetime
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# resumable sweeps over many models. A json manifest records per-model status, outputs and a hash
+# of the inputs, so a rerun after an interruption skips finished models and retries failed ones.
+# the inputs are the parameters and, with source, the identity of the data each model is read
+# from (path and modification time of local files, store and version of remote ones), so a
+# rewritten tier or a new catalog version reruns the model.
+
+# attempts after the first failure, and seconds before the first retry (doubled after each);
+# run_sweep falls back to these when retries or backoff is None
+RETRIES = 2
+BACKOFF = 30
+
+# metadata files rewritten whenever a zarr store is (re)written
+ZARR_METADATA = ['.zmetadata', '.zattrs', '.zgroup', 'zarr.json']
+
+def path_identity(path):
+    # [path, modification time] of a local file or zarr store (its newest metadata file),
+    # glob patterns expand to every file; remote paths (gs://, https://) are kept as they are
+    if '://' in path:
+        return [[path, None]]
+    files = sorted(glob.glob(path)) if glob.has_magic(path) else [path]
+    identity = []
+    for file in files:
+        file = os.path.abspath(file)
+        if os.path.isdir(file):
+            stamps = [os.path.getmtime(os.path.join(file, name)) for name in ZARR_METADATA if os.path.exists(os.path.join(file, name))]
+            identity.append([file, max(stamps, default = os.path.getmtime(file))])
+        elif os.path.exists(file):
+            identity.append([file, os.path.getmtime(file)])
+        else:
+            identity.append([file, None])
+    return identity
+
+def source_identity(source):
+    # source = path, list of paths, or dicts (e.g. {'zstore': ..., 'version': ...}) kept as they are
+    identity = []
+    for item in [source] if isinstance(source, (str, dict)) else source:
+        identity += path_identity(item) if isinstance(item, str) else [item]
+    return identity
+
+def input_hash(id, params, source = None):
+    # hash of everything that determines a model's outputs
+    key = {'id': id, **params}
+    if source is not None:
+        key['source'] = source_identity(source)
+    key = json.dumps(key, sort_keys = True, default = str)
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+def load_manifest(manifest_path):
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    return {'models': {}}
+
+def save_manifest(manifest, manifest_path):
+    # write to a temporary file first so a killed job never leaves a truncated manifest
+    tmp = f'{manifest_path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent = 2)
+    os.replace(tmp, manifest_path)
+
+def is_done(entry, hash):
+    return (entry.get('status') == 'done' and entry.get('input_hash') == hash
+            and all(os.path.exists(path) for path in entry.get('outputs', [])))
+
+def run_sweep(id_li, task, manifest_path, params = {}, retries = None, backoff = None, source = None):
+    # task(id) runs one model and returns a list of output paths, source(id) its input paths
+    # or store identities (see source_identity)
+    retries = RETRIES if retries is None else retries
+    backoff = BACKOFF if backoff is None else backoff
+    manifest = load_manifest(manifest_path)
+    models = manifest['models']
+
+    for id in id_li:
+        try:
+            hash = input_hash(id, params, None if source is None else source(id))
+        except Exception as e:
+            models[id] = {'status': 'failed', 'input_hash': None, 'outputs': [], 'attempts': 0,
+                          'error': f'source {type(e).__name__}: {e}'}
+            print(f'error: {id} failed: {models[id]["error"]}')
+            save_manifest(manifest, manifest_path)
+            continue
+        entry = models.get(id, {})
+        if is_done(entry, hash):
+            print(f'skipping {id}, done at {entry["finished"]}')
+            continue
+
+        entry = {'status': 'running', 'input_hash': hash, 'outputs': [], 'attempts': 0, 'error': None}
+        models[id] = entry
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                wait = backoff * 2 ** (attempt - 1)
+                print(f'retrying {id} in {wait} s (attempt {attempt + 1} of {retries + 1})')
+                time.sleep(wait)
+            entry['attempts'] = attempt + 1
+            save_manifest(manifest, manifest_path)
+
+            print(f'running {id} -----------------------------------------------')
+            start = datetime.now()
+            try:
+                outputs = task(id)
+            except Exception as e:
+                entry['status'] = 'failed'
+                entry['error'] = f'{type(e).__name__}: {e}'
+                entry['traceback'] = traceback.format_exc()
+                print(f'error: {id} failed: {entry["error"]}')
+                continue
+            end = datetime.now()
+            entry.update({'status': 'done', 'outputs': list(outputs or []), 'error': None,
+                          'finished': str(end), 'runtime': str(end - start)})
+            entry.pop('traceback', None)
+            print(f'{id} finished at {end}, runtime: {end - start}')
+            break
+        save_manifest(manifest, manifest_path)
+
+    return failure_report(manifest, id_li)
+
+def failure_report(manifest, id_li = None):
+    models = manifest['models']
+    if id_li is None:
+        id_li = list(models.keys())
+    failed = {id: models[id] for id in id_li if models.get(id, {}).get('status') != 'done'}
+    done = len(id_li) - len(failed)
+    print(f'sweep finished: {done} of {len(id_li)} models done, {len(failed)} failed')
+    for id, entry in failed.items():
+        print(f'  {id}: {entry.get("error")} ({entry.get("attempts", 0)} attempts)')
+    return failed
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from bootstrap import bootstrap_trend, bootstrap_mean, annual_series, seasonal_series
+
+def _white_noise(n = 35, points = 2000, seed = 1):
+    # (point, year) series with no trend and zero mean, so every rejection is a false positive
+    rng = np.random.default_rng(seed)
+    return xr.DataArray(rng.normal(size = (points, n)), dims = ['point', 'year'])
+
+def test_size_at_35_years():
+    # rejections of a true null at alpha = 0.05 and coverage of the 95% interval
+    da = _white_noise()
+    for bootstrap in (bootstrap_trend, bootstrap_mean):
+        stats = bootstrap(da, n_boot = 499)
+        rejected = float((stats['pvalue'] < 0.05).mean())
+        covered = float(((stats['lower'] <= 0) & (stats['upper'] >= 0)).mean())
+        assert 0.035 < rejected < 0.07, (bootstrap.__name__, rejected)
+        assert 0.93 < covered < 0.965, (bootstrap.__name__, covered)
+        # the uncorrected percentile bootstrap is anti-conservative at this length
+        assert float((bootstrap(da, n_boot = 499, small_sample = False)['pvalue'] < 0.05).mean()) > 0.075
+
+def test_missing_points_stay_missing():
+    da = _white_noise(points = 4).copy()
+    da[0] = np.nan
+    stats = bootstrap_trend(da, n_boot = 99)
+    assert stats['pvalue'][0].isnull() and stats['pvalue'][1:].notnull().all()
+
+def test_series_match_groupby():
+    # the segments kernels against the nested groupby they replace, on a record ending mid-year
+    rng = np.random.default_rng(0)
+    time = pd.date_range('1980-01-01', '1985-08-01', freq = 'MS')
+    xrds = xr.Dataset({'ta': (('time', 'plev', 'lat', 'lon'), 250 + rng.normal(0, 2, (len(time), 3, 5, 4)))},
+                      coords = {'time': time, 'plev': [1000., 100., 10.], 'lat': np.linspace(-80, 80, 5), 'lon': np.arange(0, 360, 90.)})
+    zonal = xrds[['ta']].mean(dim = 'lon')
+    annual = zonal.groupby('time.year').mean(dim = 'time')
+    seasonal = zonal.groupby('time.season').map(lambda season: season.groupby('time.year').mean(dim = 'time'))
+    xr.testing.assert_allclose(annual_series(xrds, 'lon', 'time', 'ta').transpose(*annual['ta'].dims), annual)
+    xr.testing.assert_allclose(seasonal_series(xrds, 'lon', 'time', 'ta').transpose(*seasonal['ta'].dims), seasonal)
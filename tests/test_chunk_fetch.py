@@ -0,0 +1,15 @@
+import pytest
+
+pytest.importorskip('zarr')
+
+import chunk_fetch
+
+def test_benchmark():
+    # every remote read path reproduces the local zonal mean; readahead beats sequential reads
+    # and coalescing merges the packed reference reads into fewer requests
+    report = chunk_fetch.benchmark(latency = 0.02, ntime = 24)
+    for name, result in report.items():
+        assert result['error'] == 0, name
+    assert report['sequential']['requests'] >= 24
+    assert report['readahead']['seconds'] < report['sequential']['seconds']
+    assert report['references coalesced']['requests'] < report['references']['requests']
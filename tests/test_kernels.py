@@ -0,0 +1,73 @@
+import os
+import sys
+import subprocess
+import numpy as np
+import pytest
+
+import kernels
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(autouse = True)
+def numba_backend():
+    kernels.set_backend('numba')
+    yield
+    kernels.set_backend('numba')
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_parity(dtype):
+    # numpy and numba kernels against scipy linregress/detrend and xarray's weighted mean
+    pytest.importorskip('scipy')
+    report = kernels.parity_check(dtype)
+    assert set(report) == {'detrend', 'nandetrend', 'slope', 'nanslope', 'weighted_mean', 'nanweighted_mean'}
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_dtype_kept(dtype):
+    y, y_nan, w = kernels._examples((4, 30), dtype = dtype)
+    for backend in ['numpy', 'numba']:
+        if backend == 'numba' and kernels.active_backend() != 'numba':
+            continue
+        assert kernels.kernel('detrend', backend = backend)(y_nan).dtype == dtype
+        assert kernels.kernel('slope', backend = backend)(y_nan).dtype == dtype
+        assert kernels.kernel('weighted_mean', backend = backend)(y_nan, w).dtype == dtype
+
+def test_numpy_fallback():
+    kernels.set_backend('numpy')
+    assert kernels.active_backend() == 'numpy'
+    y, y_nan, w = kernels._examples((4, 30))
+    assert kernels.kernel('slope')(y).shape == (4,)
+
+_CACHE_PROBE = '''
+import sys
+import numpy as np
+import kernels
+assert 'numba' not in sys.modules, 'numba imported with kernels'
+kernels.kernel('slope')(np.arange(10, dtype = np.float64)[None])
+assert 'numba' in sys.modules
+assert set(kernels._COMPILED) == {'slope'}, sorted(kernels._COMPILED)
+'''
+
+def _probe(cache_dir):
+    env = dict(os.environ, NUMBA_CACHE_DIR = str(cache_dir), NUMBA_DEBUG_CACHE = '1')
+    out = subprocess.run([sys.executable, '-c', _CACHE_PROBE], capture_output = True, text = True, cwd = ROOT, env = env)
+    assert out.returncode == 0, out.stderr
+    return out.stdout
+
+def test_lazy_disk_cache(tmp_path):
+    # numba is imported and only the requested kernel compiled on the first call; the first
+    # process writes the machine code to the cache, a new process loads it instead of compiling
+    pytest.importorskip('numba')
+    first = _probe(tmp_path)
+    assert 'data saved to' in first
+    cached = sorted(path.name for path in tmp_path.rglob('*.nbi'))
+    assert cached
+    second = _probe(tmp_path)
+    assert 'data loaded from' in second
+    assert 'data saved to' not in second
+    assert sorted(path.name for path in tmp_path.rglob('*.nbi')) == cached
+
+def test_benchmark():
+    times = kernels.benchmark(shape = (64, 120), repeat = 1)
+    names = {name for name, backend in times}
+    assert names == {'detrend', 'nandetrend', 'slope', 'nanslope', 'weighted_mean', 'nanweighted_mean'}
+    assert all(np.isfinite(seconds) and seconds > 0 for seconds in times.values())
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import climatology
+import trends
+
+def _field(start, stop, seed):
+    # monthly (time, plev, lat, lon) temperatures with a 0.03 K/year trend
+    rng = np.random.default_rng(seed)
+    time = pd.date_range(f'{start}-01-01', f'{stop}-12-01', freq = 'MS')
+    ta = 230 + 0.0025 * np.arange(len(time))[:, None, None, None] + rng.normal(0, 0.5, (len(time), 3, 6, 4))
+    return xr.Dataset({'ta': (('time', 'plev', 'lat', 'lon'), ta)},
+                      coords = {'time': time, 'plev': [1000., 100., 10.], 'lat': np.linspace(-75, 75, 6), 'lon': np.arange(0, 360, 90.)})
+
+@pytest.mark.parametrize('module', [climatology, trends])
+def test_scenario_reaches_open_model(module, monkeypatch):
+    # a historical + ssp245 model record (ingest.open_model) over 1980-2024
+    opened = []
+    def open_model(source_id, institution_id = '', scenario = None):
+        opened.append(scenario)
+        return _field(1950, 2024 if scenario else 2014, 0)
+    monkeypatch.setattr(module, 'open_model', open_model)
+    monkeypatch.setattr(module, 'open_source', lambda name, time_range, resolution = None: _field(*time_range, 1))
+
+    data = module.load_models('CESM2', '', ('1980', '2024'), scenario = 'ssp245')
+    data = data[0] if module is climatology else data
+    assert opened == ['ssp245']
+    annual_model, annual_diff = data[1], data[3]
+    assert annual_model['ta'].notnull().all() and annual_diff['ta'].notnull().all()
+    if module is trends:
+        # the 45-year trend, K/decade
+        assert np.allclose(annual_model['ta'].values, 0.3, atol = 0.05)
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import pangeo_pull
+
+def _region_tier(plev):
+    # (region, time, plev) monthly regional means as stored in the region tier
+    time = pd.date_range('1980-01-01', periods = 36, freq = 'MS')
+    ta = 220 + np.arange(len(plev))[None, None, :] + np.zeros((2, 36, len(plev)))
+    return xr.Dataset({'ta': (('region', 'time', 'plev'), ta)},
+                      coords = {'region': ['global', 'arctic'], 'time': time, 'plev': plev})
+
+def test_region_year_missing_level(monkeypatch):
+    # a model without the 1 hPa level keeps its 10 hPa line, 1 hPa is NaN
+    tiers = {'full': _region_tier([100., 10., 1.]), 'low-top': _region_tier([100., 10.])}
+    monkeypatch.setattr(pangeo_pull, 'open_region', lambda name: tiers[name])
+    full = pangeo_pull.region_year('full', [10, 1], ['global'])
+    low = pangeo_pull.region_year('low-top', [10, 1], ['global'])
+    assert list(low['plev'].values) == [10, 1]
+    xr.testing.assert_equal(low['ta'].sel(plev = 10), full['ta'].sel(plev = 10))
+    assert low['ta'].sel(plev = 1).isnull().all()
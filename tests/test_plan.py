@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy.signal import detrend
+
+import plan
+from summary_figs import box_mean
+
+def _field(seed = 0):
+    # monthly (time, plev, lat, lon) temperatures with a trend; 10 hPa is missing entirely and
+    # 50 hPa at the polar latitudes (as below ground in some reanalyses), so both levels drop
+    rng = np.random.default_rng(seed)
+    time = pd.date_range('1980-01-01', periods = 120, freq = 'MS')
+    plev = np.array([1000, 500, 100, 50, 10, 1], dtype = float)
+    lat = np.linspace(-88.75, 88.75, 72)
+    lon = np.arange(0, 360, 30.)
+    ta = 250 + 0.02 * np.arange(120)[:, None, None, None] + rng.normal(0, 2, (120, 6, 72, 12))
+    ta[:, 4] = np.nan
+    ta[:, 3, :4] = np.nan
+    return xr.Dataset({'ta': (('time', 'plev', 'lat', 'lon'), ta)},
+                      coords = {'time': time, 'plev': plev, 'lat': lat, 'lon': lon})
+
+def _reference(xrds, lat, plev, season):
+    # the original chain: zonal mean, dropna over plev, detrend per season (scipy) keeping the
+    # mean, seasonal mean, box, cos(lat) weighted mean, mean over plev
+    zonal = xrds[['ta']].mean(dim = 'lon').dropna(dim = 'plev', how = 'any')
+    def detrend_fct(group):
+        return group.copy(data = {'ta': detrend(group['ta'].values, axis = 0) + group['ta'].values.mean(axis = 0)})
+    seasonal = zonal.groupby('time.season').map(detrend_fct).groupby('time.season').mean(dim = 'time')
+    box = seasonal.sel(season = season).sel(lat = lat, plev = plev)
+    weights = np.cos(np.deg2rad(box['lat']))
+    return float(box['ta'].weighted(weights).mean(dim = 'lat').mean(dim = 'plev'))
+
+def test_box_mean_drops_nan_levels():
+    # the optimized plan removes the detrend but keeps the level drop: same result as the
+    # original chain on a field with missing levels
+    xrds = _field()
+    for lat, season in [(slice(60, 90), 'DJF'), (slice(-90, -60), 'JJA')]:
+        result = box_mean(xrds, lat, slice(500, 1), season)
+        expected = _reference(xrds, lat, slice(500, 1), season)
+        assert np.allclose(result, expected, rtol = 0, atol = 1e-9), (result, expected)
+
+def test_optimized_plan_keeps_level_drop():
+    box_plan = [('vars', ['ta']), ('zonal_mean', 'lon'), ('drop_nan_levels', 'plev'), ('detrend', 'time', 'season'),
+                ('group_mean', 'time', 'season'), ('sel', {'season': 'DJF'}),
+                ('sel', {'lat': slice(60, 90), 'plev': slice(500, 1)}), ('area_mean', 'lat', 'lon'), ('mean', ['plev'])]
+    optimized = plan.optimize(list(box_plan))
+    kinds = [op[0] for op in optimized]
+    assert 'detrend' not in kinds and 'drop_nan_levels' in kinds
+    # the level subset moves ahead of the drop, the latitude subset does not
+    assert kinds.index('drop_nan_levels') < optimized.index(('sel', {'lat': slice(60, 90)}))
+    assert optimized.index(('sel', {'plev': slice(500, 1)})) < kinds.index('drop_nan_levels')
+
+    xrds = _field(1)
+    result = plan.run(xrds, box_plan)['ta'].values
+    unordered = plan.run(xrds, box_plan, reorder = False)['ta'].values
+    assert np.allclose(result, unordered, rtol = 0, atol = 1e-9)
+    without_drop = plan.run(xrds, [op for op in box_plan if op[0] != 'drop_nan_levels'])['ta'].values
+    assert not np.allclose(result, without_drop, rtol = 0, atol = 1e-9)
+
+def test_box_mean_levels_per_source():
+    # in a stacked cube a level missing in one source is dropped for that source only
+    first = _field(2)
+    second = _field(3)
+    second['ta'][:, 2, :6] = np.nan
+    cube = xr.concat([first, second], dim = 'source').assign_coords(source = ['A', 'B'])
+    stacked = box_mean(cube, slice(60, 90), slice(500, 1), 'DJF')
+    single = [box_mean(first, slice(60, 90), slice(500, 1), 'DJF'), box_mean(second, slice(60, 90), slice(500, 1), 'DJF')]
+    assert np.allclose(stacked, np.array(single), rtol = 0, atol = 1e-9), (stacked, single)
+
+def test_drop_nan_levels_dim_name():
+    # the level dimension is a parameter: MERRA-2 style 'lev' drops the same levels as 'plev'
+    from ncf_funct import drop_nan_levels, detrend_fct, find_trend
+    zonal = _field()[['ta']].mean(dim = 'lon')
+    renamed = zonal.rename({'plev': 'lev'})
+    assert list(drop_nan_levels(renamed, 'lev')['lev'].values) == [1000, 500, 100, 1]
+    for fct in (detrend_fct, find_trend):
+        expected = fct(zonal)['ta'].values
+        np.testing.assert_array_equal(fct(renamed, 'lev')['ta'].values, expected)
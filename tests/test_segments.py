@@ -0,0 +1,13 @@
+import numpy as np
+import pytest
+
+import segments
+
+@pytest.mark.parametrize('stop', ['1983-08', '1983-12', '1984-01', '1984-11'])
+def test_group_trend_against_polyfit(stop):
+    # records ending in every season, so empty (group, year) slots follow some groups
+    segments.check_group_trend('1980-01', stop)
+
+@pytest.mark.parametrize('seed', [1, 2])
+def test_group_trend_seeds(seed):
+    segments.check_group_trend(seed = seed)
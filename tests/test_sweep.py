@@ -0,0 +1,55 @@
+import os
+
+import sweep
+
+def _task(tmp_path, runs, fail = 0):
+    # writes one output per model and counts the runs; fails the first `fail` attempts
+    def task(id):
+        runs.append(id)
+        if len(runs) <= fail:
+            raise OSError('store unavailable')
+        path = tmp_path / f'{id}.out'
+        path.write_text(id)
+        return [str(path)]
+    return task
+
+def test_rewritten_source_reruns(tmp_path):
+    # the same parameters over a rewritten input file invalidate the finished model
+    source = tmp_path / 'CESM2_zonal.nc'
+    source.write_text('v1')
+    manifest, runs = str(tmp_path / 'sweep.json'), []
+    for _ in range(2):
+        sweep.run_sweep(['CESM2'], _task(tmp_path, runs), manifest, params = {'n_boot': 10}, source = lambda id: [str(source)])
+    assert runs == ['CESM2']
+
+    os.utime(source, (os.path.getatime(source), os.path.getmtime(source) + 60))
+    sweep.run_sweep(['CESM2'], _task(tmp_path, runs), manifest, params = {'n_boot': 10}, source = lambda id: [str(source)])
+    assert runs == ['CESM2', 'CESM2']
+
+def test_store_version_reruns(tmp_path):
+    manifest, runs = str(tmp_path / 'sweep.json'), []
+    for version in ['v20190308', 'v20190308', 'v20200101']:
+        store = [{'zstore': 'gs://cmip6/CMIP6/CMIP/NCAR/CESM2/historical/r1i1p1f1/Amon/ta/gn/', 'version': version}]
+        sweep.run_sweep(['CESM2'], _task(tmp_path, runs), manifest, source = lambda id: store)
+    assert runs == ['CESM2', 'CESM2']
+
+def test_backoff(tmp_path, monkeypatch):
+    waits = []
+    monkeypatch.setattr(sweep.time, 'sleep', waits.append)
+    runs = []
+    failed = sweep.run_sweep(['CESM2'], _task(tmp_path, runs, fail = 2), str(tmp_path / 'a.json'), backoff = 1)
+    assert waits == [1, 2] and not failed
+
+    monkeypatch.setattr(sweep, 'BACKOFF', 5)
+    monkeypatch.setattr(sweep, 'RETRIES', 1)
+    waits.clear()
+    runs.clear()
+    failed = sweep.run_sweep(['CESM2'], _task(tmp_path, runs, fail = 2), str(tmp_path / 'b.json'))
+    assert waits == [5] and list(failed) == ['CESM2']
+
+def test_source_failure_is_recorded(tmp_path):
+    def missing(id):
+        raise IndexError(f'{id} is not in the catalog')
+    runs = []
+    failed = sweep.run_sweep(['CESM2'], _task(tmp_path, runs), str(tmp_path / 'sweep.json'), source = missing)
+    assert runs == [] and 'not in the catalog' in failed['CESM2']['error']
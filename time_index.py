@@ -0,0 +1,89 @@
+import numpy as np
+
+# Sylvia Whang siw2111@barnard.edu, Spring 2025
+# calendar-normalized integer time labels. Models come in 360_day, noleap and gregorian calendars
+# as cftime objects; converting once at ingest to integer (year, month, season, season_year)
+# coordinates lets every groupby and time selection run as vectorized integer operations.
+
+SEASONS = np.array(['DJF', 'MAM', 'JJA', 'SON'])
+
+CUM_DAYS = {365: np.cumsum([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30]),
+            366: np.cumsum([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30])}
+
+FIXED_YEAR = {'360_day': 360, 'noleap': 365, '365_day': 365, 'all_leap': 366, '366_day': 366}
+
+UNIT_DAYS = {'days': 1, 'hours': 1 / 24, 'minutes': 1 / 1440, 'seconds': 1 / 86400}
+
+def day_number(year, month, day, calendar):
+    # integer day count since year 0 (fixed-length calendars) or since 1970-01-01 (real calendars)
+    year, month, day = np.asarray(year), np.asarray(month), np.asarray(day)
+    if calendar == '360_day':
+        return (year * 12 + month - 1) * 30 + day - 1
+    if calendar in FIXED_YEAR:
+        length = FIXED_YEAR[calendar]
+        return year * length + CUM_DAYS[length][month - 1] + day - 1
+    months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    return months.astype('datetime64[D]').astype(np.int64) + day - 1
+
+def labels_from_day_number(days, calendar):
+    # (year, month) integer arrays from day_number
+    days = np.floor(days).astype(np.int64)
+    if calendar == '360_day':
+        return days // 360, (days % 360) // 30 + 1
+    if calendar in FIXED_YEAR:
+        length = FIXED_YEAR[calendar]
+        return days // length, np.searchsorted(CUM_DAYS[length], days % length, side = 'right')
+    months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    return months // 12 + 1970, months % 12 + 1
+
+def encoded_time_labels(values, units, calendar = 'standard'):
+    # labels straight from CF-encoded times (decode_times = False), e.g. 'days since 1850-01-01'
+    step, origin = units.split(' since ')
+    date = origin.strip().split(' ')[0].split('T')[0]
+    year, month, day = [int(part) for part in date.split('-')]
+    days = day_number(year, month, day, calendar) + np.asarray(values) * UNIT_DAYS[step.strip()]
+    return labels_from_day_number(days, calendar)
+
+def time_labels(time):
+    # (year, month) integer arrays for a datetime64 or cftime time coordinate
+    values = np.asarray(time)
+    if np.issubdtype(values.dtype, np.datetime64):
+        months = values.astype('datetime64[M]').astype(np.int64)
+        return months // 12 + 1970, months % 12 + 1
+    import cftime
+    calendar = values[0].calendar
+    days = cftime.date2num(values, 'days since 1970-01-01', calendar = calendar)
+    return encoded_time_labels(days, 'days since 1970-01-01', calendar)
+
+def add_time_labels(xrds, time = 'time'):
+    # attach integer year, month, season_id (0 = DJF) and season_year (December counted with
+    # the following JF) plus the season name as coordinates along time
+    year, month = time_labels(xrds[time].values)
+    season_id = (month % 12) // 3
+    season_year = year + (month == 12)
+    return xrds.assign_coords(year = (time, year.astype(np.int32)),
+                              month = (time, month.astype(np.int8)),
+                              season_id = (time, season_id.astype(np.int8)),
+                              season_year = (time, season_year.astype(np.int32)),
+                              season = (time, SEASONS[season_id]))
+
+LABELS = ['year', 'month', 'season_id', 'season_year', 'season']
+
+def load_time_labels(xrds):
+    # labels read back from a file are lazy, groupby needs them in memory
+    return xrds.assign_coords({name: xrds[name].compute() for name in LABELS if name in xrds.coords})
+
+def group_key(xrds, time, label):
+    # integer label coordinate if present, otherwise the datetime accessor
+    if label in xrds.coords and time in xrds[label].dims:
+        if xrds[label].chunks:
+            return xrds[label].compute()
+        return label
+    return f'{time}.{label}'
+
+def select_years(xrds, start, end, time = 'time'):
+    # time selection by integer year labels
+    if 'year' not in xrds.coords:
+        xrds = add_time_labels(xrds, time)
+    mask = (xrds['year'].values >= int(start)) & (xrds['year'].values <= int(end))
+    return xrds.isel({time: mask})
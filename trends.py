@@ -1,41 +1,36 @@
 import xarray as xr
-import matplotlib.pyplot as plt
 import numpy as np
-import cmasher as cmr
-from datetime import datetime
-from pangeo_pull import pangeo_pull
-from ncf_funct import difference, find_trend
-from dask.diagnostics import ProgressBar
+from ncf_funct import find_trend, zonal_mean, coarsen_lat, drop_nan_levels
+from cubes import stack_seasons, difference_matrix
+from ingest import open_source, open_model, model_name, source_paths, HI_MODEL_LI, LO_MODEL_LI
+from time_index import select_years
+from bootstrap import trend_significance, stipple
+from sweep import run_sweep
+from segments import group_trend
+from reanalyses_plots import variable_list
 
 # plots to compare model and reanalysis trends. As seen in Figures 58-95 of phonebook.
 
-def seasonal_zonal_trend(xrds, lon, time, variable):
+def seasonal_zonal_trend(xrds, lon, time, variable, resolution = None, plev = 'plev'):
     print(f'finding seasonal trends...')
-    xrds = xrds[[variable]]
-    xrds = xrds.mean(dim = lon)
-    seasonal_xrds = xrds.groupby(f"{time}.season").map(find_trend)    
+    xrds = xrds[variable_list(variable)]
+    xrds = coarsen_lat(zonal_mean(xrds, lon), resolution)
+    xrds = drop_nan_levels(xrds, plev)
+    seasonal_xrds = group_trend(xrds, time, 'season') * 10 # K/decade, all seasons in one pass
     return seasonal_xrds
 
-def annual_zonal_trend(xrds, lon, time, variable):
+def annual_zonal_trend(xrds, lon, time, variable, resolution = None, plev = 'plev'):
     print(f'finding annual trend...')
-    xrds = xrds[[variable]]
-    xrds = xrds.mean(dim = lon)
-    xrds = find_trend(xrds)
+    xrds = xrds[variable_list(variable)]
+    xrds = coarsen_lat(zonal_mean(xrds, lon), resolution)
+    xrds = find_trend(xrds, plev)
     return xrds
 
-def load_models(source_id, institution_id, time_range:tuple):
+def load_models(source_id, institution_id, time_range:tuple, resolution = None, n_boot = 0, seed = 0, scenario = None):
+    # n_boot > 0 adds block-bootstrap p-values for the trend and difference panels
+    # scenario = 'ssp245' etc. continues the historical run past 2014 (ingest.open_model)
     # load model
-    time_slice = slice(f'{time_range[0]}-01-01', f'{time_range[1]}-12-01')
-
-    model_xrds = pangeo_pull(source_id, institution_id)
-
-    model_xrds =model_xrds.sel(time = time_slice)
-
-    model_xrds = model_xrds.sel(member_id = 'r1i1p1f1')
-    plev = model_xrds.coords['plev'].values
-    model_xrds = model_xrds.assign_coords(plev  = np.divide(plev,100).round(2))
-    model_xrds = model_xrds.sel(plev = slice(1000,1))
-    model_xrds = model_xrds.mean(dim = ['dcpp_init_year'])
+    model_xrds = select_years(open_model(source_id, institution_id, scenario), *time_range)
 
     '''# load JRA-55 reanalysis
     rean_xrds = xr.open_dataset('/dx02/siw2111/JRA-55/JRA-55_T.nc', chunks = 'auto')
@@ -48,38 +43,38 @@ def load_models(source_id, institution_id, time_range:tuple):
     
     rean_xrds = rean_xrds.sel(time = time_slice)'''
 
-    # load MERRA-2 reanalysis
-    rean_xrds = xr.open_dataset('/dx02/siw2111/MERRA-2/MERRA-2_TEMP_ALL-TIME.nc4', chunks = 'auto')
-    rean_xrds = rean_xrds.rename({'lat':'lat', 'lon':'lon', 'lev':'plev', 'time': 'time', 'T':'ta'})
-    rean_xrds = rean_xrds.sel(plev = slice(1000,1))
-    rean_xrds = rean_xrds.sortby('time')
-    
-    rean_xrds = rean_xrds.sel(time = time_slice)
+    # load MERRA-2 reanalysis (zonal-mean tier if built)
+    rean_xrds = open_source('MERRA-2', time_range, resolution = resolution)
 
     # group annually and seasonally
-    annual_model = annual_zonal_trend(model_xrds, 'lon', 'time', 'ta')
-    seasonal_model = seasonal_zonal_trend(model_xrds, 'lon', 'time', 'ta')
+    annual_model = annual_zonal_trend(model_xrds, 'lon', 'time', 'ta', resolution)
+    seasonal_model = seasonal_zonal_trend(model_xrds, 'lon', 'time', 'ta', resolution)
 
-    annual_rean = annual_zonal_trend(rean_xrds, 'lon', 'time', 'ta')
-    seasonal_rean = seasonal_zonal_trend(rean_xrds, 'lon', 'time', 'ta')
+    annual_rean = annual_zonal_trend(rean_xrds, 'lon', 'time', 'ta', resolution)
+    seasonal_rean = seasonal_zonal_trend(rean_xrds, 'lon', 'time', 'ta', resolution)
 
     print('computing difference...')
-    xrds_li = [(annual_model, annual_rean), (seasonal_model, seasonal_rean)]
-    diff_li = []
+    # annual and seasonal trend differences in one broadcast (cubes.py)
+    model = stack_seasons(annual_model, seasonal_model).expand_dims(model = [source_id])
+    rean = stack_seasons(annual_rean, seasonal_rean).expand_dims(source = ['MERRA-2'])
+    diff = difference_matrix(model, rean).isel(model = 0, reanalysis = 0, drop = True)
+    annual_diff = diff.sel(season = 'ANN', drop = True)
+    seasonal_diff = diff.sel(season = ['DJF', 'MAM', 'JJA', 'SON'])
 
-    for model, rean in xrds_li:
-        diff = difference(model, rean)
-        diff_li.append(diff)
+    sig = None
+    if n_boot:
+        print(f'bootstrapping significance ({n_boot} replicates)...')
+        sig = trend_significance(model_xrds, rean_xrds, 'lon', 'time', 'ta', n_boot = n_boot, seed = seed)
 
-    annual_diff = diff_li[0] 
-    seasonal_diff = diff_li[1] 
-
-    data = (source_id, annual_model, annual_rean, annual_diff, seasonal_model, seasonal_rean, seasonal_diff)
+    data = (source_id, annual_model, annual_rean, annual_diff, seasonal_model, seasonal_rean, seasonal_diff, sig)
 
     return data
     
 def plot_trend(data, savename, time_range):
-    model, annual_model, annual_rean, annual_diff, seasonal_model, seasonal_rean, seasonal_diff = data
+    import matplotlib.pyplot as plt
+    import cmasher as cmr
+    from dask.diagnostics import ProgressBar
+    model, annual_model, annual_rean, annual_diff, seasonal_model, seasonal_rean, seasonal_diff, sig = data
     fig, axes = plt.subplots(nrows = 5, ncols = 2, figsize = (18, 20), 
                              sharex = False, sharey = False, layout = 'constrained')
 
@@ -117,6 +112,8 @@ def plot_trend(data, savename, time_range):
             xlim = (-89, 89),
             ax = axes[0,0])
     plt.clabel(cs, cs.levels, fontsize=10)
+    if sig is not None:
+        stipple(sig['annual_model']['pvalue'], axes[0,0])
     annual_model.close()
 
     axes[0,0].set_ylabel('Pressure, hPa', fontsize = 15, fontweight = "medium")
@@ -156,6 +153,8 @@ def plot_trend(data, savename, time_range):
             xlim = (-89, 89),
             ax = axes[i + 1, 0])
         plt.clabel(cs, cs.levels, fontsize=10)
+        if sig is not None:
+            stipple(sig['seasonal_model']['pvalue'].sel(season = season), axes[i + 1, 0])
         seasonal_model.close()
 
         axes[i+1, 0].set_ylabel('Pressure, hPa', fontsize = 15, fontweight = "medium")
@@ -197,6 +196,8 @@ def plot_trend(data, savename, time_range):
             xlim = (-89, 89),
             ax = axes[0,1])
     plt.clabel(cs, cs.levels, fontsize=10)
+    if sig is not None:
+        stipple(sig['annual_diff']['pvalue'], axes[0,1])
     annual_diff.close()
     axes[0,1].set_title('Difference from MERRA-2 \nAnnual', fontsize = 15, fontweight = "medium")
 
@@ -232,6 +233,8 @@ def plot_trend(data, savename, time_range):
             xlim = (-89, 89),
             ax = axes[i + 1, 1])
         plt.clabel(cs, cs.levels, fontsize=10)
+        if sig is not None:
+            stipple(sig['seasonal_diff']['pvalue'].sel(season = season), axes[i + 1, 1])
         seasonal_diff.close()
 
         axes[i+1,1].set_title(season, fontsize = 15, fontweight = "medium")
@@ -245,23 +248,18 @@ def plot_trend(data, savename, time_range):
     plt.close()
 
 if __name__ == '__main__':
-    lo_model_li = ['ACCESS-ESM1-5','BCC-CSM2-MR', 'CAMS-CSM1-0','CanESM5','CAS-ESM2-0','CESM2', 'CIESM','CMCC-CM2-SR5', 'CMCC-ESM2', 'EC-Earth3-Veg-LR','FGOALS-f3-L', 'FGOALS-g3',
-'FIO-ESM-2-0', 'GFDL-CM4', 'GFDL-ESM4', 'INM-CM4-8', 'KIOST-ESM', 'MIROC-ES2L','NESM3', 'NorESM2-LM','NorESM2-MM ','TaiESM1' ]
-    model_li = ['CESM2-WACCM', 'ACCESS-CM2', 'AWI-CM-1-1-MR' , 'GISS-E2-1-G', 'GISS-E2-1-H','IITM-ESM','MIROC6', 'MPI-ESM1-2-HR', 'MPI-ESM1-2-LR', 'MRI-ESM2-0', 'E3SM-1-1', 'EC-Earth3','EC-Earth3-CC', 'EC-Earth3-Veg', 'INM-CM5-0', 'IPSL-CM6A-LR' , 'KACE-1-0-G']
-    model_li = model_li + lo_model_li
-    for model in model_li:
-        for time_range in [('1980','2014')]:
-            print(f'plotting... {model} -----------------------------------------------')
-            try:
-                start = datetime.now()
+    model_li = HI_MODEL_LI + LO_MODEL_LI
+    time_range = ('1980','2014')
+    scenario = None # e.g. 'ssp245' with time_range = ('1980', '2024')
+    plot_dir = '/home/siw2111/cmip6_reanalyses_comp/model_plots/05-21-2025'
+
+    def trend_task(model):
+        data = load_models(model, '', time_range, n_boot = 1000, scenario = scenario)
+        savename = f'{plot_dir}/{model_name(model, scenario)}_trend_{time_range[0]}-{time_range[1]}_MERRA2.png'
+        plot_trend(data, savename, time_range)
+        return [savename]
 
-                data, maximum, minimum = load_models(model, '', time_range)
-                savename = f'/home/siw2111/cmip6_reanalyses_comp/model_plots/05-21-2025/{model}_trend_{time_range[0]}-{time_range[1]}_MERRA2.png'
-                plot_trend(data, savename, time_range)
-                model.close()
-                
-                end = datetime.now()
-                print(f'{model} finished at {end}, runtime: {end - start}')
-            except:
-                print(f'error: unable to plot {model}')
-                continue
+    # rerunning skips models already plotted, see sweep.py
+    run_sweep(model_li, trend_task, f'{plot_dir}/trend_sweep.json',
+              params = {'time_range': time_range, 'rean': 'MERRA-2', 'n_boot': 1000, 'scenario': scenario},
+              source = lambda model: source_paths(model_name(model, scenario), tier = False) + source_paths('MERRA-2'))